@@ -12,6 +12,7 @@ from helpers import (
     read_stats,
     write_stats,
 )
+from fingerprint import tag_stats
 from storage import Storage, StorageKind
 
 
@@ -86,7 +87,7 @@ def benchmark_sgx_io(storage: Storage, stats: Dict[str, List], x86_acc: bool = F
 
        
 def main() -> None:
-    stats = read_stats("aesni.json")
+    stats = read_stats("aesni.jsonl")
     storage = Storage(create_settings())
 
     if "x86_acc" not in stats["type"]:
@@ -97,7 +98,8 @@ def main() -> None:
         benchmark_sgx_io(storage, stats, x86_acc=False)
     else:
         print("skip no_x86_acc")
-    write_stats("aesni.json", stats)
+    tag_stats(stats, storage.settings)
+    write_stats("aesni.jsonl", stats)
 
     csv = f"aesni-{NOW}.tsv"
     print(csv)
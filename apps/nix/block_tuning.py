@@ -0,0 +1,125 @@
+import os
+import sys
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from helpers import run
+from result_store import Stats
+
+
+@dataclass(frozen=True)
+class QueueProfile:
+    name: str
+    # /sys/block/<dev>/queue/<tunable> values, applied in this order since
+    # the range of nr_requests depends on the scheduler
+    tunables: Tuple[Tuple[str, str], ...]
+
+
+PROFILES = {
+    p.name: p
+    for p in [
+        # whatever the host booted with
+        QueueProfile("booted", ()),
+        QueueProfile(
+            "none-deep-noreadahead",
+            (
+                ("scheduler", "none"),
+                ("nr_requests", "1023"),
+                ("read_ahead_kb", "0"),
+                ("rq_affinity", "2"),
+                ("nomerges", "0"),
+            ),
+        ),
+        QueueProfile(
+            "mq-deadline",
+            (("scheduler", "mq-deadline"), ("nr_requests", "256"), ("read_ahead_kb", "128")),
+        ),
+        QueueProfile(
+            "kyber-noreadahead",
+            (("scheduler", "kyber"), ("read_ahead_kb", "0"), ("rq_affinity", "2")),
+        ),
+    ]
+}
+
+
+# read back after applying any profile, so that rows of all profiles show them
+TUNABLES = list(dict.fromkeys(t for p in PROFILES.values() for t, _ in p.tunables))
+
+
+def queue_profiles() -> List[QueueProfile]:
+    """Profiles to sweep, i.e. QUEUE_PROFILES=booted,none-deep-noreadahead"""
+    names = os.environ.get("QUEUE_PROFILES", "booted").split(",")
+    unknown = [n for n in names if n not in PROFILES]
+    if unknown:
+        raise RuntimeError(f"unknown queue profiles {unknown}, choose from {list(PROFILES)}")
+    return [PROFILES[n] for n in names]
+
+
+def queue_path(device: str, tunable: str) -> str:
+    return f"/sys/block/{os.path.basename(device)}/queue/{tunable}"
+
+
+def read_tunable(device: str, tunable: str) -> str:
+    with open(queue_path(device, tunable)) as f:
+        value = f.read().strip()
+    if tunable == "scheduler":
+        # "[mq-deadline] kyber none"
+        for scheduler in value.split():
+            if scheduler.startswith("["):
+                return scheduler.strip("[]")
+    return value
+
+
+def write_tunable(device: str, tunable: str, value: str) -> bool:
+    cmd = ["sudo", "sh", "-c", 'echo "$0" > "$1"', value, queue_path(device, tunable)]
+    return run(cmd, check=False).returncode == 0
+
+
+class QueueTuning:
+    """
+    Applies a profile to the queue of a block device and restores the
+    previous values afterwards.
+    """
+
+    def __init__(self, device: str, profile: QueueProfile) -> None:
+        self.device = device
+        self.profile = profile
+        self.previous: List[Tuple[str, str]] = []
+        self.actual: Dict[str, str] = {}
+
+    def apply(self) -> None:
+        self.previous = []
+        for tunable, value in self.profile.tunables:
+            old = read_tunable(self.device, tunable)
+            if not write_tunable(self.device, tunable, value):
+                print(
+                    f"{self.device}: cannot set {tunable}={value} for {self.profile.name}",
+                    file=sys.stderr,
+                )
+                continue
+            self.previous.append((tunable, old))
+        # the kernel may clamp values, i.e. nr_requests to the hardware queue depth
+        self.actual = {t: read_tunable(self.device, t) for t in TUNABLES}
+        print(f"{self.device}: queue profile {self.profile.name}: {self.actual}")
+
+    def restore(self) -> None:
+        for tunable, value in reversed(self.previous):
+            write_tunable(self.device, tunable, value)
+        self.previous = []
+
+
+def tag_queue_profile(stats: Stats, profile: QueueProfile, tuning: Optional[QueueTuning]) -> None:
+    """
+    Tags the following rows with the profile and the values read back from
+    sysfs; without tuning (SPDK) the kernel block layer is not involved.
+    """
+    actual = None if tuning is None else dict(tuning.actual)
+    for tunable, value in profile.tunables:
+        if actual is not None and actual.get(tunable) != value:
+            print(
+                f"queue profile {profile.name}: {tunable} is "
+                f"{actual.get(tunable)!r} instead of {value!r}",
+                file=sys.stderr,
+            )
+    stats.tags["queue-profile"] = profile.name
+    stats.tags["queue-tunables"] = actual
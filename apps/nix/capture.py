@@ -0,0 +1,172 @@
+import gzip
+import json
+import os
+import queue
+import re
+import subprocess
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import IO, Any, Deque, Iterable, Iterator, List, Optional, Tuple
+
+# Print captured lines as they arrive; off by default because it competes
+# with the benchmark for CPU.
+ECHO = os.environ.get("CAPTURE_ECHO", "0") == "1"
+
+
+class Parser(ABC):
+    """
+    Incremental parser fed with one output line at a time (without the
+    trailing newline). Returns the samples completed by this line.
+    """
+
+    stream = "stdout"
+
+    @abstractmethod
+    def feed(self, line: str) -> Iterable[Any]:
+        ...
+
+
+class JsonBlockParser(Parser):
+    """Pretty-printed json objects, i.e. fio --output-format=json"""
+
+    def __init__(self) -> None:
+        self.lines: Optional[List[str]] = None
+
+    def feed(self, line: str) -> Iterable[Any]:
+        if line == "{":
+            self.lines = []
+        if self.lines is None:
+            return []
+        self.lines.append(line)
+        if line != "}":
+            return []
+        data, self.lines = "\n".join(self.lines), None
+        return [json.loads(data)]
+
+
+class TaggedParser(Parser):
+    """One json object per line between <tag> and </tag>"""
+
+    def __init__(self, tag: str) -> None:
+        self.start = f"<{tag}>"
+        self.end = f"</{tag}>"
+        self.inside = False
+
+    def feed(self, line: str) -> Iterable[Any]:
+        if line == self.start:
+            self.inside = True
+        elif line == self.end:
+            self.inside = False
+        elif self.inside:
+            return [json.loads(line)]
+        return []
+
+
+class RegexParser(Parser):
+    """Emits the match object for every matching line"""
+
+    def __init__(self, pattern: str) -> None:
+        self.pattern = re.compile(pattern)
+
+    def feed(self, line: str) -> Iterable[Any]:
+        match = self.pattern.match(line)
+        return [match] if match else []
+
+
+Line = Tuple[float, str, str]
+
+
+class Capture:
+    """
+    Tees the stdout/stderr pipes of a process into a ring buffer and a gzip
+    compressed log file. Every line is stamped with the monotonic time since
+    the capture started and fed to the parsers; their samples can be
+    consumed with samples() while the process is still running.
+    """
+
+    def __init__(
+        self,
+        proc: subprocess.Popen,
+        log_path: str,
+        parsers: List[Parser] = [],
+        ring_size: int = 1000,
+    ) -> None:
+        self.proc = proc
+        self.log_path = log_path
+        self.parsers = parsers
+        self.lines: Deque[Line] = deque(maxlen=ring_size)
+        self.start = time.monotonic()
+        self._samples: "queue.Queue[Optional[Tuple[float, Any]]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self._log: Optional[IO[str]] = None
+
+    def __enter__(self) -> "Capture":
+        self._log = gzip.open(self.log_path, "wt")
+        print(f"capture output to {self.log_path}")
+        for name in ["stdout", "stderr"]:
+            pipe = getattr(self.proc, name)
+            if pipe is None:
+                continue
+            thread = threading.Thread(target=self._read, args=(name, pipe), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def _read(self, stream: str, pipe: IO[str]) -> None:
+        parsers = [p for p in self.parsers if p.stream == stream]
+        try:
+            for line in pipe:
+                line = line.rstrip("\n")
+                now = time.monotonic() - self.start
+                with self._lock:
+                    self.lines.append((now, stream, line))
+                    if self._log is not None:
+                        self._log.write(f"{now:.6f}\t{stream}\t{line}\n")
+                if ECHO:
+                    print(f"{stream}: {line}")
+                for parser in parsers:
+                    # keep draining the pipe even if a parser chokes
+                    try:
+                        for sample in parser.feed(line):
+                            self._samples.put((now, sample))
+                    except ValueError as e:
+                        print(f"{type(parser).__name__}: {e}", file=sys.stderr)
+        finally:
+            self._samples.put(None)
+
+    def samples(self, timeout: Optional[float] = None) -> Iterator[Tuple[float, Any]]:
+        """
+        Yields (timestamp, sample) until all pipes are closed or, if given,
+        no sample arrived for timeout seconds
+        """
+        open_streams = len(self._threads)
+        while open_streams > 0:
+            try:
+                item = self._samples.get(timeout=timeout)
+            except queue.Empty:
+                return
+            if item is None:
+                open_streams -= 1
+            else:
+                yield item
+
+    def tail(self, n: int = 20) -> List[Line]:
+        with self._lock:
+            return list(self.lines)[-n:]
+
+    def print_tail(self, n: int = 20) -> None:
+        for now, stream, line in self.tail(n):
+            print(f"[{now:9.3f}] {stream}: {line}", file=sys.stderr)
+
+    def __exit__(self, *args: Any) -> None:
+        # the process has been stopped at this point, so its pipes close soon
+        for thread in self._threads:
+            thread.join(timeout=5)
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
@@ -24,6 +24,7 @@ from helpers import (
     read_stats,
     write_stats
 )
+from fingerprint import tag_stats
 from storage import Storage, StorageKind
 
 def benchmark_dd(
@@ -77,7 +78,7 @@ def benchmark_sgx_io_dd(storage: Storage, stats: Dict[str, List]) -> None:
     benchmark_dd(storage, "sgx-io", "dd-sgx-io", "/dev/spdk0", stats)
 
 def main() -> None:
-    stats = read_stats("dd.json")
+    stats = read_stats("dd.jsonl")
     settings = create_settings()
     storage = Storage(settings)
 
@@ -95,7 +96,8 @@ def main() -> None:
             print(f"skip {name} benchmark")
             continue
         benchmark(storage, stats)
-        write_stats("dd.json", stats)
+        tag_stats(stats, settings)
+        write_stats("dd.jsonl", stats)
 
     csv = f"dd-test-{NOW}.tsv"
     df = pd.DataFrame(stats)
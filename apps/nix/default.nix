@@ -291,6 +291,25 @@ in {
     command = [ "bin/latency-test" ];
   };
 
+  latency-test-sgx-io = runImage {
+    pkg = latency-test;
+    command = [ "bin/latency-test" ];
+  };
+
+  latency-test-sgx-lkl = runImage {
+    pkg = latency-test;
+    command = [ "bin/latency-test" ];
+    sgx-lkl-run = "${sgx-lkl}/bin/sgx-lkl-run";
+  };
+
+  latency-test-native = runImage {
+    pkg = latency-test;
+    native = true;
+    command = [ "bin/latency-test" ];
+  };
+
+  latency-test-client = latency-test;
+
   memcpy-test-sgx-io = runImage {
     pkg = memcpy-test;
     command = [ "bin/memcpy-test" "0"];
@@ -388,6 +407,8 @@ in {
 
   iperf-client = iperf3;
 
+  udp-pps-client = simpleio-musl;
+
   iproute = runImage {
     pkg = pkgsMusl.iproute;
     command = [ "bin/ip" "a" ];
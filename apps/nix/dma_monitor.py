@@ -0,0 +1,290 @@
+"""
+Samples the physical layout of the DPDK/SPDK DMA memory of a running
+sgx-lkl-run: the hugetlbfs mappings are resolved to physical frames through
+/proc/PID/pagemap (as src/sgx-lkl-virt2phy does) and summarized as
+contiguity, NUMA node and page size statistics, one JSON line per sample.
+
+Physical frame numbers are only visible to root:
+
+    sudo python3 dma_monitor.py PID [--name sgx-lkl-run] [--interval 1]
+
+Benchmark drivers enable it with DMA_MONITOR=1; samples end up in
+dma-monitor.jsonl.
+"""
+
+import argparse
+import glob
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from result_store import ResultStore
+
+ENABLED = os.environ.get("DMA_MONITOR", "0") == "1"
+INTERVAL = float(os.environ.get("DMA_MONITOR_INTERVAL", "1"))
+DMA_STORE = "dma-monitor.jsonl"
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+# see Documentation/admin-guide/mm/pagemap.rst
+PFN_MASK = (1 << 55) - 1
+PAGE_PRESENT = 1 << 63
+# page sizes an IOMMU can map with a single IOTLB entry
+IOTLB_PAGE_SIZES = [1 << 30, 1 << 21, 1 << 12]
+
+
+@dataclass
+class Mapping:
+    start: int
+    end: int
+    path: str
+    page_size: int
+
+
+def hugetlbfs_mounts() -> List[str]:
+    mounts = []
+    with open("/proc/mounts") as f:
+        for line in f:
+            _, mountpoint, fstype = line.split()[:3]
+            if fstype == "hugetlbfs":
+                mounts.append(mountpoint.rstrip("/") + "/")
+    return mounts
+
+
+def dma_mappings(pid: int) -> List[Mapping]:
+    """Mappings of files in hugetlbfs, i.e. rtemap_* of DPDK and SPDK"""
+    mounts = hugetlbfs_mounts()
+    mappings: List[Mapping] = []
+    current: Optional[Mapping] = None
+    with open(f"/proc/{pid}/smaps") as f:
+        for line in f:
+            fields = line.split()
+            if "-" in fields[0] and not fields[0].endswith(":"):
+                # 7f2c40000000-7f2c80000000 rw-s 00000000 00:2f 123 /dev/hugepages/rtemap_0
+                current = None
+                path = fields[5] if len(fields) > 5 else ""
+                if any(path.startswith(m) for m in mounts):
+                    start, end = (int(a, 16) for a in fields[0].split("-"))
+                    current = Mapping(start, end, path, PAGE_SIZE)
+                    mappings.append(current)
+            elif current is not None and fields[0] == "KernelPageSize:":
+                current.page_size = int(fields[1]) * 1024
+    return mappings
+
+
+def memory_block_nodes() -> Tuple[int, Dict[int, int]]:
+    """Size of a memory block and the node of each block"""
+    with open("/sys/devices/system/memory/block_size_bytes") as f:
+        block_size = int(f.read().strip(), 16)
+    nodes = {}
+    for path in glob.glob("/sys/devices/system/node/node*/memory[0-9]*"):
+        node = int(path.split("/")[-2][len("node"):])
+        nodes[int(os.path.basename(path)[len("memory"):])] = node
+    return block_size, nodes
+
+
+def physical_pages(pagemap: int, mapping: Mapping) -> Iterator[Tuple[int, Optional[int]]]:
+    """(virtual, physical) address of every page; physical is None if not present"""
+    for virt in range(mapping.start, mapping.end, mapping.page_size):
+        entry = int.from_bytes(os.pread(pagemap, 8, (virt // PAGE_SIZE) * 8), "little")
+        pfn = entry & PFN_MASK
+        if entry & PAGE_PRESENT and pfn != 0:
+            yield virt, pfn * PAGE_SIZE
+        else:
+            yield virt, None
+
+
+def iotlb_entries(start: int, length: int) -> int:
+    """Minimal number of naturally aligned IOMMU pages covering the range"""
+    entries = 0
+    end = start + length
+    while start < end:
+        for size in IOTLB_PAGE_SIZES:
+            if start % size == 0 and start + size <= end:
+                break
+        start += size
+        entries += 1
+    return entries
+
+
+def sample(pid: int) -> Dict[str, Any]:
+    mappings = dma_mappings(pid)
+    block_size, block_nodes = memory_block_nodes()
+
+    page_sizes: Dict[str, int] = {}
+    nodes: Dict[str, int] = {}
+    pages = present = 0
+    # physically and virtually contiguous runs as (physical start, length)
+    runs: List[Tuple[int, int]] = []
+    last_virt = last_phys = None
+
+    fd = os.open(f"/proc/{pid}/pagemap", os.O_RDONLY)
+    try:
+        for mapping in mappings:
+            key = str(mapping.page_size)
+            for virt, phys in physical_pages(fd, mapping):
+                pages += 1
+                page_sizes[key] = page_sizes.get(key, 0) + 1
+                if phys is None:
+                    last_virt = last_phys = None
+                    continue
+                present += 1
+                node = str(block_nodes.get(phys // block_size, -1))
+                nodes[node] = nodes.get(node, 0) + 1
+                if virt == last_virt and phys == last_phys and runs:
+                    start, length = runs[-1]
+                    runs[-1] = (start, length + mapping.page_size)
+                else:
+                    runs.append((phys, mapping.page_size))
+                last_virt = virt + mapping.page_size
+                last_phys = phys + mapping.page_size
+    finally:
+        os.close(fd)
+
+    total = sum(length for _, length in runs)
+    largest = max((length for _, length in runs), default=0)
+    return dict(
+        time=time.time(),
+        pid=pid,
+        mappings=len(mappings),
+        pages=pages,
+        present=present,
+        page_sizes=page_sizes,
+        nodes=nodes,
+        bytes=total,
+        runs=len(runs),
+        largest_run=largest,
+        # 0 if all memory is one contiguous run, close to 1 if no two pages are adjacent
+        fragmentation=(len(runs) - 1) / (present - 1) if present > 1 else 0.0,
+        iotlb_entries=sum(iotlb_entries(start, length) for start, length in runs),
+    )
+
+
+def children(pid: int) -> List[int]:
+    pids = []
+    for path in glob.glob(f"/proc/{pid}/task/*/children"):
+        with open(path) as f:
+            pids.extend(int(p) for p in f.read().split())
+    return pids
+
+
+def find_process(root: int, name: str) -> Optional[int]:
+    """root itself or its first descendant with the given command name"""
+    todo = [root]
+    while todo:
+        pid = todo.pop(0)
+        try:
+            with open(f"/proc/{pid}/comm") as f:
+                if f.read().strip() == name[:15]:
+                    return pid
+            todo.extend(children(pid))
+        except OSError:
+            continue
+    return None
+
+
+def monitor(root: int, name: str, interval: float) -> None:
+    running = True
+
+    def stop(*args: Any) -> None:
+        nonlocal running
+        running = False
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    pid = None
+    while running and os.path.exists(f"/proc/{root}"):
+        if pid is None:
+            pid = find_process(root, name)
+        if pid is not None:
+            try:
+                record = sample(pid)
+            except OSError:  # process exited
+                break
+            # DMA memory is allocated during startup
+            if record["mappings"] > 0:
+                print(json.dumps(record), flush=True)
+        time.sleep(interval)
+
+
+class DmaMonitor:
+    """
+    Runs this file as root in the background while the benchmark process is
+    alive and stores its samples, tagged with name, in DMA_STORE.
+    """
+
+    def __init__(self, pid: int, name: str, interval: float = INTERVAL) -> None:
+        self.pid = pid
+        self.name = name
+        self.interval = interval
+        self.samples: List[Dict[str, Any]] = []
+        self.proc: Optional[subprocess.Popen] = None
+        self.thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> "DmaMonitor":
+        cmd = ["sudo", sys.executable, os.path.abspath(__file__), str(self.pid)]
+        cmd += ["--interval", str(self.interval)]
+        self.proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+        self.thread = threading.Thread(target=self._read, daemon=True)
+        self.thread.start()
+        return self
+
+    def _read(self) -> None:
+        assert self.proc is not None and self.proc.stdout is not None
+        for line in self.proc.stdout:
+            self.samples.append(json.loads(line))
+
+    def __exit__(self, *args: Any) -> None:
+        assert self.proc is not None and self.thread is not None
+        if self.proc.poll() is None:
+            # sudo relays the signal to the monitor
+            self.proc.send_signal(signal.SIGINT)
+        self.proc.wait()
+        self.thread.join()
+        for s in self.samples:
+            s["name"] = self.name
+        ResultStore(DMA_STORE).append(self.samples)
+        if self.samples:
+            last = self.samples[-1]
+            print(
+                f"[{self.name}] DMA memory: {last['bytes'] >> 20} MiB in {last['runs']} runs, "
+                f"nodes {last['nodes']}, {last['iotlb_entries']} IOTLB entries"
+            )
+
+
+@contextmanager
+def monitor_dma(pid: int, name: str) -> Iterator[None]:
+    """Monitors the process if DMA_MONITOR=1, otherwise does nothing"""
+    if not ENABLED:
+        yield
+        return
+    with DmaMonitor(pid, name):
+        yield
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pid", type=int, help="benchmark process or one of its ancestors")
+    parser.add_argument("--name", default="sgx-lkl-run", help="command name to look for")
+    parser.add_argument("--interval", type=float, default=INTERVAL, help="seconds between samples")
+    parser.add_argument("--once", action="store_true", help="print a single sample and exit")
+    args = parser.parse_args()
+    if args.once:
+        pid = find_process(args.pid, args.name)
+        if pid is None:
+            print(f"no {args.name} process found below {args.pid}", file=sys.stderr)
+            sys.exit(1)
+        print(json.dumps(sample(pid), indent=2))
+        return
+    monitor(args.pid, args.name, args.interval)
+
+
+if __name__ == "__main__":
+    main()
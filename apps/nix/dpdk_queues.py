@@ -0,0 +1,213 @@
+"""
+Sweep of the number of DPDK RX/TX queues together with the number of
+enclave threads (SGXLKL_ETHREADS) for the sgx-io network benchmarks.
+
+sgx-lkl-userpci configures the queues on the NIC and writes the extended
+statistics of the PMD to SGXLKL_DPDK_STATS once the enclave exits. The
+per-queue counters of each run end up in dpdk-queues.jsonl:
+
+    DPDK_QUEUES=1,2,4 DPDK_ETHREADS=1,2,4 python3 iperf.py
+
+The scaling curve, i.e. throughput relative to one queue and one thread:
+
+    python3 dpdk_queues.py iperf.jsonl
+"""
+
+import itertools
+import json
+import os
+import re
+import sys
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from result_store import ResultStore, Stats
+from sysctl_profiles import LEGACY
+
+QUEUE_STORE = "dpdk-queues.jsonl"
+# i.e. rx_q0packets, tx_q3bytes from the generic ethdev counters, with an
+# underscore in some PMDs
+QUEUE_COUNTER = re.compile(r"(rx|tx)_q(\d+)_?(packets|bytes|errors)")
+
+
+@dataclass(frozen=True)
+class QueueConfig:
+    queues: int
+    ethreads: int
+
+    @property
+    def name(self) -> str:
+        return f"{self.queues}q-{self.ethreads}t"
+
+    def env(self, stats_path: str) -> Dict[str, str]:
+        return dict(
+            SGXLKL_DPDK_RX_QUEUES=str(self.queues),
+            SGXLKL_DPDK_TX_QUEUES=str(self.queues),
+            SGXLKL_ETHREADS=str(self.ethreads),
+            SGXLKL_DPDK_STATS=stats_path,
+        )
+
+
+# what reproduce.load_default_env sets
+DEFAULT = QueueConfig(1, 1)
+
+
+def parse_counts(name: str) -> List[int]:
+    value = os.environ.get(name, "1")
+    try:
+        counts = [int(v) for v in value.split(",")]
+    except ValueError:
+        raise RuntimeError(f"{name} must be a list of numbers, got {value}")
+    if any(c < 1 for c in counts):
+        raise RuntimeError(f"{name} must be positive, got {value}")
+    return counts
+
+
+def queue_configs() -> List[QueueConfig]:
+    """Configurations to sweep, from DPDK_QUEUES=1,2,4 and DPDK_ETHREADS=1,2,4"""
+    queues = parse_counts("DPDK_QUEUES")
+    ethreads = parse_counts("DPDK_ETHREADS")
+    return [QueueConfig(q, t) for q, t in itertools.product(queues, ethreads)]
+
+
+def tag_queues(stats: Stats, config: Optional[QueueConfig]) -> None:
+    """Rows of systems without DPDK are not tagged"""
+    if config is None:
+        stats.tags.pop("dpdk-queues", None)
+        stats.tags.pop("ethreads", None)
+        return
+    stats.tags["dpdk-queues"] = config.queues
+    stats.tags["ethreads"] = config.ethreads
+
+
+def read_queue_stats(path: str, timeout: float = 10) -> Optional[Dict[str, Any]]:
+    """
+    Waits for sgx-lkl-userpci to write the statistics, which happens after
+    the enclave has exited.
+    """
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(path):
+        if time.monotonic() > deadline:
+            print(f"sgx-lkl-userpci did not write {path}", file=sys.stderr)
+            return None
+        time.sleep(0.1)
+    # the file is created before it is written
+    for _ in range(int(timeout * 10)):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except ValueError:
+            time.sleep(0.1)
+    print(f"{path} is incomplete", file=sys.stderr)
+    return None
+
+
+def queue_counters(raw: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """One record per port, direction and queue from the xstats of the PMD"""
+    queues: Dict[Tuple[int, str, int], Dict[str, Any]] = {}
+    for port in raw["ports"]:
+        for name, value in port["xstats"].items():
+            match = QUEUE_COUNTER.fullmatch(name)
+            if not match:
+                continue
+            direction, queue, counter = match.group(1), int(match.group(2)), match.group(3)
+            key = (port["port"], direction, queue)
+            record = queues.setdefault(
+                key, dict(port=port["port"], direction=direction, queue=queue)
+            )
+            record[counter] = value
+    return [queues[k] for k in sorted(queues)]
+
+
+def record_queue_stats(
+    path: str, config: QueueConfig, benchmark: str, tags: Dict[str, Any]
+) -> None:
+    raw = read_queue_stats(path)
+    if raw is None:
+        return
+    os.unlink(path)
+    records = queue_counters(raw)
+    for r in records:
+        r.update(tags)
+        r.update(benchmark=benchmark, queues=config.queues, ethreads=config.ethreads)
+    ResultStore(QUEUE_STORE).append(records)
+
+    rx = [r.get("packets", 0) for r in records if r["direction"] == "rx" and r["queue"] < config.queues]
+    total = sum(rx)
+    if total == 0:
+        print(f"[{benchmark}] {config.name}: the PMD reports no per-queue rx packets")
+        return
+    shares = " ".join(f"{p / total * 100:.0f}%" for p in rx)
+    print(f"[{benchmark}] {config.name}: rx packets per queue {shares}")
+
+
+# other sweep dimensions that change the throughput, with the value of rows
+# written before they were recorded (see the completed_runs of the drivers)
+SWEEP_DEFAULTS = {"sysctl-profile": LEGACY, "mtu": 1500, "instances": 1}
+
+
+def _configs(df: pd.DataFrame) -> List[str]:
+    return [c for c in SWEEP_DEFAULTS if c in df.columns]
+
+
+def scaling_curve(df: pd.DataFrame, metric: str) -> pd.DataFrame:
+    """
+    Mean of metric per queue count and thread count, relative to the run
+    with one queue and one thread of the same sysctl profile, MTU and
+    number of iperf instances.
+    """
+    df = df[df["system"] == "sgx-io"].copy()
+    df["dpdk-queues"] = df["dpdk-queues"].fillna(DEFAULT.queues).astype(int)
+    df["ethreads"] = df["ethreads"].fillna(DEFAULT.ethreads).astype(int)
+    configs = _configs(df)
+    for column in configs:
+        df[column] = df[column].fillna(SWEEP_DEFAULTS[column])
+    curve = df.groupby(configs + ["dpdk-queues", "ethreads"])[metric].mean().reset_index()
+    is_base = (curve["dpdk-queues"] == 1) & (curve["ethreads"] == 1)
+    keys = [curve[c] for c in configs] if configs else (lambda _: 0)
+    base = curve[metric].where(is_base).groupby(keys).transform("max")
+    curve["speedup"] = curve[metric] / base
+    return curve
+
+
+def iperf_throughput(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Throughput of every run per interval, summed over the ports (instances)
+    of the run. Rows written before runs had an id cannot be told apart and
+    are left out.
+    """
+    if "run-id" not in df.columns:
+        df = df.assign(**{"run-id": None})
+    legacy = df["run-id"].isna()
+    if legacy.any():
+        print(f"skip {legacy.sum()} rows without a run-id", file=sys.stderr)
+    df = df[(df["direction"] == "send") & ~legacy].copy()
+    df["gbps"] = df["bytes"] / df["seconds"] * 8 / 1e9
+    keys = ["system", "dpdk-queues", "ethreads"] + _configs(df) + ["run-id", "interval"]
+    return df.groupby(keys, dropna=False)["gbps"].sum().reset_index()
+
+
+def main() -> None:
+    if len(sys.argv) != 2:
+        print(f"USAGE: {sys.argv[0]} iperf.jsonl|nginx.jsonl", file=sys.stderr)
+        sys.exit(1)
+    path = sys.argv[1]
+    df = pd.DataFrame(ResultStore(path).read())
+    if "dpdk-queues" not in df.columns:
+        df["dpdk-queues"] = None
+        df["ethreads"] = None
+    if os.path.basename(path).startswith("iperf"):
+        curve = scaling_curve(iperf_throughput(df), "gbps")
+    else:
+        curve = scaling_curve(df, "req_sec_tot")
+    print(curve.to_string(index=False))
+    csv = os.path.basename(path).split(".")[0] + "-queue-scaling.tsv"
+    print(csv)
+    curve.to_csv(csv, index=False, sep="\t")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import glob
+import hashlib
+import json
+import os
+import re
+import socket
+import subprocess
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from helpers import Settings
+from result_store import ResultStore, Stats
+
+# One record per distinct machine state, referenced by the "fingerprint"
+# column of every result row.
+FINGERPRINT_STORE = "fingerprints.jsonl"
+
+
+def read_file(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def cpu_info() -> Dict[str, Optional[str]]:
+    info: Dict[str, Optional[str]] = dict(model=None, microcode=None)
+    cpuinfo = read_file("/proc/cpuinfo") or ""
+    # first processor is representative
+    for line in cpuinfo.split("\n\n")[0].splitlines():
+        key, _, value = line.partition(":")
+        key = key.strip()
+        if key == "model name":
+            info["model"] = value.strip()
+        elif key == "microcode":
+            info["microcode"] = value.strip()
+    return info
+
+
+def cpu_governors() -> List[str]:
+    paths = glob.glob("/sys/devices/system/cpu/cpu*/cpufreq/scaling_governor")
+    return sorted({read_file(p) or "" for p in paths})
+
+
+def turbo_enabled() -> Optional[bool]:
+    no_turbo = read_file("/sys/devices/system/cpu/intel_pstate/no_turbo")
+    if no_turbo is not None:
+        return no_turbo == "0"
+    boost = read_file("/sys/devices/system/cpu/cpufreq/boost")
+    if boost is not None:
+        return boost == "1"
+    return None
+
+
+def hugepages() -> Dict[str, Dict[str, int]]:
+    pages: Dict[str, Dict[str, int]] = {}
+    for path in sorted(glob.glob("/sys/devices/system/node/node*/hugepages/hugepages-*")):
+        node = path.split("/")[5]
+        size = os.path.basename(path)[len("hugepages-"):]
+        pages.setdefault(node, {})[size] = int(read_file(f"{path}/nr_hugepages") or 0)
+    return pages
+
+
+def block_queue(device: str) -> Dict[str, str]:
+    """Same tunables as python-scripts/introspect-blocks.py dumps"""
+    tunables = {}
+    queue = f"/sys/block/{device}/queue"
+    for root, _, files in os.walk(queue):
+        for name in files:
+            path = os.path.join(root, name)
+            value = read_file(path)
+            if value is not None:
+                tunables[os.path.relpath(path, queue)] = value
+    return tunables
+
+
+def nic_rings(ifname: str) -> Optional[Dict[str, int]]:
+    try:
+        proc = subprocess.run(
+            ["ethtool", "-g", ifname], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+        )
+    except FileNotFoundError:
+        return None
+    if proc.returncode != 0:
+        return None
+    # the second block holds the current settings, the first the maximum
+    current = proc.stdout.split("Current hardware settings:")[-1]
+    rings = {}
+    for key, value in re.findall(r"^(RX|TX):\s+(\d+)", current, re.MULTILINE):
+        rings[key.lower()] = int(value)
+    return rings
+
+
+def sgx_epc_bytes() -> Optional[int]:
+    # in-tree driver (linux >= 6.0)
+    nodes = glob.glob("/sys/devices/system/node/node*/x86/sgx_total_bytes")
+    if nodes:
+        return sum(int(read_file(n) or 0) for n in nodes)
+    # out-of-tree isgx driver
+    pages = read_file("/sys/module/isgx/parameters/sgx_nr_total_epc_pages")
+    if pages is not None:
+        return int(pages) * 4096
+    return None
+
+
+def collect(settings: Settings) -> Dict[str, Any]:
+    record: Dict[str, Any] = dict(
+        cpu=cpu_info(),
+        governors=cpu_governors(),
+        turbo=turbo_enabled(),
+        smt=read_file("/sys/devices/system/cpu/smt/active"),
+        hugepages=hugepages(),
+        cmdline=read_file("/proc/cmdline"),
+        kernel=os.uname().release,
+        nic_rings=nic_rings(settings.native_nic_ifname),
+        sgx_epc_bytes=sgx_epc_bytes(),
+    )
+    # the loop backend has no fixed device, its loop devices come and go with
+    # every mount
+    if settings.storage_backend == "nvme":
+        try:
+            record["block_queue"] = block_queue(settings.spdk_device())
+        except Exception:  # device is bound to SPDK or absent
+            record["block_queue"] = None
+    return record
+
+
+def fingerprint_id(record: Dict[str, Any]) -> str:
+    data = json.dumps(record, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+def record_fingerprint(settings: Settings, path: str = FINGERPRINT_STORE) -> str:
+    """Stores the current machine state if it was not seen before, returns its id"""
+    record = collect(settings)
+    id = fingerprint_id(record)
+    store = ResultStore(path)
+    if id not in store.read(["id"])["id"]:
+        store.append([dict(id=id, hostname=socket.gethostname(), time=datetime.now().isoformat(), **record)])
+    return id
+
+
+def tag_stats(stats: Stats, settings: Settings) -> None:
+    """Links all rows written from now on to the current machine state"""
+    stats.tags["fingerprint"] = record_fingerprint(settings)
@@ -1,8 +1,7 @@
-import json
 import os
 import subprocess
 import signal
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional
 
 import pandas as pd
 from helpers import (
@@ -10,18 +9,35 @@ from helpers import (
     create_settings,
     flamegraph_env,
     nix_build,
+    nix_build_all,
     read_stats,
     write_stats,
     scone_env
 )
-from storage import Storage, StorageKind
+from fingerprint import tag_stats
+from dma_monitor import monitor_dma
+from capture import Capture, JsonBlockParser
+from block_tuning import queue_profiles, tag_queue_profile
+from fio_jobs import DEFAULT, FioJob, fio_jobs, tag_job
+from fio_timeseries import (
+    FINAL_REPORT_TIMEOUT,
+    STATUS_INTERVAL,
+    interval_rows,
+    label_phases,
+    runtime_over,
+    steady_summary,
+)
+from result_store import Stats, completed_runs
+from storage import SYSTEM_KINDS, Storage, StorageKind
 
 
 def benchmark_fio(
     system: str,
     attr: str,
     directory: str,
-    stats: Dict[str, List],
+    stats: Stats,
+    series: Stats,
+    job: FioJob,
     extra_env: Dict[str, str] = {},
 ) -> None:
 
@@ -41,62 +57,89 @@ def benchmark_fio(
     if os.environ.get("SGXLKL_ENABLE_GDB", "0") == "1":
         stdout = None
 
-    cmd = [str(fio), "bin/fio", "--output-format=json", "--eta=always", "fio-rand-RW.job"]
-    proc = subprocess.Popen(cmd, stdout=stdout, text=True, env=env)
-    data = ""
-    in_json = False
-    print(f"[Benchmark]: {system}")
-    try:
-        if proc.stdout is None:
-            proc.wait()
-        else:
-            for line in proc.stdout:
-                print(line, end="")
-                if line == "{\n":
-                    in_json = True
-                if in_json:
-                    data += line
-                if line == "}\n":
-                    break
-    finally:
+    # json+ adds the latency histograms the interval percentiles are taken from
+    cmd = [
+        str(fio),
+        "bin/fio",
+        "--output-format=json+",
+        f"--status-interval={STATUS_INTERVAL}",
+        "--eta=always",
+    ] + job.args()
+    proc = subprocess.Popen(cmd, stdout=stdout, stderr=stdout, text=True, env=env)
+    reports: List[Dict[str, Any]] = []
+    print(f"[Benchmark]: {system} {job.name}")
+    with Capture(proc, f"fio-{system}-{job.name}-{NOW}.log.gz", [JsonBlockParser()]) as capture:
         try:
-            print("stop fio...")
-            proc.send_signal(signal.SIGINT)
-            proc.wait(timeout=3)
-        except subprocess.TimeoutExpired:
-            proc.send_signal(signal.SIGKILL)
-            proc.wait()
-    if data == "":
-        raise RuntimeError(f"Did not get a result when running benchmark for {system}")
-    jsondata = json.loads(data)
-    for jobnum, job in enumerate(jsondata["jobs"]):
-        stats["system"].append(system)
-        stats["job"].append(jobnum)
+            with monitor_dma(proc.pid, f"fio-{system}"):
+                if proc.stdout is None:
+                    proc.wait()
+                else:
+                    for _, report in capture.samples():
+                        reports.append(report)
+                        if not runtime_over(report, job.runtime):
+                            continue
+                        # the final report follows, unless this was it and fio exits
+                        for _, report in capture.samples(timeout=FINAL_REPORT_TIMEOUT):
+                            reports.append(report)
+                            break
+                        break
+        finally:
+            try:
+                print("stop fio...")
+                proc.send_signal(signal.SIGINT)
+                proc.wait(timeout=3)
+            except subprocess.TimeoutExpired:
+                proc.send_signal(signal.SIGKILL)
+                proc.wait()
+        if not reports or not runtime_over(reports[-1], job.runtime):
+            capture.print_tail()
+            raise RuntimeError(f"Did not get a result when running benchmark for {system}")
+
+    run_id = f"{NOW}-{stats.num_rows()}"
+    rows = interval_rows(reports)
+    steady_bw = label_phases(rows)
+    series.append_rows({"system": system, "run-id": run_id, **row} for row in rows)
+    if steady_bw is None:
+        print(f"[Benchmark]: {system} {job.name} did not reach a steady state")
+    else:
+        ramp = min(row["time"] for row in rows if row["phase"] != "ramp")
+        print(f"[Benchmark]: {system} {job.name} steady at {steady_bw:.1f} MiB/s after {ramp:.0f}s")
+
+    steady = steady_summary(reports, rows)
+    # the {op}-* columns cover the whole run including the ramp-up, as fio
+    # reports them; the steady-* columns only the steady intervals
+    for jobnum, fio_job in enumerate(reports[-1]["jobs"]):
+        # steady-bw-mib is the total of all jobs
+        row = {"system": system, "job": jobnum, "run-id": run_id, "steady-bw-mib": steady_bw}
+        row.update(steady.get(jobnum, {}))
         for op in ["read", "write", "trim"]:
-            metrics = job[op]
+            metrics = fio_job[op]
             for metric_name, metric in metrics.items():
                 if isinstance(metric, dict):
                     for name, submetric in metric.items():
-                        stats[f"{op}-{metric_name}-{name}"].append(submetric)
+                        # the histograms only go into the time series
+                        if name != "bins":
+                            row[f"{op}-{metric_name}-{name}"] = submetric
                 else:
-                    stats[f"{op}-{metric_name}"].append(metric)
+                    row[f"{op}-{metric_name}"] = metric
+        stats.append_rows([row])
 
 
-def benchmark_native(storage: Storage, stats: Dict[str, List]) -> None:
+def benchmark_native(storage: Storage, stats: Stats, series: Stats, job: FioJob) -> None:
     mount = storage.setup(StorageKind.NATIVE)
     with mount as mnt:
-        benchmark_fio("native", "fio-native", mnt, stats, extra_env=mount.extra_env())
+        benchmark_fio("native", "fio-native", mnt, stats, series, job, extra_env=mount.extra_env())
 
 
-def benchmark_scone(storage: Storage, stats: Dict[str, List]) -> None:
+def benchmark_scone(storage: Storage, stats: Stats, series: Stats, job: FioJob) -> None:
     mount = storage.setup(StorageKind.SCONE)
     with mount as mnt:
         extra_env = scone_env(mnt)
         extra_env.update(mount.extra_env())
-        benchmark_fio("scone", "fio-scone", mnt, stats, extra_env=extra_env)
+        benchmark_fio("scone", "fio-scone", mnt, stats, series, job, extra_env=extra_env)
 
 
-def benchmark_sgx_lkl(storage: Storage, stats: Dict[str, List]) -> None:
+def benchmark_sgx_lkl(storage: Storage, stats: Stats, series: Stats, job: FioJob) -> None:
     mount = storage.setup(StorageKind.LKL)
     with mount as mnt:
         benchmark_fio(
@@ -104,25 +147,28 @@ def benchmark_sgx_lkl(storage: Storage, stats: Dict[str, List]) -> None:
             "fio-sgx-lkl",
             mnt,
             stats,
+            series,
+            job,
             extra_env=mount.extra_env(),
         )
 
 
-def benchmark_sgx_io(storage: Storage, stats: Dict[str, List]) -> None:
+def benchmark_sgx_io(storage: Storage, stats: Stats, series: Stats, job: FioJob) -> None:
     mount = storage.setup(StorageKind.SPDK)
     with mount as mnt:
-        benchmark_fio("sgx-io", "fio-sgx-io", mnt, stats, extra_env=mount.extra_env())
+        benchmark_fio("sgx-io", "fio-sgx-io", mnt, stats, series, job, extra_env=mount.extra_env())
 
 
 def main() -> None:
-    stats = read_stats("fio.json")
+    stats = read_stats("fio.jsonl")
+    # one row per job, operation and status interval
+    series = read_stats("fio-timeseries.jsonl")
+    series.tags = stats.tags
 
     settings = create_settings()
 
     storage = Storage(settings)
 
-    system = set(stats["system"])
-
     benchmarks = {
         "native": benchmark_native,
         "sgx-io": benchmark_sgx_io,
@@ -130,12 +176,35 @@ def main() -> None:
         "sgx-lkl": benchmark_sgx_lkl,
     }
 
-    for name, benchmark in benchmarks.items():
-        if name in system:
-            print(f"skip {name} benchmark")
-            continue
-        benchmark(storage, stats)
-        write_stats("fio.json", stats)
+    # rows without a job ran fio-rand-RW.job
+    done = completed_runs(
+        stats, {"system": None, "queue-profile": "booted", "fio-job": DEFAULT.name}
+    )
+    profiles = queue_profiles()
+    jobs = fio_jobs()
+    nix_build_all(
+        [f"fio-{name}" for name in benchmarks]
+        + [storage.image_attr(StorageKind.NATIVE), storage.image_attr(StorageKind.SCONE)]
+    )
+
+    for profile in profiles:
+        storage.queue_profile = profile
+        for name, benchmark in benchmarks.items():
+            if not storage.supports_system(name):
+                continue
+            if profile.tunables and SYSTEM_KINDS[name] == StorageKind.SPDK:
+                # SPDK bypasses the kernel block layer
+                continue
+            for job in jobs:
+                if (name, profile.name, job.name) in done:
+                    print(f"skip {name} benchmark ({profile.name}, {job.name})")
+                    continue
+                benchmark(storage, stats, series, job)
+                tag_job(stats, job)
+                tag_queue_profile(stats, profile, storage.tuning)
+                tag_stats(stats, settings)
+                write_stats("fio.jsonl", stats)
+                write_stats("fio-timeseries.jsonl", series)
 
     csv = f"fio-throughput-{NOW}.tsv"
     print(csv)
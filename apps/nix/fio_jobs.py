@@ -0,0 +1,129 @@
+"""
+fio jobs rendered from a grid of parameters instead of the job files in
+iotest-image.nix. Every dimension is a comma-separated list; the first
+value of each is the default operating point:
+
+    FIO_BS=4K,64K FIO_IODEPTH=1,16,64 FIO_IOENGINE=libaio python3 fio.py
+
+By default the full cartesian product runs; FIO_SWEEP=axes varies one
+dimension at a time while the others stay at their default.
+"""
+
+import itertools
+import os
+import sys
+from dataclasses import dataclass, fields, replace
+from typing import Any, List
+
+from result_store import Stats
+
+
+@dataclass(frozen=True)
+class FioJob:
+    bs: str = "4K"
+    iodepth: int = 16
+    numjobs: int = 8
+    # 100 is a pure random read, 0 a pure random write
+    rwmixread: int = 60
+    direct: int = 0
+    # of the file each job works on
+    size: str = "40G"
+    # psync is what fio uses without ioengine and ignores iodepth
+    ioengine: str = "psync"
+    runtime: int = 300
+    # the smp benchmark runs its jobs as threads of one process
+    thread: bool = False
+
+    @property
+    def name(self) -> str:
+        io = "direct" if self.direct else "buffered"
+        return (
+            f"{self.ioengine}-bs{self.bs}-qd{self.iodepth}-j{self.numjobs}"
+            f"-r{self.rwmixread}-{io}-{self.size}"
+        )
+
+    @property
+    def rw(self) -> str:
+        if self.rwmixread == 100:
+            return "randread"
+        if self.rwmixread == 0:
+            return "randwrite"
+        return "randrw"
+
+    def args(self) -> List[str]:
+        """
+        The job as command line options. These work for every system, while
+        a job file would have to be written into the (encrypted) disk image
+        of the enclave; the data file is still created relative to
+        SGXLKL_CWD.
+        """
+        args = [
+            "--name=fio-rand-RW",
+            "--filename=fio-rand-RW",
+            f"--rw={self.rw}",
+            f"--rwmixread={self.rwmixread}",
+            f"--bs={self.bs}",
+            f"--direct={self.direct}",
+            f"--ioengine={self.ioengine}",
+            f"--iodepth={self.iodepth}",
+            f"--numjobs={self.numjobs}",
+            f"--size={self.size}",
+            "--time_based=1",
+            f"--runtime={self.runtime}",
+        ]
+        if self.thread:
+            args.append("--thread")
+        return args
+
+
+# equivalent to fio-rand-RW.job, which older results ran
+DEFAULT = FioJob()
+
+# environment variable of each dimension
+DIMENSIONS = {
+    "bs": "FIO_BS",
+    "iodepth": "FIO_IODEPTH",
+    "numjobs": "FIO_NUMJOBS",
+    "rwmixread": "FIO_RWMIXREAD",
+    "direct": "FIO_DIRECT",
+    "size": "FIO_SIZE",
+    "ioengine": "FIO_IOENGINE",
+}
+
+
+def parse_dimension(field: str, base: FioJob) -> List[Any]:
+    name = DIMENSIONS[field]
+    default = getattr(base, field)
+    value = os.environ.get(name, str(default))
+    try:
+        return [type(default)(v) for v in value.split(",")]
+    except ValueError:
+        raise RuntimeError(f"{name} must be a list of {type(default).__name__}, got {value}")
+
+
+def fio_jobs(base: FioJob = DEFAULT) -> List[FioJob]:
+    """Jobs to sweep, from the FIO_* variables and FIO_SWEEP=product|axes"""
+    grid = {field: parse_dimension(field, base) for field in DIMENSIONS}
+    runtime = int(os.environ.get("FIO_RUNTIME", str(base.runtime)))
+    base = replace(base, runtime=runtime, **{f: values[0] for f, values in grid.items()})
+
+    sweep = os.environ.get("FIO_SWEEP", "product")
+    if sweep == "product":
+        combinations = itertools.product(*grid.values())
+        jobs = [replace(base, **dict(zip(grid.keys(), c))) for c in combinations]
+    elif sweep == "axes":
+        jobs = [base]
+        for field, values in grid.items():
+            jobs += [replace(base, **{field: v}) for v in values[1:]]
+    else:
+        raise RuntimeError(f"FIO_SWEEP must be product or axes, got {sweep}")
+    if "psync" in grid["ioengine"] and len(grid["iodepth"]) > 1:
+        print("psync submits one io at a time, iodepth has no effect for it", file=sys.stderr)
+    return jobs
+
+
+def tag_job(stats: Stats, job: FioJob) -> None:
+    """Keys the following rows by every parameter of the job"""
+    stats.tags["fio-job"] = job.name
+    for field in fields(job):
+        stats.tags[f"fio-{field.name}"] = getattr(job, field.name)
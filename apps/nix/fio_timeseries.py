@@ -0,0 +1,155 @@
+"""
+Time series of a fio run from the reports it prints every
+--status-interval seconds. The reports are cumulative, so each row is the
+difference to the previous report: bandwidth, iops and completion latency
+percentiles (from the json+ latency bins) per job, operation and interval.
+
+Every interval is labelled with the phase of the run: "ramp" until the
+bandwidth settles, "steady" while it stays within STEADY_TOLERANCE of the
+first steady window and "drift" when it leaves it later on, i.e. once the
+SSD starts garbage collecting.
+"""
+
+import os
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+STATUS_INTERVAL = int(os.environ.get("FIO_STATUS_INTERVAL", "1"))
+# consecutive intervals within the tolerance of their mean that start the steady phase
+STEADY_WINDOW = 5
+STEADY_TOLERANCE = 0.1
+OPERATIONS = ["read", "write", "trim"]
+PERCENTILES = {"p50": 50.0, "p99": 99.0, "p99.9": 99.9}
+# how long to wait for the final report once the runtime is over
+FINAL_REPORT_TIMEOUT = 30.0
+
+
+def runtime_over(report: Dict[str, Any], runtime: int) -> bool:
+    """
+    The last status reports can have the runtime elapsed already; the final
+    report follows them when fio exits
+    """
+    return all(job["elapsed"] >= runtime for job in report["jobs"])
+
+
+def bins_percentile(bins: Dict[int, int], q: float) -> Optional[float]:
+    total = sum(bins.values())
+    if total == 0:
+        return None
+    rank = q / 100 * total
+    seen = 0
+    for value in sorted(bins):
+        seen += bins[value]
+        if seen >= rank:
+            return float(value)
+    return None
+
+
+def _bins(op: Dict[str, Any]) -> Dict[int, int]:
+    # only present with --output-format=json+
+    return {int(ns): count for ns, count in op.get("clat_ns", {}).get("bins", {}).items()}
+
+
+# time since the first report, job, operation, seconds, bytes, ios, latency bins
+Delta = Tuple[float, int, str, float, int, int, Dict[int, int]]
+
+
+def _deltas(reports: List[Dict[str, Any]]) -> Iterator[Delta]:
+    start = reports[0]["timestamp_ms"]
+    for previous, report in zip(reports, reports[1:]):
+        seconds = (report["timestamp_ms"] - previous["timestamp_ms"]) / 1000
+        if seconds <= 0:
+            continue
+        time = (report["timestamp_ms"] - start) / 1000
+        for jobnum, (old, new) in enumerate(zip(previous["jobs"], report["jobs"])):
+            for op in OPERATIONS:
+                if new[op]["total_ios"] == 0:
+                    continue
+                old_bins = _bins(old[op])
+                bins = {ns: c - old_bins.get(ns, 0) for ns, c in _bins(new[op]).items()}
+                io_bytes = new[op]["io_bytes"] - old[op]["io_bytes"]
+                ios = new[op]["total_ios"] - old[op]["total_ios"]
+                yield time, jobnum, op, seconds, io_bytes, ios, bins
+
+
+def _metrics(seconds: float, io_bytes: int, ios: int, bins: Dict[int, int]) -> Dict[str, Any]:
+    metrics = {"bw-mib": io_bytes / seconds / 2 ** 20, "iops": ios / seconds}
+    for name, q in PERCENTILES.items():
+        ns = bins_percentile(bins, q)
+        metrics[f"clat-{name}-us"] = None if ns is None else ns / 1000
+    return metrics
+
+
+def interval_rows(reports: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    rows = []
+    for time, jobnum, op, seconds, io_bytes, ios, bins in _deltas(reports):
+        row = {"time": time, "job": jobnum, "op": op}
+        row.update(_metrics(seconds, io_bytes, ios, bins))
+        rows.append(row)
+    return rows
+
+
+def steady_summary(
+    reports: List[Dict[str, Any]], rows: List[Dict[str, Any]]
+) -> Dict[int, Dict[str, Any]]:
+    """
+    Bandwidth, iops and latency percentiles per job over the steady
+    intervals only, from the rows labelled by label_phases
+    """
+    steady = {row["time"] for row in rows if row["phase"] == "steady"}
+    totals: Dict[Tuple[int, str], List[Any]] = {}
+    for time, jobnum, op, seconds, io_bytes, ios, bins in _deltas(reports):
+        if time not in steady:
+            continue
+        total = totals.setdefault((jobnum, op), [0.0, 0, 0, {}])
+        total[0] += seconds
+        total[1] += io_bytes
+        total[2] += ios
+        for ns, count in bins.items():
+            total[3][ns] = total[3].get(ns, 0) + count
+    summary: Dict[int, Dict[str, Any]] = {}
+    for (jobnum, op), (seconds, io_bytes, ios, bins) in totals.items():
+        metrics = _metrics(seconds, io_bytes, ios, bins)
+        summary.setdefault(jobnum, {}).update({f"steady-{op}-{k}": v for k, v in metrics.items()})
+    return summary
+
+
+def steady_start(bandwidth: List[float]) -> Optional[int]:
+    """First interval of STEADY_WINDOW intervals within the tolerance of their mean"""
+    for i in range(len(bandwidth) - STEADY_WINDOW + 1):
+        window = bandwidth[i : i + STEADY_WINDOW]
+        mean = sum(window) / STEADY_WINDOW
+        if mean > 0 and all(abs(b - mean) <= STEADY_TOLERANCE * mean for b in window):
+            return i
+    return None
+
+
+def label_phases(rows: List[Dict[str, Any]]) -> Optional[float]:
+    """
+    Sets the phase of every row from the total bandwidth of its interval and
+    returns the mean total bandwidth of the steady phase, None if the run
+    never settled.
+    """
+    totals: Dict[float, float] = {}
+    for row in rows:
+        totals[row["time"]] = totals.get(row["time"], 0.0) + row["bw-mib"]
+    times = sorted(totals)
+    bandwidth = [totals[t] for t in times]
+    start = steady_start(bandwidth)
+    if start is None:
+        for row in rows:
+            row["phase"] = "ramp"
+        return None
+
+    reference = sum(bandwidth[start : start + STEADY_WINDOW]) / STEADY_WINDOW
+    phases = {}
+    for i, t in enumerate(times):
+        if i < start:
+            phases[t] = "ramp"
+        elif abs(totals[t] - reference) <= STEADY_TOLERANCE * reference:
+            phases[t] = "steady"
+        else:
+            phases[t] = "drift"
+    for row in rows:
+        row["phase"] = phases[row["time"]]
+    steady = [totals[t] for t in times if phases[t] == "steady"]
+    return sum(steady) / len(steady)
@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
-from typing import Dict, List, Any, Union
+from typing import Dict, List, Any, Optional, Union
 import pandas as pd
 import os
 from plot import ticker
+from result_store import ResultStore
 
 PAPER_MODE = os.environ.get("PAPER_MODE", "1") == "1"
 
@@ -43,6 +44,8 @@ ROW_ALIASES = dict(
 )
 COLUMN_ALIASES: Dict[str, str] = {
     "iperf-throughput": "Throughput [Gbps]",
+    "latency-us": "Round trip [μs]",
+    "aggregate-gbps": "Aggregate throughput [Gbps]",
     "disk-throughput": "Throughput [MiB/s]",
     "hdparm-throughput": "Throughput [GiB/s]",
     "SQL statistics read": "Read",
@@ -70,6 +73,18 @@ COLUMN_ALIASES: Dict[str, str] = {
 }
 
 
+def read_results(path: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Loads a result store (.jsonl) or a tsv export. If columns are given, only
+    those are loaded.
+    """
+    if path.endswith(".jsonl"):
+        return pd.DataFrame(ResultStore(path).read(columns))
+    # older exports lack columns that were added later
+    usecols = None if columns is None else lambda c: c in columns
+    return pd.read_csv(path, sep="\t", usecols=usecols)
+
+
 def systems_order(df: pd.DataFrame) -> List[str]:
     priorities = {
         "native": 10,
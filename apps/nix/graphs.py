@@ -3,14 +3,16 @@ import sys
 import os
 
 import pandas as pd
-from typing import Any, Optional, List
-from plot import catplot, plt, apply_hatch
+from typing import Any, Dict, Optional, List
+from plot import catplot, relplot, plt, apply_hatch
+from dpdk_queues import iperf_throughput, scaling_curve
 from graph_utils import (
     apply_aliases,
     column_alias,
     systems_order,
     change_width,
     apply_to_graphs,
+    read_results,
     PAPER_MODE,
 )
 
@@ -109,6 +111,84 @@ def iperf_graph(df: pd.DataFrame) -> Any:
     return g
 
 
+def iperf_instances_graph(df: pd.DataFrame) -> Any:
+    # totals per run from iperf-runs.jsonl
+    df = df[df["direction"] == "send"]
+    g = catplot(
+        data=apply_aliases(df),
+        x="instances",
+        y=column_alias("aggregate-gbps"),
+        hue=column_alias("system"),
+        kind="point",
+        height=2.5,
+        palette=palette,
+    )
+    g.ax.set_xlabel("Parallel iperf instances")
+    return g
+
+
+def queue_scaling_graph(curve: pd.DataFrame) -> Any:
+    g = catplot(
+        data=curve,
+        x="dpdk-queues",
+        y="speedup",
+        hue="ethreads",
+        kind="point",
+        height=2.5,
+        palette=palette,
+    )
+    g.ax.set_xlabel("DPDK queues")
+    g.ax.set_ylabel("Speedup over 1 queue, 1 thread")
+    return g
+
+
+def latency_graph(df: pd.DataFrame) -> Any:
+    # percentiles of the smallest message size per protocol
+    df = df[df["size"] == df.groupby("proto")["size"].transform("min")]
+    df = pd.melt(
+        df,
+        id_vars=["system", "proto"],
+        value_vars=["p50-us", "p99-us", "p99.9-us", "max-us"],
+        var_name="percentile",
+        value_name="latency-us",
+    )
+    df["percentile"] = df["percentile"].str.replace("-us", "", regex=False)
+
+    g = catplot(
+        data=apply_aliases(df),
+        x=column_alias("system"),
+        y=column_alias("latency-us"),
+        hue="percentile",
+        col="proto",
+        order=systems_order(df),
+        kind="bar",
+        height=2.5,
+        palette=palette,
+    )
+    # tails are orders of magnitude above the median
+    g.set(yscale="log")
+    return g
+
+
+def fio_timeseries_graph(df: pd.DataFrame) -> Any:
+    # bandwidth of all jobs and operations of a run per status interval
+    df = df.groupby(["system", "run-id", "time"])["bw-mib"].sum().reset_index()
+    df = df.rename(columns={"bw-mib": "disk-throughput"})
+    g = relplot(
+        data=apply_aliases(df),
+        x="time",
+        y=column_alias("disk-throughput"),
+        hue=column_alias("system"),
+        units="run-id",
+        estimator=None,
+        kind="line",
+        height=2.5,
+        palette=palette,
+    )
+    g.ax.set_xlabel("Time [s]")
+    return g
+
+
 def mysql_read_graph(df: pd.DataFrame) -> Any:
     groups = len(set((list(df["system"].values))))
 
@@ -263,16 +343,50 @@ def read_shit(path: str) -> None:
             print(", ".join(row))
 
 
+# Columns needed per result file; everything else is not loaded
+# matched by prefix in this order, so longer prefixes come first
+GRAPH_COLUMNS: Dict[str, List[str]] = {
+    "fio-timeseries": ["system", "run-id", "time", "bw-mib"],
+    "fio": ["system", "job", "read-bw", "write-bw"],
+    "syscall": ["system", "data_size", "threads", "total_time", "packets_per_thread"],
+    "iperf-runs": ["system", "direction", "instances", "aggregate-gbps"],
+    "iperf-streams": [],
+    "iperf": [
+        "system",
+        "direction",
+        "bytes",
+        "seconds",
+        "interval",
+        "run-id",
+        "dpdk-queues",
+        "ethreads",
+        "sysctl-profile",
+        "mtu",
+        "instances",
+    ],
+    "latency": ["system", "proto", "size", "p50-us", "p99-us", "p99.9-us", "max-us"],
+}
+
+
+def graph_columns(basename: str) -> Optional[List[str]]:
+    for prefix, columns in GRAPH_COLUMNS.items():
+        if basename.startswith(prefix):
+            return columns
+    return None
+
+
 def main() -> None:
     if len(sys.argv) < 1:
         print_usage()
 
     graphs = []
     for arg in sys.argv[1:]:
-        df = pd.read_csv(arg, delimiter="\t")
         basename = os.path.basename(arg)
+        df = read_results(arg, graph_columns(basename))
 
-        if basename.startswith("fio"):
+        if basename.startswith("fio-timeseries"):
+            graphs.append(("fio-timeseries", fio_timeseries_graph(df)))
+        elif basename.startswith("fio"):
             graphs.append(("fio-read-write", fio_read_write_graph(df)))
         if basename.startswith("syscalls-perf") or basename.startswith("syscall-perf"):
             graphs.append(("syscalls-perf", syscalls_perf_graph(df)))
@@ -281,8 +395,18 @@ def main() -> None:
             graphs.append(("MySQL-Writes", mysql_write_graph(df)))
             graphs.append(("MySQL-Latency", mysql_latency_graph(df)))
             graphs.append(("MySQL-Thru", mysql_throughput_graph(df)))
+        elif basename.startswith("iperf-runs"):
+            graphs.append(("iperf-instances", iperf_instances_graph(df)))
+        elif basename.startswith("iperf-streams"):
+            print(f"no graph for {arg}, see iperf-runs.jsonl for the totals per run")
         elif basename.startswith("iperf"):
             graphs.append(("iperf", iperf_graph(df)))
+            if "dpdk-queues" in df.columns:
+                curve = scaling_curve(iperf_throughput(df), "gbps")
+                if len(curve) > 1:
+                    graphs.append(("iperf-queue-scaling", queue_scaling_graph(curve)))
+        elif basename.startswith("latency"):
+            graphs.append(("latency", latency_graph(df)))
         elif basename.startswith("hdparm"):
             graphs.append(("HDPARM-Cached", hdparm_graph(df, "cached")))
             graphs.append(("HDPARM-Buffered", hdparm_graph(df, "buffered")))
@@ -24,7 +24,10 @@ from helpers import (
     read_stats,
     write_stats
 )
-from storage import Storage, StorageKind
+from fingerprint import tag_stats
+from block_tuning import queue_profiles, tag_queue_profile
+from result_store import completed_runs
+from storage import SYSTEM_KINDS, Storage, StorageKind
 
 
 def benchmark_hdparm(
@@ -60,19 +63,21 @@ def benchmark_hdparm(
 def benchmark_hdparm_native(storage: Storage, stats: Dict[str, List]) -> None:
     mnt = storage.setup(StorageKind.NATIVE)
     subprocess.run(["sudo", "chown", getpass.getuser(), mnt.dev])
-    benchmark_hdparm(storage, "native", "hdparm-native", mnt.dev, stats)
+    # mounting applies the queue profile
+    with mnt:
+        benchmark_hdparm(storage, "native", "hdparm-native", mnt.dev, stats)
 
 
 def benchmark_hdparm_sgx_lkl(storage: Storage, stats: Dict[str, List]) -> None:
-    storage.setup(StorageKind.LKL)
-    benchmark_hdparm(
-        storage,
-        "sgx-lkl",
-        "hdparm-sgx-lkl",
-        "/dev/vdb",
-        stats,
-        extra_env=dict(SGXLKL_HDS="/dev/nvme0n1:/mnt/nvme"),
-    )
+    with storage.setup(StorageKind.LKL):
+        benchmark_hdparm(
+            storage,
+            "sgx-lkl",
+            "hdparm-sgx-lkl",
+            "/dev/vdb",
+            stats,
+            extra_env=dict(SGXLKL_HDS="/dev/nvme0n1:/mnt/nvme"),
+        )
 
 
 def benchmark_hdparm_sgx_io(storage: Storage, stats: Dict[str, List]) -> None:
@@ -81,7 +86,7 @@ def benchmark_hdparm_sgx_io(storage: Storage, stats: Dict[str, List]) -> None:
 
 
 def main() -> None:
-    stats = read_stats("hdparm.json")
+    stats = read_stats("hdparm.jsonl")
     settings = create_settings()
     storage = Storage(settings)
 
@@ -91,13 +96,20 @@ def main() -> None:
         "sgx-io": benchmark_hdparm_sgx_io,
     }
 
-    system = set(stats["system"])
-    for name, benchmark in benchmarks.items():
-        if name in system:
-            print(f"skip {name} benchmark")
-            continue
-        benchmark(storage, stats)
-        write_stats("hdparm.json", stats)
+    done = completed_runs(stats, {"system": None, "queue-profile": "booted"})
+    for profile in queue_profiles():
+        storage.queue_profile = profile
+        for name, benchmark in benchmarks.items():
+            if (name, profile.name) in done:
+                print(f"skip {name} benchmark ({profile.name})")
+                continue
+            if profile.tunables and SYSTEM_KINDS[name] == StorageKind.SPDK:
+                # SPDK bypasses the kernel block layer
+                continue
+            benchmark(storage, stats)
+            tag_queue_profile(stats, profile, storage.tuning)
+            tag_stats(stats, settings)
+            write_stats("hdparm.jsonl", stats)
 
     csv = f"hdparm-test-{NOW}.tsv"
     print(csv)
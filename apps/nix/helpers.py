@@ -1,14 +1,23 @@
+import atexit
 import os
 import signal
+import statistics
 import subprocess
 import sys
 import json
+import tempfile
+import threading
+import time
 from contextlib import contextmanager
 from dataclasses import dataclass
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Iterator, List, Optional, Text, DefaultDict, Any, IO, Callable
-from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List, Optional, Text, Any, IO, Callable, Set
+
+from capture import Capture
+from dma_monitor import monitor_dma
+from result_store import Stats, read_stats, write_stats  # noqa: F401
 
 ROOT = Path(__file__).parent.resolve()
 NOW = datetime.now().strftime("%Y%m%d-%H%M%S")
@@ -46,22 +55,6 @@ def run(
     )
 
 
-def read_stats(path: str) -> DefaultDict[str, List]:
-    stats: DefaultDict[str, List] = defaultdict(list)
-    if not os.path.exists(path):
-        return stats
-    with open(path) as f:
-        raw_stats = json.load(f)
-        for key, value in raw_stats.items():
-            stats[key] = value
-    return stats
-
-
-def write_stats(path: str, stats: DefaultDict[str, List]) -> None:
-    with open(path, "w") as f:
-        json.dump(stats, f)
-
-
 class Chdir(object):
     def __init__(self, path: str) -> None:
         self.old_dir = os.getcwd()
@@ -75,7 +68,14 @@ class Chdir(object):
 
 
 @contextmanager
-def spawn(*args: str, extra_env: Dict[str, str] = {}) -> Iterator[subprocess.Popen]:
+def spawn(
+    *args: str, extra_env: Dict[str, str] = {}, log: Optional[str] = None
+) -> Iterator[subprocess.Popen]:
+    """
+    Runs a server in the background for the duration of the with block.
+    If log is given, its output is captured into this (gzip) file instead of
+    being inherited.
+    """
     env = os.environ.copy()
 
     env.update(extra_env)
@@ -84,12 +84,31 @@ def spawn(*args: str, extra_env: Dict[str, str] = {}) -> Iterator[subprocess.Pop
         env_string.append(f"{k}={v}")
 
     print(f"$ {' '.join(env_string)} {' '.join(args)}&")
-    proc = subprocess.Popen(args, cwd=ROOT, env=env)
+    if log is None:
+        proc = subprocess.Popen(args, cwd=ROOT, env=env)
+        with _stop_on_exit(proc):
+            yield proc
+        return
+
+    proc = subprocess.Popen(
+        args, cwd=ROOT, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+    )
+    name = os.path.basename(log).split(".")[0]
+    with Capture(proc, log) as capture:
+        try:
+            with _stop_on_exit(proc), monitor_dma(proc.pid, name):
+                yield proc
+        except BaseException:
+            capture.print_tail()
+            raise
+
 
+@contextmanager
+def _stop_on_exit(proc: subprocess.Popen) -> Iterator[None]:
     try:
-        yield proc
+        yield
     finally:
-        print(f"terminate {args[0]}")
+        print(f"terminate {proc.args[0]}")
         proc.send_signal(signal.SIGINT)
         try:
             print("wait for process to finish...")
@@ -99,24 +118,170 @@ def spawn(*args: str, extra_env: Dict[str, str] = {}) -> Iterator[subprocess.Pop
             proc.wait()
 
 
+SSH_CONTROL_DIR = Path(tempfile.gettempdir()).joinpath(f"rkt-io-ssh-{os.getuid()}")
+
+
+class SshSession:
+    """
+    Runs all commands for one host over a single multiplexed ssh connection.
+    Only the first command pays for the handshake; the master connection stays
+    around for a while after the benchmark exits so the next run can reuse it.
+    """
+
+    def __init__(self, host: str) -> None:
+        self.host = host
+        SSH_CONTROL_DIR.mkdir(mode=0o700, exist_ok=True)
+        self.commands = 0
+        # round trip of the first command, which sets up the master connection
+        self.connect: Optional[float] = None
+
+    def options(self) -> List[str]:
+        return [
+            "-o", "ControlMaster=auto",
+            "-o", f"ControlPath={SSH_CONTROL_DIR}/%C",
+            "-o", "ControlPersist=10m",
+        ]
+
+    def nix_sshopts(self) -> Dict[str, str]:
+        # makes `nix copy --to ssh://` reuse the master connection
+        return dict(NIX_SSHOPTS=" ".join(self.options()))
+
+    def command(self, args: List[str]) -> List[str]:
+        return ["ssh"] + self.options() + [self.host, "--"] + args
+
+    def dispatch(self) -> float:
+        """
+        Round trip of a no-op command, i.e. what ssh adds to every command
+        apart from the time the command itself runs. A failed connection
+        raises instead of reporting how fast it failed.
+        """
+        start = time.perf_counter()
+        subprocess.run(self.command(["true"]), stdout=subprocess.DEVNULL, check=True)
+        return time.perf_counter() - start
+
+    def run(
+        self, args: List[str], input: Optional[str] = None, check: bool = True
+    ) -> "subprocess.CompletedProcess[Text]":
+        if self.connect is None:
+            self.connect = self.dispatch()
+        self.commands += 1
+        return run(self.command(args), input=input, check=check)
+
+    def report(self) -> None:
+        if self.connect is None:
+            return
+        times = [self.dispatch() for _ in range(5)]
+        info(
+            f"[ssh {self.host}] {self.commands} commands, connect {self.connect * 1000:.1f}ms, "
+            f"dispatch median {statistics.median(times) * 1000:.1f}ms, "
+            f"max {max(times) * 1000:.1f}ms"
+        )
+
+
+@lru_cache(maxsize=None)
+def ssh_session(host: str) -> SshSession:
+    session = SshSession(host)
+    atexit.register(session.report)
+    return session
+
+
+class RemoteStore:
+    """
+    Session-wide registry of store paths known to be present on a remote host.
+    A path being valid implies its closure is valid, so only missing top-level
+    paths need to be copied.
+    """
+
+    def __init__(self, ssh_host: str) -> None:
+        self.ssh_host = ssh_host
+        self.present: Set[str] = set()
+        self._pending: Optional[threading.Thread] = None
+        self._pending_error: Optional[BaseException] = None
+
+    def _nix(self, args: List[str], check: bool = True) -> "subprocess.CompletedProcess[Text]":
+        return run(
+            ["nix"] + args,
+            extra_env=ssh_session(self.ssh_host).nix_sshopts(),
+            check=check,
+        )
+
+    def missing(self, paths: Iterable[str]) -> List[str]:
+        unknown = [p for p in dict.fromkeys(paths) if p not in self.present]
+        if not unknown:
+            return []
+        proc = self._nix(
+            ["path-info", "--json", "--store", f"ssh://{self.ssh_host}"] + unknown,
+            check=False,
+        )
+        try:
+            infos = json.loads(proc.stdout)
+        except ValueError:
+            infos = []
+        # nix 2.3 returns a list with "valid": false entries,
+        # newer versions a dict mapping invalid paths to null
+        if isinstance(infos, dict):
+            valid = [path for path, i in infos.items() if i is not None]
+        else:
+            valid = [i["path"] for i in infos if i.get("valid", True)]
+        self.present.update(valid)
+        return [p for p in unknown if p not in self.present]
+
+    def _copy(self, paths: Iterable[str]) -> None:
+        missing = self.missing(paths)
+        if missing:
+            self._nix(["copy", "--to", f"ssh://{self.ssh_host}"] + missing)
+            self.present.update(missing)
+
+    def copy(self, paths: Iterable[str]) -> None:
+        self.wait()
+        self._copy(paths)
+
+    def copy_async(self, paths: Iterable[str]) -> None:
+        """Copy in the background, i.e. while local builds are still running"""
+        self.wait()
+        paths = list(paths)
+
+        def worker() -> None:
+            try:
+                self._copy(paths)
+            except BaseException as e:
+                self._pending_error = e
+
+        self._pending = threading.Thread(target=worker, daemon=True)
+        self._pending.start()
+
+    def wait(self) -> None:
+        if self._pending is not None:
+            self._pending.join()
+            self._pending = None
+        if self._pending_error is not None:
+            error, self._pending_error = self._pending_error, None
+            raise error
+
+
+@lru_cache(maxsize=None)
+def remote_store(ssh_host: str) -> RemoteStore:
+    return RemoteStore(ssh_host)
+
+
 @dataclass
 class RemoteCommand:
     nix_path: str
     ssh_host: str
 
     def __post_init__(self) -> None:
-        run(["nix", "copy", self.nix_path, "--to", f"ssh://{self.ssh_host}"])
+        remote_store(self.ssh_host).copy([self.nix_path])
 
     def run(
         self, exe: str, args: List[str], extra_env: Dict[str, str] = {}
     ) -> subprocess.CompletedProcess:
 
-        cmd = ["ssh", self.ssh_host, "--", "env"]
+        cmd = ["env"]
         for k, v in extra_env.items():
             cmd.append(f"{k}={v}")
         cmd.append(os.path.join(self.nix_path, exe))
         cmd += args
-        return run(cmd)
+        return ssh_session(self.ssh_host).run(cmd)
 
 
 @dataclass(frozen=True)
@@ -131,6 +296,9 @@ class Settings:
     dpdk_netmask6: int
     nvme_pci_id: str
     nic_pci_id: str
+    # "nvme" or "loop", see storage.StorageBackend
+    storage_backend: str
+    loop_disk_size: str
     spdk_hd_key: Optional[str]
     native_nic_driver: str
     native_nic_ifname: str
@@ -159,6 +327,11 @@ class Settings:
     def remote_command(self, nix_attr: str) -> RemoteCommand:
         return RemoteCommand(nix_attr, self.remote_ssh_host)
 
+    def prefetch_remote(self, attrs: List[str]) -> None:
+        """Build attributes and start copying them to the remote host"""
+        paths = nix_build_all(attrs)
+        remote_store(self.remote_ssh_host).copy_async(paths.values())
+
     def spdk_device(self) -> str:
         for device in os.listdir("/sys/block"):
             path = Path(f"/sys/block/{device}").resolve()
@@ -170,8 +343,78 @@ class Settings:
         raise Exception(f"No block device with PCI ID {self.nvme_pci_id} found")
 
 
+# Maps attribute -> {"drv": ..., "out": ...} of the last build; survives
+# across benchmark runs so unchanged derivations are not rebuilt.
+NIX_BUILD_CACHE = ROOT.joinpath(".nix-build-cache.json")
+_nix_builds: Dict[str, str] = {}
+
+
+def _read_nix_build_cache() -> Dict[str, Dict[str, str]]:
+    try:
+        with open(NIX_BUILD_CACHE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_nix_build_cache(cache: Dict[str, Dict[str, str]]) -> None:
+    tmp = f"{NIX_BUILD_CACHE}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(cache, f, indent=2)
+    os.replace(tmp, NIX_BUILD_CACHE)
+
+
+def nix_instantiate(attrs: List[str]) -> List[str]:
+    cmd = ["nix-instantiate"]
+    for attr in attrs:
+        cmd += ["-A", attr]
+    drvs = run(cmd).stdout.split()
+    if len(drvs) != len(attrs):
+        raise RuntimeError(
+            f"nix-instantiate returned {len(drvs)} derivations for {len(attrs)} attributes"
+        )
+    return drvs
+
+
+def nix_build_all(attrs: List[str]) -> Dict[str, str]:
+    """
+    Build all attributes with a single evaluation and a single nix-build call.
+    Attributes whose derivation did not change since the last build are
+    returned from the cache without building.
+    """
+    missing = [a for a in dict.fromkeys(attrs) if a not in _nix_builds]
+    if missing:
+        cache = _read_nix_build_cache()
+        drvs = dict(zip(missing, nix_instantiate(missing)))
+        outdated = []
+        for attr, drv in drvs.items():
+            entry = cache.get(attr)
+            if entry and entry["drv"] == drv and os.path.exists(entry["out"]):
+                _nix_builds[attr] = entry["out"]
+            else:
+                outdated.append(attr)
+
+        if outdated:
+            cmd = ["nix-build", "--no-out-link"]
+            for attr in outdated:
+                cmd += ["-A", attr]
+            paths = run(cmd).stdout.split()
+            if len(paths) != len(outdated):
+                raise RuntimeError(
+                    f"nix-build returned {len(paths)} paths for {len(outdated)} attributes"
+                )
+            for attr, path in zip(outdated, paths):
+                # keep --out-link behaviour: the symlink is a gc root
+                run(["nix-store", "--add-root", attr, "--indirect", "--realise", path])
+                cache[attr] = dict(drv=drvs[attr], out=path)
+                _nix_builds[attr] = path
+            _write_nix_build_cache(cache)
+
+    return {attr: _nix_builds[attr] for attr in attrs}
+
+
 def nix_build(attr: str) -> str:
-    return run(["nix-build", "-A", attr, "--out-link", attr]).stdout.strip()
+    return nix_build_all([attr])[attr]
 
 
 def scone_env(mountpoint: Optional[str]) -> Dict[str, str]:
@@ -236,9 +479,14 @@ def create_settings() -> Settings:
         print("NVME_PCI_ID not set", file=sys.stderr)
         sys.exit(1)
     elif nvme_pci_id == "NULL":
-        print("NVME_PCI_ID is NULL, using malloc bdev")
+        print("NVME_PCI_ID is NULL, using loop device")
         nvme_pci_id = None
 
+    storage_backend = os.environ.get("STORAGE_BACKEND", "nvme" if nvme_pci_id else "loop")
+    if storage_backend == "nvme" and not nvme_pci_id:
+        print("STORAGE_BACKEND=nvme requires NVME_PCI_ID", file=sys.stderr)
+        sys.exit(1)
+
     return Settings(
         remote_ssh_host=remote_ssh_host,
         remote_dpdk_ip=remote_dpdk_ip,
@@ -250,6 +498,8 @@ def create_settings() -> Settings:
         dpdk_netmask6=int(os.environ.get("DEFAULT_DPDK_IPV6_MASK", "64")),
         nic_pci_id=nic_pci_id,
         nvme_pci_id=nvme_pci_id,
+        storage_backend=storage_backend,
+        loop_disk_size=os.environ.get("LOOP_DISK_SIZE", "16G"),
         native_nic_driver=os.environ.get("NATIVE_NETWORK_DRIVER", "i40e"),
         native_nic_ifname=os.environ.get("NATIVE_NETWORK_IFNAME", "eth2"),
         dpdk_nic_driver=os.environ.get("DPDK_NETWORK_DRIVER", "igb_uio"),
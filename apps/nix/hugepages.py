@@ -0,0 +1,234 @@
+import glob
+import math
+import os
+import re
+import sys
+from dataclasses import dataclass
+from typing import List, Optional
+
+from helpers import run
+
+GiB = 1024 * 1024 * 1024
+MiB = 1024 * 1024
+KiB = 1024
+
+# Requirements of src/main/spdk_hugetbl.c: a data pool of 1023 x 2 MiB, two
+# 1 GiB DMA allocations that are only made in full if 4 GiB remain besides
+# them, and 128 MiB of DPDK DMA memory for the enclave. The allocation fails
+# below 2 GiB.
+SPDK_DATA_POOL = 1023 * 2 * MiB
+SPDK_DMA = 2 * GiB
+DPDK_DMA = 128 * MiB
+# sgx-lkl-userpci creates a tx mempool per port and an rx mempool per queue,
+# each of DPDK_MBUF_NUM mbufs of DPDK_MBUF_SIZ, see src/include/dpdk_config.h
+DPDK_MBUF_NUM = 512 * 4
+DPDK_MBUF_SIZ = 64 * KiB
+# EAL memzones, rings and mempool headers
+EAL_OVERHEAD = 256 * MiB
+# same as the old "total memory minus 6 GB" rule, but per node
+SYSTEM_RESERVE = 6 * GiB
+# default of SGXLKL_HEAP, see src/main/sgxlkl_config.h
+DEFAULT_HEAP = 200 * MiB
+
+NODE_PATH = "/sys/devices/system/node"
+
+
+def dpdk_mempools(queues: int) -> int:
+    return (queues + 1) * DPDK_MBUF_NUM * DPDK_MBUF_SIZ
+
+
+def dma_memory(queues: int = 1) -> int:
+    """
+    Huge pages needed by SPDK and DPDK with the given number of rx queues;
+    the mempools of sgx-lkl-userpci share what SPDK leaves to DPDK
+    """
+    dpdk = DPDK_DMA + dpdk_mempools(queues)
+    return max(SPDK_DMA + 4 * GiB, SPDK_DATA_POOL + SPDK_DMA + dpdk) + EAL_OVERHEAD
+
+
+def parse_size(size: str) -> int:
+    """Sizes as accepted by sgx-lkl, i.e. 2G, 512M or plain bytes"""
+    match = re.fullmatch(r"(\d+)\s*([kKmMgG]?)[bB]?", size.strip())
+    if not match:
+        raise ValueError(f"invalid size: {size}")
+    unit = dict(k=KiB, m=MiB, g=GiB).get(match.group(2).lower(), 1)
+    return int(match.group(1)) * unit
+
+
+def read_int(path: str) -> int:
+    with open(path) as f:
+        return int(f.read().strip())
+
+
+def nodes() -> List[int]:
+    paths = glob.glob(f"{NODE_PATH}/node[0-9]*")
+    return sorted(int(os.path.basename(p)[len("node"):]) for p in paths)
+
+
+def page_sizes(node: int) -> List[int]:
+    """Supported huge page sizes of a node in bytes, largest first"""
+    sizes = []
+    for path in glob.glob(f"{NODE_PATH}/node{node}/hugepages/hugepages-*kB"):
+        sizes.append(int(os.path.basename(path)[len("hugepages-"):-len("kB")]) * KiB)
+    return sorted(sizes, reverse=True)
+
+
+def hugepages_path(node: int, page_size: int) -> str:
+    return f"{NODE_PATH}/node{node}/hugepages/hugepages-{page_size // KiB}kB"
+
+
+def node_memory(node: int) -> int:
+    with open(f"{NODE_PATH}/node{node}/meminfo") as f:
+        for line in f:
+            # Node 0 MemTotal:       65854412 kB
+            fields = line.split()
+            if fields[2] == "MemTotal:":
+                return int(fields[3]) * KiB
+    raise RuntimeError(f"MemTotal entry not found for node {node}")
+
+
+def pci_numa_node(pci_id: Optional[str]) -> Optional[int]:
+    if pci_id is None:
+        return None
+    try:
+        node = read_int(f"/sys/bus/pci/devices/{pci_id}/numa_node")
+    except OSError:
+        return None
+    # -1 on single-node systems
+    return node if node >= 0 else None
+
+
+@dataclass(frozen=True)
+class HugepagePlan:
+    node: int
+    page_size: int
+    pages: int
+
+    @property
+    def size(self) -> int:
+        return self.page_size * self.pages
+
+    def __str__(self) -> str:
+        return f"{self.pages} x {self.page_size // MiB} MiB on node{self.node}"
+
+
+def local_node(pci_ids: List[Optional[str]]) -> int:
+    """
+    Node of the first device that reports one; the DMA buffers of the others
+    are remote, which is worth a warning.
+    """
+    device_nodes = {i: pci_numa_node(i) for i in pci_ids if i is not None}
+    known = [n for n in device_nodes.values() if n is not None]
+    if not known:
+        return nodes()[0]
+    if len(set(known)) > 1:
+        print(f"devices are attached to different NUMA nodes: {device_nodes}", file=sys.stderr)
+    return known[0]
+
+
+def plan_hugepages(need: int, node: int, page_size: int) -> HugepagePlan:
+    sizes = page_sizes(node)
+    if page_size not in sizes:
+        raise RuntimeError(f"node{node} does not support {page_size // KiB} kB pages: {sizes}")
+
+    heap = parse_size(os.environ.get("SGXLKL_HEAP", str(DEFAULT_HEAP)))
+    available = node_memory(node) - SYSTEM_RESERVE - heap
+    if need > available:
+        raise RuntimeError(
+            f"need {need // MiB} MiB of huge pages on node{node}, "
+            f"but only {max(available, 0) // MiB} MiB are left besides the enclave heap"
+        )
+    return HugepagePlan(node, page_size, math.ceil(need / page_size))
+
+
+def apply_plan(plan: HugepagePlan) -> None:
+    """Releases the pages of all other nodes and sizes, then reserves the plan"""
+    script = []
+    for node in nodes():
+        for size in page_sizes(node):
+            if (node, size) != (plan.node, plan.page_size):
+                script.append(f"echo 0 > {hugepages_path(node, size)}/nr_hugepages")
+    script.append(f"echo {plan.pages} > {hugepages_path(plan.node, plan.page_size)}/nr_hugepages")
+    run(["sudo", "sh", "-c", "\n".join(script)])
+
+
+def reserved(node: int, page_size: int) -> int:
+    return read_int(f"{hugepages_path(node, page_size)}/nr_hugepages")
+
+
+def free(node: int, page_size: int) -> int:
+    return read_int(f"{hugepages_path(node, page_size)}/free_hugepages")
+
+
+def mounted_page_size(mountpoint: str) -> Optional[int]:
+    with open("/proc/mounts") as f:
+        for line in f:
+            _, path, fstype, options = line.split()[:4]
+            if path != mountpoint or fstype != "hugetlbfs":
+                continue
+            for option in options.split(","):
+                if option.startswith("pagesize="):
+                    return parse_size(option[len("pagesize="):])
+    return None
+
+
+def current_plan(need: int, pci_ids: List[Optional[str]]) -> Optional[HugepagePlan]:
+    """
+    The reservation in place if it is exactly what reserve_hugepages would
+    set up and none of its pages is in use, otherwise None.
+    """
+    node = local_node(pci_ids)
+    found = None
+    for n in nodes():
+        for size in page_sizes(n):
+            pages = reserved(n, size)
+            if pages == 0:
+                continue
+            if found is not None or n != node or free(n, size) != pages:
+                return None
+            found = HugepagePlan(n, size, pages)
+    if need == 0:
+        return HugepagePlan(node, 2 * MiB, 0) if found is None else None
+    forced = os.environ.get("HUGEPAGE_SIZE")
+    if found is None or (forced and parse_size(forced) != found.page_size):
+        return None
+    if found.pages != math.ceil(need / found.page_size):
+        return None
+    return found
+
+
+def verify_plan(plan: HugepagePlan) -> None:
+    # the kernel silently reserves fewer pages if memory is fragmented
+    got = reserved(plan.node, plan.page_size)
+    if got < plan.pages:
+        raise RuntimeError(f"requested {plan}, but the kernel only reserved {got} pages")
+
+
+def reserve_hugepages(need: int, pci_ids: List[Optional[str]]) -> HugepagePlan:
+    """
+    Reserves at least need bytes of huge pages on the node local to the
+    devices. Uses the largest page size; if the kernel cannot find enough
+    contiguous memory for 1 GiB pages, falls back to the next smaller size.
+    HUGEPAGE_SIZE (e.g. 2M or 1G) forces a page size.
+    """
+    node = local_node(pci_ids)
+    if need == 0:
+        plan = HugepagePlan(node, 2 * MiB, 0)
+        apply_plan(plan)
+        return plan
+
+    forced = os.environ.get("HUGEPAGE_SIZE")
+    sizes = [parse_size(forced)] if forced else page_sizes(node)
+    for size in sizes:
+        plan = plan_hugepages(need, node, size)
+        apply_plan(plan)
+        try:
+            verify_plan(plan)
+        except RuntimeError as e:
+            if size == sizes[-1]:
+                raise
+            print(f"{e}; retry with smaller pages", file=sys.stderr)
+            continue
+        print(f"reserved {plan}")
+        return plan
+    raise RuntimeError(f"node{node} does not support huge pages")
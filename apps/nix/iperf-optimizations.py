@@ -20,25 +20,27 @@ from helpers import (
     spawn,
     RemoteCommand
 )
+from fingerprint import tag_stats
 from network import Network, NetworkKind, setup_remote_network
 
-from iperf import _postprocess_iperf, Benchmark
+from iperf import Benchmark, read_iperf_stats, write_iperf_stats
 
 
 def run_variant(name: str, benchmark: Benchmark, extra_env: Dict[str, str]) -> None:
-    stats_file = f"iperf-{name}.json"
-    stats = read_stats(stats_file)
-    system = set(stats["system"])
+    stats_file = f"iperf-{name}.jsonl"
+    stats = read_iperf_stats(stats_file)
+    system = set(stats.intervals["system"])
     if "sgx-io" in system:
         print(f"skip {name} benchmark")
     else:
         extra_env.update(benchmark.network.setup(NetworkKind.DPDK))
         benchmark.run("iperf-sgx-io", "sgx-io", stats, extra_env=extra_env)
-        write_stats(stats_file, stats)
+        tag_stats(stats.intervals, benchmark.settings)
+        write_iperf_stats(stats_file, stats)
 
     csv = f"iperf-{name}-latest.tsv"
     print(csv)
-    pd.DataFrame(stats).to_csv(csv, index=False, sep="\t")
+    pd.DataFrame(stats.intervals).to_csv(csv, index=False, sep="\t")
 
 
 def main() -> None:
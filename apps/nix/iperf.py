@@ -1,12 +1,13 @@
 #!/usr/bin/env python3
 
+import os
 import sys
 import json
 import subprocess
 import time
 import signal
-from functools import lru_cache
-from typing import Any, Dict, List
+from dataclasses import dataclass
+from typing import Any, Dict, List, Tuple
 
 import pandas as pd
 from helpers import (
@@ -17,47 +18,134 @@ from helpers import (
     create_settings,
     flamegraph_env,
     nix_build,
+    nix_build_all,
     spawn,
     RemoteCommand
 )
-from network import Network, NetworkKind, setup_remote_network
+from dpdk_queues import DEFAULT, queue_configs, record_queue_stats, tag_queues
+from fingerprint import tag_stats
+from sysctl_profiles import LEGACY, sysctl_profiles, tag_sysctl
+from network import MTU, Network, NetworkKind, mtus, nc_command, setup_remote_network
+from result_store import Stats, completed_runs
 
 
-def _postprocess_iperf(
-    raw_data: Dict[str, Any], direction: str, system: str, stats: Dict[str, Any]
-) -> None:
-    for instance in raw_data["instances"]:
-        result = instance["result"]
-        if "error" in result:
-            print(result["error"], file=sys.stderr)
-            sys.exit(1)
-        cpu = result["end"]["cpu_utilization_percent"]
+def parse_instances(output: str) -> List[Dict[str, Any]]:
+    """One json object per line and instance, see parallel-iperf.py"""
+    return [json.loads(line) for line in output.splitlines() if line.startswith("{")]
+
+
+def iperf_instances() -> List[int]:
+    """Numbers of parallel instances to sweep, i.e. IPERF_INSTANCES=1,2,4,8,16"""
+    value = os.environ.get("IPERF_INSTANCES", "1")
+    try:
+        return [int(v) for v in value.split(",")]
+    except ValueError:
+        raise RuntimeError(f"IPERF_INSTANCES must be a list of numbers, got {value}")
+
+
+def jain_fairness(throughputs: List[float]) -> float:
+    """1 if all streams get the same share, 1/n if one stream gets everything"""
+    square_sum = sum(t * t for t in throughputs)
+    if square_sum == 0:
+        return 0.0
+    return sum(throughputs) ** 2 / (len(throughputs) * square_sum)
+
+
+def summarize_iperf(instances: List[Dict[str, Any]]) -> Dict[str, float]:
+    """
+    Totals of one run over all instances that did not fail. iperf3 reports
+    the cpu usage of its own process: the clients are separate processes and
+    add up, while all instances share one multi-threaded server process.
+    """
+    succeeded = [i for i in instances if "error" not in i["result"]]
+    if not succeeded:
+        raise RuntimeError(f"all {len(instances)} iperf instances failed")
+    streams = pd.json_normalize(succeeded, record_path=["result", "end", "streams"])
+    gbps = streams["receiver.bits_per_second"] / 1e9
+    cpu = pd.DataFrame([i["result"]["end"]["cpu_utilization_percent"] for i in succeeded])
+    return {
+        "instances": len(instances),
+        "failed-instances": len(instances) - len(succeeded),
+        "aggregate-gbps": float(gbps.sum()),
+        "min-stream-gbps": float(gbps.min()),
+        "max-stream-gbps": float(gbps.max()),
+        "fairness": jain_fairness(gbps.tolist()),
+        "client-cpu": float(cpu["host_total"].sum()),
+        "server-cpu": float(cpu["remote_total"].max()),
+    }
+
+
+@dataclass
+class IperfStats:
+    """
+    The tables of one result file, linked by run-id: throughput per
+    instance and interval (iperf.jsonl), per stream and interval
+    (iperf-streams.jsonl) and one row of totals per run (iperf-runs.jsonl).
+    All tables share their tags.
+    """
+
+    intervals: Stats
+    streams: Stats
+    runs: Stats
 
-        for interval in result["intervals"]:
-            for key in cpu.keys():
-                stats[f"cpu_{key}"].append(cpu[key])
 
-            moved_bytes = 0
-            seconds = 0.0
-            for stream in interval["streams"]:
-                moved_bytes += stream["bytes"]
-                seconds += stream["seconds"]
+def table_paths(path: str) -> Tuple[str, str, str]:
+    base = path[: -len(".jsonl")]
+    return path, f"{base}-streams.jsonl", f"{base}-runs.jsonl"
 
-            seconds /= len(interval["streams"])
 
-            start = int(interval["streams"][0]["start"])
-            stats["interval"].append(start)
-            stats["port"].append(instance["port"])
-            stats["system"].append(system)
-            stats["bytes"].append(moved_bytes)
-            stats["seconds"].append(seconds)
-            stats["direction"].append(direction)
+def read_iperf_stats(path: str) -> IperfStats:
+    intervals, streams, runs = (read_stats(p) for p in table_paths(path))
+    streams.tags = runs.tags = intervals.tags
+    return IperfStats(intervals, streams, runs)
 
 
-@lru_cache(maxsize=1)
-def nc_command(settings: Settings) -> RemoteCommand:
-    path = nix_build("netcat-native")
-    return settings.remote_command(path)
+def write_iperf_stats(path: str, stats: IperfStats) -> None:
+    for table, table_path in zip([stats.intervals, stats.streams, stats.runs], table_paths(path)):
+        write_stats(table_path, table)
+
+
+def _records(df: pd.DataFrame) -> List[Dict[str, Any]]:
+    # python scalars for json, None instead of NaN for fields a stream lacks
+    return df.astype(object).where(df.notna(), None).to_dict("records")
+
+
+def _postprocess_iperf(
+    instances: List[Dict[str, Any]], direction: str, system: str, stats: IperfStats
+) -> None:
+    for instance in instances:
+        if "error" in instance["result"]:
+            print(f"iperf on port {instance['port']}: {instance['result']['error']}", file=sys.stderr)
+    summary = summarize_iperf(instances)
+    # the totals count the failed instances, the tables leave them out
+    instances = [i for i in instances if "error" not in i["result"]]
+    run = {"system": system, "direction": direction, "run-id": f"{NOW}-{stats.runs.num_rows()}"}
+
+    streams = pd.concat(
+        [
+            pd.json_normalize(i["result"]["intervals"], record_path="streams").assign(port=i["port"])
+            for i in sorted(instances, key=lambda i: i["port"])
+        ],
+        ignore_index=True,
+    )
+    streams["interval"] = streams["start"].astype(int)
+    intervals = (
+        streams.groupby(["port", "interval"])
+        .agg(bytes=("bytes", "sum"), seconds=("seconds", "mean"))
+        .reset_index()
+    )
+    stats.intervals.append_rows(_records(intervals.assign(**run)))
+    stats.streams.append_rows(_records(streams.assign(**run)))
+
+    cpu = [dict(port=i["port"], **i["result"]["end"]["cpu_utilization_percent"]) for i in instances]
+    stats.runs.append_rows([dict(run, cpu=cpu, **summary)])
+    print(
+        f"[iperf-{direction}-{system}] {summary['instances']} instances "
+        f"({summary['failed-instances']} failed): "
+        f"{summary['aggregate-gbps']:.2f} Gbps, fairness {summary['fairness']:.3f}, "
+        f"server cpu {summary['server-cpu']:.0f}%"
+    )
+
 
 def check_port(nc: RemoteCommand, settings: Settings) -> bool:
     try:
@@ -82,46 +170,61 @@ class Benchmark():
         self.network = Network(settings)
         self.parallel_iperf = self.settings.remote_command(nix_build("parallel-iperf"))
         self.iperf_client = self.settings.remote_command(nix_build("iperf-client"))
+        # parallel iperf3 instances, each on its own port
+        self.instances = 1
+        # remote cpus the clients are pinned to, i.e. 0-3; not pinned if empty
+        self.client_cpus = os.environ.get("IPERF_CLIENT_CPUS", "")
+        self.queue_config = DEFAULT
+        # read back after the last run
+        self.sysctls: Dict[str, str] = {}
 
     def _run(
             self,
             local_iperf: str,
             direction: str,
             system: str,
-            stats: Dict[str, List[int]],
+            stats: IperfStats,
             extra_env: Dict[str, str] = {}) -> None:
         env = extra_env.copy()
         env.update(flamegraph_env(f"iperf-{direction}-{system}-{NOW}"))
+        queue_stats = os.path.abspath(f"dpdk-stats-iperf-{direction}-{NOW}.json")
+        if system == "sgx-io":
+            env.update(self.queue_config.env(queue_stats))
         iperf = f"{self.iperf_client.nix_path}/bin/iperf3"
         fast_ssl = dict(OPENSSL_ia32cap="0x5640020247880000:0x40128")
         env.update(fast_ssl)
         if check_port(nc_command, self.settings):
             print("There is already an iperf instance running", file=sys.stderr)
             sys.exit(1)
-        with spawn(local_iperf, "bin/iperf3", "1", extra_env=env) as iperf_server:
-            for i in range(60):
-                if check_port(nc_command, self.settings):
-                    break
-                status = iperf_server.poll()
-                if status is not None:
-                    raise OSError(f"iperf exiteded with {status}")
-                time.sleep(1)
-                if i == 59:
-                    stop_process(iperf_server)
-                    raise OSError(f"Could not connect to iperf after 1 min")
+        log = f"iperf-{direction}-{system}-{NOW}.log.gz"
+        instances = str(self.instances)
+        with spawn(local_iperf, "bin/iperf3", instances, extra_env=env, log=log) as iperf_server:
+            try:
+                self.network.wait_for_port(iperf_server, 5201, "iperf")
+            except TimeoutError:
+                stop_process(iperf_server)
+                raise OSError(f"Could not connect to iperf after 1 min")
 
             iperf_args = ["client", "-c", self.settings.local_dpdk_ip, "--json", "-t", "10"]
             if direction == "send":
                 iperf_args += ["-R"]
 
-            parallel_iperf = self.parallel_iperf.run("bin/parallel-iperf", ["1", iperf] + iperf_args, extra_env=fast_ssl)
-            _postprocess_iperf(json.loads(parallel_iperf.stdout), direction, system, stats)
+            pinning = ["--cpus", self.client_cpus] if self.client_cpus else []
+            parallel_iperf = self.parallel_iperf.run(
+                "bin/parallel-iperf", pinning + [instances, iperf] + iperf_args, extra_env=fast_ssl
+            )
+            _postprocess_iperf(parse_instances(parallel_iperf.stdout), direction, system, stats)
             stop_process(iperf_server)
+        self.sysctls = self.network.effective_sysctls(log)
+        if system == "sgx-io":
+            record_queue_stats(
+                queue_stats, self.queue_config, f"iperf-{direction}", dict(system=system, run=NOW)
+            )
 
     def run(self,
             attr: str,
             system: str,
-            stats: Dict[str, List[int]],
+            stats: IperfStats,
             extra_env: Dict[str, str] = {}) -> None:
         local_iperf = nix_build(attr)
 
@@ -132,32 +235,30 @@ class Benchmark():
         self._run(local_iperf, "receive", system, stats, extra_env)
 
 
-def benchmark_native(benchmark: Benchmark, stats: Dict[str, List[int]]) -> None:
+def benchmark_native(benchmark: Benchmark, stats: IperfStats) -> None:
     extra_env = benchmark.network.setup(NetworkKind.NATIVE)
     benchmark.run("iperf-native", "native", stats, extra_env=extra_env)
 
 
-def benchmark_scone(benchmark: Benchmark, stats: Dict[str, List[int]]) -> None:
+def benchmark_scone(benchmark: Benchmark, stats: IperfStats) -> None:
     extra_env = benchmark.network.setup(NetworkKind.NATIVE)
     benchmark.run("iperf-scone", "scone", stats, extra_env=extra_env)
 
 
-def benchmark_sgx_lkl(benchmark: Benchmark, stats: Dict[str, List[int]]) -> None:
+def benchmark_sgx_lkl(benchmark: Benchmark, stats: IperfStats) -> None:
     extra_env = benchmark.network.setup(NetworkKind.TAP)
     benchmark.run("iperf-sgx-lkl", "sgx-lkl", stats, extra_env=extra_env)
 
 
-def benchmark_sgx_io(benchmark: Benchmark, stats: Dict[str, List[int]]) -> None:
+def benchmark_sgx_io(benchmark: Benchmark, stats: IperfStats) -> None:
     extra_env = benchmark.network.setup(NetworkKind.DPDK)
     benchmark.run("iperf-sgx-io", "sgx-io", stats, extra_env=extra_env)
 
 
 def main() -> None:
-    stats = read_stats("iperf.json")
+    stats = read_iperf_stats("iperf.jsonl")
     settings = create_settings()
-    setup_remote_network(settings)
 
-    benchmark = Benchmark(settings)
     benchmarks = {
         "native": benchmark_native,
         "sgx-io": benchmark_sgx_io,
@@ -165,17 +266,58 @@ def main() -> None:
         "scone": benchmark_scone,
     }
 
-    system = set(stats["system"])
+    # queues and enclave threads only matter for the DPDK path
+    configs = queue_configs()
+    profiles = sysctl_profiles()
+    sizes = mtus()
+    counts = iperf_instances()
+    done = completed_runs(
+        stats.intervals,
+        {
+            "system": None,
+            "dpdk-queues": DEFAULT.queues,
+            "ethreads": DEFAULT.ethreads,
+            "sysctl-profile": LEGACY,
+            "mtu": MTU,
+            "instances": 1,
+        },
+    )
+    runs = {
+        name: [
+            (p, mtu, c, n)
+            for p in profiles
+            for mtu in sizes
+            for c in (configs if name == "sgx-io" else [DEFAULT])
+            for n in counts
+            if (name, c.queues, c.ethreads, p.tag, mtu, n) not in done
+        ]
+        for name in benchmarks
+    }
+    settings.prefetch_remote(["parallel-iperf", "iperf-client", "netcat-native"])
+    nix_build_all([f"iperf-{name}" for name, todo in runs.items() if todo])
+    benchmark = Benchmark(settings)
     for name, benchmark_func in benchmarks.items():
-        if name in system:
+        if not runs[name]:
             print(f"skip {name} benchmark")
-            continue
-        benchmark_func(benchmark, stats)
-        write_stats("iperf.json", stats)
+        for sysctl_profile, mtu, config, instances in runs[name]:
+            setup_remote_network(settings, mtu)
+            benchmark.network.sysctl_profile = sysctl_profile
+            benchmark.network.mtu = mtu
+            benchmark.queue_config = config
+            benchmark.network.dpdk_queues = config.queues
+            benchmark.instances = instances
+            benchmark_func(benchmark, stats)
+            # the tables share their tags
+            tag_queues(stats.intervals, config if name == "sgx-io" else None)
+            tag_sysctl(stats.intervals, sysctl_profile, benchmark.sysctls)
+            stats.intervals.tags["mtu"] = mtu
+            stats.intervals.tags["instances"] = instances
+            tag_stats(stats.intervals, settings)
+            write_iperf_stats("iperf.jsonl", stats)
 
     csv = f"iperf-latest.tsv"
     print(csv)
-    pd.DataFrame(stats).to_csv(csv, index=False, sep="\t")
+    pd.DataFrame(stats.intervals).to_csv(csv, index=False, sep="\t")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,65 @@
+"""
+Aggregate throughput, fairness and cpu usage per number of parallel iperf3
+instances, and the instance count at which throughput saturates:
+
+    IPERF_INSTANCES=1,2,4,8,16 DPDK_ETHREADS=1,2,4 python3 iperf.py
+    python3 iperf_scaling.py iperf-runs.jsonl
+"""
+
+import os
+import sys
+from typing import List
+
+import pandas as pd
+
+from result_store import ResultStore
+
+# configurations that are compared across instance counts
+GROUP = ["system", "direction", "dpdk-queues", "ethreads", "mtu", "sysctl-profile"]
+METRICS = ["aggregate-gbps", "min-stream-gbps", "fairness", "client-cpu", "server-cpu"]
+# throughput within this fraction of the best counts as saturated
+SATURATION = 0.95
+
+
+def scaling_table(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.dropna(subset=["aggregate-gbps"]).copy()
+    group = [c for c in GROUP if c in df.columns]
+    # runs without DPDK have no queue and thread tags
+    df[group] = df[group].fillna("-").astype(str)
+    # older iperf.jsonl files repeat the totals on every row of a run
+    table = df.groupby(group + ["instances"])[METRICS].mean().reset_index()
+    return table.sort_values(group + ["instances"])
+
+
+def saturation_points(table: pd.DataFrame) -> pd.DataFrame:
+    """Smallest instance count per configuration that reaches SATURATION of its best"""
+    group = [c for c in GROUP if c in table.columns]
+    rows: List[pd.Series] = []
+    for _, runs in table.groupby(group):
+        best = runs["aggregate-gbps"].max()
+        saturated = runs[runs["aggregate-gbps"] >= SATURATION * best]
+        rows.append(saturated.iloc[0])
+    return pd.DataFrame(rows)[group + ["instances", "aggregate-gbps"]]
+
+
+def main() -> None:
+    if len(sys.argv) != 2:
+        print(f"USAGE: {sys.argv[0]} iperf-runs.jsonl", file=sys.stderr)
+        sys.exit(1)
+    path = sys.argv[1]
+    df = pd.DataFrame(ResultStore(path).read())
+    if "aggregate-gbps" not in df.columns:
+        print(f"{path} has no runs with totals, rerun iperf.py", file=sys.stderr)
+        sys.exit(1)
+    table = scaling_table(df)
+    print(table.to_string(index=False))
+    print()
+    print("saturated at:")
+    print(saturation_points(table).to_string(index=False))
+    csv = os.path.basename(path).split(".")[0] + "-instance-scaling.tsv"
+    print(csv)
+    table.to_csv(csv, index=False, sep="\t")
+
+
+if __name__ == "__main__":
+    main()
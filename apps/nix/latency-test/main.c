@@ -1,6 +1,11 @@
+#include <errno.h>
+#include <inttypes.h>
 #include <netinet/in.h>
+#include <netinet/tcp.h>
 #include <pthread.h>
+#include <stdint.h>
 #include <stdio.h>
+#include <time.h>
 #include <sys/socket.h>
 #include <sys/types.h>
 #include <arpa/inet.h>
@@ -123,10 +128,256 @@ int client(in_addr_t addr) {
   }
 }
 
+/*
+ * Ping-pong round trips over TCP or UDP. The server echoes everything it
+ * receives on PORT (both protocols):
+ *
+ *   latency-test server PORT
+ *
+ * The client sends one SIZE byte message at a time for SECONDS and records
+ * each round trip in a log-linear histogram with 3 significant digits (as
+ * HdrHistogram does). The non-empty buckets are printed as [ns, count]:
+ *
+ *   latency-test ping tcp|udp HOST PORT SIZE SECONDS
+ */
+
+#define MAX_MESSAGE 65507
+/* round trips before recording starts */
+#define WARMUP 1000
+
+#define HIST_SUB_BITS 11
+#define HIST_SUB_COUNT (1 << HIST_SUB_BITS)
+#define HIST_HALF (HIST_SUB_COUNT / 2)
+#define HIST_BUCKETS (HIST_SUB_COUNT + (64 - HIST_SUB_BITS) * HIST_HALF)
+
+static uint64_t histogram[HIST_BUCKETS];
+
+static size_t hist_index(uint64_t v) {
+  if (v < HIST_SUB_COUNT) {
+    return v;
+  }
+  int shift = 63 - __builtin_clzll(v) - (HIST_SUB_BITS - 1);
+  return HIST_SUB_COUNT + (shift - 1) * HIST_HALF + ((v >> shift) - HIST_HALF);
+}
+
+/* lowest value that falls into bucket i */
+static uint64_t hist_value(size_t i) {
+  if (i < HIST_SUB_COUNT) {
+    return i;
+  }
+  size_t shift = (i - HIST_SUB_COUNT) / HIST_HALF + 1;
+  return (uint64_t)(HIST_HALF + (i - HIST_SUB_COUNT) % HIST_HALF) << shift;
+}
+
+static uint64_t now_ns(void) {
+  struct timespec ts;
+  clock_gettime(CLOCK_MONOTONIC, &ts);
+  return (uint64_t)ts.tv_sec * 1000000000ULL + ts.tv_nsec;
+}
+
+static void *echo_stream(void *arg) {
+  int fd = (int)(intptr_t)arg;
+  char *buf = malloc(MAX_MESSAGE);
+  ssize_t n;
+  while (buf && (n = read(fd, buf, MAX_MESSAGE)) > 0) {
+    for (ssize_t off = 0; off < n;) {
+      ssize_t w = write(fd, buf + off, n - off);
+      if (w <= 0) {
+        goto out;
+      }
+      off += w;
+    }
+  }
+out:
+  free(buf);
+  close(fd);
+  return NULL;
+}
+
+static void *echo_datagrams(void *arg) {
+  int fd = (int)(intptr_t)arg;
+  static char buf[MAX_MESSAGE];
+  for (;;) {
+    struct sockaddr_in peer;
+    socklen_t len = sizeof(peer);
+    ssize_t n = recvfrom(fd, buf, sizeof(buf), 0, (struct sockaddr *)&peer, &len);
+    if (n == -1) {
+      perror("recvfrom");
+      return NULL;
+    }
+    sendto(fd, buf, n, 0, (struct sockaddr *)&peer, len);
+  }
+}
+
+static int bind_socket(int type, int port) {
+  struct sockaddr_in addr = {
+    .sin_family = AF_INET,
+    .sin_port = htons(port),
+    .sin_addr.s_addr = htonl(INADDR_ANY),
+  };
+  int one = 1;
+  int fd = socket(AF_INET, type, 0);
+  if (fd == -1) {
+    perror("socket");
+    return -1;
+  }
+  setsockopt(fd, SOL_SOCKET, SO_REUSEADDR, &one, sizeof(one));
+  if (bind(fd, (struct sockaddr *)&addr, sizeof(addr)) == -1) {
+    perror("bind");
+    return -1;
+  }
+  return fd;
+}
+
+static int server(int port) {
+  pthread_t thread;
+  int one = 1;
+  int udp = bind_socket(SOCK_DGRAM, port);
+  int tcp = bind_socket(SOCK_STREAM, port);
+  if (udp == -1 || tcp == -1) {
+    return 1;
+  }
+  if (listen(tcp, 16) == -1) {
+    perror("listen");
+    return 1;
+  }
+  pthread_create(&thread, NULL, echo_datagrams, (void *)(intptr_t)udp);
+  printf("listening on port %d\n", port);
+  fflush(stdout);
+  for (;;) {
+    int fd = accept(tcp, NULL, NULL);
+    if (fd == -1) {
+      perror("accept");
+      continue;
+    }
+    setsockopt(fd, IPPROTO_TCP, TCP_NODELAY, &one, sizeof(one));
+    pthread_create(&thread, NULL, echo_stream, (void *)(intptr_t)fd);
+    pthread_detach(thread);
+  }
+}
+
+/* returns the round trip in ns, 0 if the datagram was lost */
+static uint64_t round_trip(int fd, int udp, char *msg, char *reply, size_t size, uint64_t seq) {
+  memcpy(msg, &seq, sizeof(seq));
+  uint64_t start = now_ns();
+  if (write(fd, msg, size) != (ssize_t)size) {
+    perror("write");
+    exit(1);
+  }
+  if (udp) {
+    for (;;) {
+      ssize_t n = recv(fd, reply, size, 0);
+      if (n == -1) {
+        if (errno == EAGAIN || errno == EWOULDBLOCK) {
+          return 0;
+        }
+        perror("recv");
+        exit(1);
+      }
+      /* skip late replies to pings that already timed out */
+      if ((size_t)n == size && memcmp(reply, &seq, sizeof(seq)) == 0) {
+        break;
+      }
+    }
+  } else {
+    for (size_t off = 0; off < size;) {
+      ssize_t n = read(fd, reply + off, size - off);
+      if (n <= 0) {
+        perror("read");
+        exit(1);
+      }
+      off += n;
+    }
+  }
+  return now_ns() - start;
+}
+
+static int ping(const char *proto, const char *host, int port, size_t size, double seconds) {
+  int udp = strcmp(proto, "udp") == 0;
+  struct sockaddr_in addr = { .sin_family = AF_INET, .sin_port = htons(port) };
+  struct timeval timeout = { .tv_sec = 1 };
+  int one = 1;
+  uint64_t count = 0, lost = 0, sum = 0, min = UINT64_MAX, max = 0;
+
+  if (size < sizeof(uint64_t) || size > MAX_MESSAGE) {
+    fprintf(stderr, "size must be between %zu and %d\n", sizeof(uint64_t), MAX_MESSAGE);
+    return 1;
+  }
+  if (inet_aton(host, &addr.sin_addr) == 0) {
+    fprintf(stderr, "Invalid address\n");
+    return 1;
+  }
+  int fd = socket(AF_INET, udp ? SOCK_DGRAM : SOCK_STREAM, 0);
+  if (fd == -1) {
+    perror("socket");
+    return 1;
+  }
+  if (udp) {
+    setsockopt(fd, SOL_SOCKET, SO_RCVTIMEO, &timeout, sizeof(timeout));
+  } else {
+    setsockopt(fd, IPPROTO_TCP, TCP_NODELAY, &one, sizeof(one));
+  }
+  if (connect(fd, (struct sockaddr *)&addr, sizeof(addr)) == -1) {
+    perror("connect");
+    return 1;
+  }
+  char *msg = calloc(size, 1);
+  char *reply = calloc(size, 1);
+  if (!msg || !reply) {
+    perror("malloc");
+    return 1;
+  }
+
+  uint64_t seq = 0;
+  for (; seq < WARMUP; seq++) {
+    round_trip(fd, udp, msg, reply, size, seq);
+  }
+  uint64_t end = now_ns() + (uint64_t)(seconds * 1e9);
+  while (now_ns() < end) {
+    uint64_t rtt = round_trip(fd, udp, msg, reply, size, seq++);
+    if (rtt == 0) {
+      lost++;
+      continue;
+    }
+    histogram[hist_index(rtt)]++;
+    count++;
+    sum += rtt;
+    min = rtt < min ? rtt : min;
+    max = rtt > max ? rtt : max;
+  }
+
+  printf("<results>\n");
+  printf("{\"proto\": \"%s\", \"size\": %zu, \"count\": %" PRIu64 ", \"lost\": %" PRIu64
+         ", \"min\": %" PRIu64 ", \"max\": %" PRIu64 ", \"mean\": %lf, \"histogram\": [",
+         udp ? "udp" : "tcp", size, count, lost, count ? min : 0, max,
+         count ? (double)sum / count : 0.0);
+  const char *sep = "";
+  for (size_t i = 0; i < HIST_BUCKETS; i++) {
+    if (histogram[i]) {
+      printf("%s[%" PRIu64 ", %" PRIu64 "]", sep, hist_value(i), histogram[i]);
+      sep = ", ";
+    }
+  }
+  printf("]}\n");
+  printf("</results>\n");
+  close(fd);
+  return 0;
+}
+
 int main(int argc, char** argv) {
   in_addr_t addr;
+  if (argc == 3 && strcmp(argv[1], "server") == 0) {
+    return server(atoi(argv[2]));
+  }
+  if (argc == 7 && strcmp(argv[1], "ping") == 0) {
+    return ping(argv[2], argv[3], atoi(argv[4]), strtoul(argv[5], NULL, 10), atof(argv[6]));
+  }
   if (argc != 2) {
-    fprintf(stderr, "%s <dotted-address>\n", argv[0]);
+    fprintf(stderr,
+            "%s <dotted-address>\n"
+            "%s server <port>\n"
+            "%s ping tcp|udp <dotted-address> <port> <size> <seconds>\n",
+            argv[0], argv[0], argv[0]);
     exit(EXIT_FAILURE);
   }
 
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Round-trip latency of ping-pong messages over TCP and UDP between the
+remote host and bin/latency-test, which runs natively, in sgx-lkl over TAP
+and in sgx-io over DPDK:
+
+    LATENCY_PROTOCOLS=tcp,udp LATENCY_SIZES=64,1024 python3 latency.py
+
+Every run stores the full histogram of its round trips (as [ns, count]
+buckets with 3 significant digits) next to the percentiles taken from it.
+"""
+
+import math
+import os
+from typing import Any, Dict, List, Tuple
+
+import pandas as pd
+
+from capture import TaggedParser
+from fingerprint import tag_stats
+from helpers import (
+    NOW,
+    Settings,
+    create_settings,
+    nix_build,
+    nix_build_all,
+    read_stats,
+    spawn,
+    write_stats,
+)
+from network import Network, NetworkKind
+from result_store import Stats, completed_runs
+from sysctl_profiles import tag_sysctl
+
+PORT = 8888
+PROTOCOLS = ["tcp", "udp"]
+PERCENTILES = {"p50": 50.0, "p99": 99.0, "p99.9": 99.9}
+
+# protocol, message size
+Run = Tuple[str, int]
+
+
+def latency_runs() -> List[Run]:
+    """From LATENCY_PROTOCOLS and LATENCY_SIZES"""
+    protocols = os.environ.get("LATENCY_PROTOCOLS", ",".join(PROTOCOLS)).split(",")
+    unknown = [p for p in protocols if p not in PROTOCOLS]
+    if unknown:
+        raise RuntimeError(f"unknown protocols {unknown}, choose from {PROTOCOLS}")
+    value = os.environ.get("LATENCY_SIZES", "64")
+    try:
+        sizes = [int(v) for v in value.split(",")]
+    except ValueError:
+        raise RuntimeError(f"LATENCY_SIZES must be a list of numbers, got {value}")
+    return [(p, s) for p in protocols for s in sizes]
+
+
+def percentile(histogram: List[List[int]], q: float) -> int:
+    """Lowest value of the bucket that holds the q-th percentile"""
+    total = sum(count for _, count in histogram)
+    rank = max(math.ceil(q / 100 * total), 1)
+    seen = 0
+    for value, count in histogram:
+        seen += count
+        if seen >= rank:
+            return value
+    return histogram[-1][0]
+
+
+def summarize_latency(result: Dict[str, Any]) -> Dict[str, Any]:
+    histogram = result["histogram"]
+    if not histogram:
+        raise RuntimeError(f"no {result['proto']} round trip completed")
+    summary = {
+        "proto": result["proto"],
+        "size": result["size"],
+        "count": result["count"],
+        "lost": result["lost"],
+        "mean-us": result["mean"] / 1000,
+        "min-us": result["min"] / 1000,
+        "max-us": result["max"] / 1000,
+        "histogram": histogram,
+    }
+    for name, q in PERCENTILES.items():
+        summary[f"{name}-us"] = percentile(histogram, q) / 1000
+    return summary
+
+
+class Benchmark:
+    def __init__(self, settings: Settings) -> None:
+        self.settings = settings
+        self.network = Network(settings)
+        self.client = settings.remote_command(nix_build("latency-test-client"))
+        self.seconds = os.environ.get("LATENCY_SECONDS", "10")
+        self.runs: List[Run] = []
+        # read back after the last run
+        self.sysctls: Dict[str, str] = {}
+
+    def run(
+        self, attr: str, system: str, stats: Stats, extra_env: Dict[str, str] = {}
+    ) -> None:
+        server = nix_build(attr)
+        host = self.settings.local_dpdk_ip
+        log = f"latency-{system}-{NOW}.log.gz"
+        with spawn(server, "bin/latency-test", "server", str(PORT), extra_env=extra_env, log=log) as proc:
+            self.network.wait_for_port(proc, PORT, "latency-test")
+            for proto, size in self.runs:
+                args = ["ping", proto, host, str(PORT), str(size), self.seconds]
+                out = self.client.run("bin/latency-test", args)
+                parser = TaggedParser("results")
+                for line in out.stdout.splitlines():
+                    for result in parser.feed(line):
+                        row = summarize_latency(result)
+                        stats["system"].append(system)
+                        for k, v in row.items():
+                            stats[k].append(v)
+                        print(
+                            f"[latency-{system}] {proto} {size}B: p50 {row['p50-us']:.1f}us "
+                            f"p99 {row['p99-us']:.1f}us p99.9 {row['p99.9-us']:.1f}us "
+                            f"max {row['max-us']:.1f}us"
+                        )
+        self.sysctls = self.network.effective_sysctls(log)
+
+
+def benchmark_native(benchmark: Benchmark, stats: Stats) -> None:
+    extra_env = benchmark.network.setup(NetworkKind.NATIVE)
+    benchmark.run("latency-test-native", "native", stats, extra_env=extra_env)
+
+
+def benchmark_sgx_lkl(benchmark: Benchmark, stats: Stats) -> None:
+    extra_env = benchmark.network.setup(NetworkKind.TAP)
+    benchmark.run("latency-test-sgx-lkl", "sgx-lkl", stats, extra_env=extra_env)
+
+
+def benchmark_sgx_io(benchmark: Benchmark, stats: Stats) -> None:
+    extra_env = benchmark.network.setup(NetworkKind.DPDK)
+    benchmark.run("latency-test-sgx-io", "sgx-io", stats, extra_env=extra_env)
+
+
+def main() -> None:
+    stats = read_stats("latency.jsonl")
+    settings = create_settings()
+
+    benchmarks = {
+        "native": benchmark_native,
+        "sgx-lkl": benchmark_sgx_lkl,
+        "sgx-io": benchmark_sgx_io,
+    }
+
+    done = completed_runs(stats, {"system": None, "proto": None, "size": None})
+    runs = {
+        name: [r for r in latency_runs() if (name,) + r not in done] for name in benchmarks
+    }
+    settings.prefetch_remote(["latency-test-client", "netcat-native"])
+    nix_build_all([f"latency-test-{name}" for name, todo in runs.items() if todo])
+    benchmark = Benchmark(settings)
+    for name, benchmark_func in benchmarks.items():
+        if not runs[name]:
+            print(f"skip {name} benchmark")
+            continue
+        benchmark.runs = runs[name]
+        benchmark_func(benchmark, stats)
+        tag_sysctl(stats, benchmark.network.sysctl_profile, benchmark.sysctls)
+        tag_stats(stats, settings)
+        write_stats("latency.jsonl", stats)
+
+    csv = "latency-latest.tsv"
+    print(csv)
+    # the histograms only live in the result store
+    pd.DataFrame(stats).drop(columns=["histogram"]).to_csv(csv, index=False, sep="\t")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,7 +5,25 @@ import pandas as pd
 from plot import apply_hatch, catplot
 import os
 
-from graph_utils import apply_aliases, change_width, column_alias, apply_to_graphs
+from graph_utils import (
+    apply_aliases,
+    change_width,
+    column_alias,
+    apply_to_graphs,
+    read_results,
+)
+
+IPERF_COLUMNS = ["system", "direction", "bytes", "seconds"]
+
+
+def read_result(dir: str, name: str, columns: List[str]) -> pd.DataFrame:
+    """Prefers the result store of a benchmark over its tsv export"""
+    store = os.path.join(os.path.realpath(dir), f"{name}.jsonl")
+    if os.path.exists(store):
+        return read_results(store, columns)
+    return read_results(
+        os.path.join(os.path.realpath(dir), f"{name}-latest.tsv"), columns
+    )
 
 
 def preprocess_hdparm(df_col: pd.Series) -> Any:
@@ -143,9 +161,7 @@ def storage_bs_plot(dir: str, graphs: List[Any]) -> None:
 
 
 def smp_plot(dir: str, graphs: List[Any]) -> None:
-    df = pd.read_csv(
-        os.path.join(os.path.realpath(dir), "smp-latest.tsv"), sep="\t"
-    )
+    df = read_result(dir, "smp", ["cores", "job", "read-bw", "write-bw"])
     df = pd.melt(df,
                  id_vars=['cores', 'job'],
                  value_vars=['read-bw', 'write-bw'],
@@ -175,19 +191,19 @@ def smp_plot(dir: str, graphs: List[Any]) -> None:
     graphs.append(g)
 
 
-def read_iperf(path: str, type: str) -> pd.DataFrame:
-    df = pd.read_csv(path, sep="\t")
+def read_iperf(dir: str, name: str, type: str) -> pd.DataFrame:
+    df = read_result(dir, name, IPERF_COLUMNS)
     df = df[df["direction"] == "send"]
     df["iperf-throughput"] = df["bytes"] / df["seconds"] * 8 / 1e9
     return df.assign(type=type)
 
 
 def network_optimization_plot(dir: str, graphs: List[Any]) -> None:
-    df_all = read_iperf(os.path.join(os.path.realpath(dir), "iperf-all-on-latest.tsv"), "offloads+\nzerocopy")
+    df_all = read_iperf(dir, "iperf-all-on", "offloads+\nzerocopy")
 
-    df_offload = read_iperf(os.path.join(os.path.realpath(dir), "iperf-offload_off-latest.tsv"), "no offloads")
+    df_offload = read_iperf(dir, "iperf-offload_off", "no offloads")
 
-    df_zcopy = read_iperf(os.path.join(os.path.realpath(dir), "iperf-zerocopy_off-latest.tsv"), "no zerocopy")
+    df_zcopy = read_iperf(dir, "iperf-zerocopy_off", "no zerocopy")
     df = pd.concat([df_all, df_offload, df_zcopy])
     g = catplot(
         data=apply_aliases(df),
@@ -205,9 +221,7 @@ def network_optimization_plot(dir: str, graphs: List[Any]) -> None:
 
 
 def aesni_plot(dir: str, graphs: List[Any]) -> None:
-    df = pd.read_csv(
-        os.path.join(os.path.realpath(dir), "aesni-latest.tsv"), sep="\t"
-    )
+    df = read_result(dir, "aesni", ["type", "bytes", "time"])
     df = df.assign(aesnithroughput=df.bytes / df.time / 1024 / 1024)
     g = catplot(
         data=apply_aliases(df),
@@ -1,6 +1,5 @@
 import re
 import os
-import subprocess
 from functools import lru_cache
 from typing import Dict, List
 
@@ -11,12 +10,14 @@ from helpers import (
     Settings,
     create_settings,
     nix_build,
+    nix_build_all,
     spawn,
     flamegraph_env,
     read_stats,
     write_stats,
     scone_env
 )
+from fingerprint import tag_stats
 from network import Network, NetworkKind, setup_remote_network
 from storage import Storage, StorageKind
 
@@ -27,12 +28,6 @@ def sysbench_command(settings: Settings) -> RemoteCommand:
     return settings.remote_command(path)
 
 
-@lru_cache(maxsize=1)
-def nc_command(settings: Settings) -> RemoteCommand:
-    path = nix_build("netcat-native")
-    return settings.remote_command(path)
-
-
 def parse_sysbench(output: str) -> Dict[str, str]:
     stats_found = False
     section = ""
@@ -59,12 +54,13 @@ def parse_sysbench(output: str) -> Dict[str, str]:
     return data
 
 
-def process_sysbench(output: str, system: str, stats: Dict[str, List]) -> None:
+def process_sysbench(output: str, system: str, stats: Dict[str, List], time_to_ready: float) -> None:
     data = parse_sysbench(output)
 
     for k, v in data.items():
         stats[k].append(v)
     stats["system"].append(system)
+    stats["time-to-ready"].append(time_to_ready)
 
 
 class Benchmark:
@@ -93,7 +89,8 @@ class Benchmark:
             f"--datadir={mnt}/var/lib/mysql",
             "--socket=/tmp/mysql.sock",
             extra_env=env,
-        ):
+            log=f"mysql-{system}-{NOW}.log.gz",
+        ) as mysqld:
             common_flags = [
                 f"--mysql-host={self.settings.local_dpdk_ip}",
                 "--mysql-db=root",
@@ -104,19 +101,12 @@ class Benchmark:
                 f"{sysbench.nix_path}/share/sysbench/oltp_read_write.lua",
             ]
 
-            while True:
-                try:
-                    proc = nc_command(self.settings).run(
-                        "bin/nc", ["-z", "-v", self.settings.local_dpdk_ip, "3306"]
-                    )
-                    break
-                except subprocess.CalledProcessError:
-                    print(".")
-                    pass
+            # mysqld may need to initialize its data directory first
+            time_to_ready = self.network.wait_for_port(mysqld, 3306, "mysqld", deadline=300.0)
 
             sysbench.run("bin/sysbench", common_flags + ["prepare"])
             proc = sysbench.run("bin/sysbench", common_flags + ["run"])
-            process_sysbench(proc.stdout, system, stats)
+            process_sysbench(proc.stdout, system, stats, time_to_ready)
             sysbench.run("bin/sysbench", common_flags + ["cleanup"])
 
 
@@ -156,7 +146,7 @@ def benchmark_scone(benchmark: Benchmark, stats: Dict[str, List]) -> None:
 
 
 def main() -> None:
-    stats = read_stats("mysql.json")
+    stats = read_stats("mysql.jsonl")
 
     settings = create_settings()
     benchmark = Benchmark(settings)
@@ -171,12 +161,17 @@ def main() -> None:
     setup_remote_network(settings)
 
     system = set(stats["system"])
+    settings.prefetch_remote(["netcat-native", "sysbench"])
+    nix_build_all(
+        ["iotest-image"] + [f"mysql-{name}" for name in benchmarks if name not in system]
+    )
     for name, benchmark_func in benchmarks.items():
         if name in system:
             print(f"skip {name} benchmark")
             continue
         benchmark_func(benchmark, stats)
-        write_stats("mysql.json", stats)
+        tag_stats(stats, settings)
+        write_stats("mysql.jsonl", stats)
 
     csv = f"mysql-{NOW}.tsv"
     print(csv)
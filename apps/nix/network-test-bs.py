@@ -15,8 +15,10 @@ from helpers import (
     read_stats,
     write_stats,
     spawn,
-    run as helper_run,
+    ssh_session,
+    remote_store,
 )
+from fingerprint import tag_stats
 from storage import Storage, StorageKind
 from network import Network, NetworkKind, setup_remote_network, remote_cmd
 
@@ -43,7 +45,8 @@ class Benchmark:
         batch_size = [4, 8, 16, 32, 64, 128, 256, 512] # in KiB
         #batch_size = [4, 8] # in KiB
 
-        helper_run(["nix", "copy", self.local_nc, "--to", f"ssh://{self.settings.remote_ssh_host}"])
+        session = ssh_session(self.settings.remote_ssh_host)
+        remote_store(self.settings.remote_ssh_host).copy([self.local_nc])
 
         nc_cmds = [
             ["while", "true"],
@@ -52,7 +55,7 @@ class Benchmark:
         ]
         nc_command = "; ".join(map(lambda cmd: " ".join(cmd), nc_cmds))
 
-        with spawn("ssh", self.settings.remote_ssh_host, "--", nc_command) as remote_nc_proc:
+        with spawn(*session.command([nc_command])) as remote_nc_proc:
             for bs in batch_size:
                 #while True:
                 #    try:
@@ -107,7 +110,7 @@ def benchmark_nw_test_sgx_io(benchmark: Benchmark, stats: Dict[str, List]) -> No
     benchmark.run("network-test-sgx-io", "sgx-io", stats, extra_env=extra_env)
 
 def main() -> None:
-    stats = read_stats("network-test-bs.json")
+    stats = read_stats("network-test-bs.jsonl")
     settings = create_settings()
     setup_remote_network(settings)
 
@@ -124,7 +127,8 @@ def main() -> None:
             print(f"skip {name} benchmark")
             continue
         bench_func(benchmark, stats)
-        write_stats("network-test-bs.json", stats)
+        tag_stats(stats, settings)
+        write_stats("network-test-bs.jsonl", stats)
 
     csv = f"network-test-bs-{NOW}.tsv"
     throughput_df = pd.DataFrame(stats)
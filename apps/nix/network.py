@@ -1,10 +1,28 @@
 import getpass
+import ipaddress
+import json
+import os
 import subprocess
+import time
+from dataclasses import dataclass, field, replace
 from enum import Enum
-from typing import List, Dict
+from functools import lru_cache
+from typing import List, Dict, Optional, Set
 
-from helpers import ROOT, Settings, nix_build, run
+from helpers import ROOT, RemoteCommand, Settings, nix_build, run, ssh_session
+from privileged import Batch, Step
+from readiness import wait_for_port
 from storage import setup_hugepages, StorageKind
+from sysctl_profiles import (
+    SysctlProfile,
+    enclave_sysctls,
+    host_sysctls,
+    sysctl_changes,
+    sysctl_profiles,
+)
+
+BRIDGE = "iperf-br"
+MTU = 1500
 
 
 class NetworkKind(Enum):
@@ -18,43 +36,245 @@ def ip(args: List[str]) -> None:
     run(["sudo", "ip"] + args)
 
 
+@dataclass
+class Link:
+    ifname: str
+    # "tun" or "bridge" for links we create, None for the physical NIC (any kind)
+    kind: Optional[str] = None
+    mtu: int = MTU
+    up: bool = True
+    master: Optional[str] = None
+    # global addresses in cidr notation; None means "leave as is"
+    addrs: Optional[Set[str]] = field(default_factory=set)
+    owner: Optional[str] = None
+
+
+def normalize_cidr(cidr: str) -> str:
+    return str(ipaddress.ip_interface(cidr))
+
+
+def parse_links(output: str) -> Dict[str, Link]:
+    """Links and their addresses from `ip -d -j addr show`"""
+    links = {}
+    for l in json.loads(output):
+        info = l.get("linkinfo", {})
+        addrs = {
+            normalize_cidr(f"{a['local']}/{a['prefixlen']}")
+            for a in l.get("addr_info", [])
+            if a.get("scope") == "global"
+        }
+        links[l["ifname"]] = Link(
+            l["ifname"],
+            kind=info.get("info_kind"),
+            mtu=l["mtu"],
+            up="UP" in l["flags"],
+            master=l.get("master"),
+            addrs=addrs,
+            owner=info.get("info_data", {}).get("user"),
+        )
+    return links
+
+
+def read_links() -> Dict[str, Link]:
+    """Current links as reported by netlink"""
+    return parse_links(run(["ip", "-d", "-j", "addr", "show"]).stdout)
+
+
+def link_changes(current: Optional[Link], desired: Link) -> List[Step]:
+    """ip(8) commands that turn current into desired, each with its inverse"""
+    name = desired.ifname
+    steps = []
+    if current is not None and (
+        (desired.kind is not None and current.kind != desired.kind)
+        or (current.owner is not None and desired.owner is not None and current.owner != desired.owner)
+    ):
+        steps.append(Step(["ip", "link", "del", name]))
+        current = None
+    if current is None:
+        if desired.kind == "tun":
+            cmd = ["ip", "tuntap", "add", "dev", name, "mode", "tap", "user", str(desired.owner)]
+        elif desired.kind == "bridge":
+            cmd = ["ip", "link", "add", "name", name, "mtu", str(desired.mtu), "type", "bridge"]
+        else:
+            raise RuntimeError(f"interface {name} does not exist")
+        steps.append(Step(cmd, undo=["ip", "link", "del", name]))
+        mtu = desired.mtu if desired.kind == "bridge" else 0
+        # everything else is undone by deleting the link
+        current = Link(name, desired.kind, mtu=mtu, up=False)
+        created = True
+    else:
+        created = False
+
+    def change(cmd: List[str], undo: List[str]) -> None:
+        steps.append(Step(["ip"] + cmd, None if created else ["ip"] + undo))
+
+    if current.mtu != desired.mtu:
+        change(
+            ["link", "set", "dev", name, "mtu", str(desired.mtu)],
+            ["link", "set", "dev", name, "mtu", str(current.mtu)],
+        )
+    if current.master != desired.master:
+        def master(m: Optional[str]) -> List[str]:
+            if m is None:
+                return ["link", "set", "dev", name, "nomaster"]
+            return ["link", "set", "dev", name, "master", m]
+        change(master(desired.master), master(current.master))
+    if desired.addrs is not None and current.addrs is not None:
+        for addr in sorted(current.addrs - desired.addrs):
+            change(["addr", "del", addr, "dev", name], ["addr", "add", addr, "dev", name])
+        for addr in sorted(desired.addrs - current.addrs):
+            change(["addr", "add", addr, "dev", name], ["addr", "del", addr, "dev", name])
+    if current.up != desired.up:
+        state = lambda up: "up" if up else "down"
+        change(
+            ["link", "set", "dev", name, state(desired.up)],
+            ["link", "set", "dev", name, state(current.up)],
+        )
+    return steps
+
+
+def network_changes(
+    current: Dict[str, Link], desired: List[Link], absent: List[str]
+) -> List[Step]:
+    """
+    Changes for all links in dependency order: removed links first, then
+    desired links in the given order, i.e. bridges before their ports.
+    """
+    steps = []
+    current = dict(current)
+    for name in absent:
+        if name not in current:
+            continue
+        steps.append(Step(["ip", "link", "del", name]))
+        del current[name]
+        # deleting a bridge releases its ports
+        for n, link in current.items():
+            if link.master == name:
+                current[n] = replace(link, master=None)
+    for link in desired:
+        steps.extend(link_changes(current.get(link.ifname), link))
+    return steps
+
+
+def pci_driver(pci_id: str) -> Optional[str]:
+    path = f"/sys/bus/pci/devices/{pci_id}/driver"
+    if not os.path.exists(path):
+        return None
+    return os.path.basename(os.readlink(path))
+
+
 def remote_cmd(ssh_host: str, args: List[str]) -> None:
-    run(["ssh", ssh_host, "--"] + args)
+    ssh_session(ssh_host).run(args)
+
+
+def mtus() -> List[int]:
+    """MTUs to sweep, i.e. NETWORK_MTUS=1500,4000,9000"""
+    value = os.environ.get("NETWORK_MTUS", str(MTU))
+    try:
+        return [int(v) for v in value.split(",")]
+    except ValueError:
+        raise RuntimeError(f"NETWORK_MTUS must be a list of numbers, got {value}")
+
 
+def setup_remote_network(settings: Settings, mtu: int = MTU) -> None:
+    host = settings.remote_ssh_host
+    current = parse_links(ssh_session(host).run(["ip", "-d", "-j", "addr", "show"]).stdout)
+    desired = Link(
+        settings.remote_nic_ifname, mtu=mtu, addrs={normalize_cidr(settings.remote_cidr)}
+    )
+    batch = Batch(f"network {host}", ssh_host=host)
+    batch.steps = network_changes(current, [desired], [])
+    batch.apply()
 
-def setup_remote_network(settings: Settings) -> None:
-    cmds = [
-        ["sudo", "ip", "link", "set", settings.remote_nic_ifname, "up"],
-        ["sudo", "ip", "addr", "flush", "dev", settings.remote_nic_ifname],
-        ["sudo", "ip", "addr", "add", f"{settings.remote_dpdk_ip}/{settings.dpdk_netmask}", "dev", settings.remote_nic_ifname],
-        ["sudo", "ip", "link", "set", settings.remote_nic_ifname, "mtu", "1500"],
-        ["sudo", "ip", "link", "set", settings.remote_nic_ifname, "up"]
-    ]
-    command = "; ".join(map(lambda cmd: " ".join(cmd), cmds))
-    remote_cmd(settings.remote_ssh_host, [command])
+
+# kinds where the host kernel terminates the benchmark connections
+HOST_STACK = (NetworkKind.NATIVE, NetworkKind.CLIENT_NATIVE)
+
+
+@lru_cache(maxsize=1)
+def nc_command(settings: Settings) -> RemoteCommand:
+    path = nix_build("netcat-native")
+    return settings.remote_command(path)
 
 
 class Network:
     def __init__(self, settings: Settings) -> None:
         self.settings = settings
+        self.sysctl_profile: SysctlProfile = sysctl_profiles()[0]
+        self.kind: Optional[NetworkKind] = None
+        # of every link on both ends and of the enclave interface
+        self.mtu = MTU
+        # rx queues of sgx-lkl-userpci, each needs its own mempool in huge pages
+        self.dpdk_queues = 1
+
+    def nic_driver(self, kind: NetworkKind) -> str:
+        # DPDK_TAP runs DPDK on top of a tap device; the NIC stays with the kernel
+        if kind == NetworkKind.DPDK:
+            return self.settings.dpdk_nic_driver
+        return self.settings.native_nic_driver
 
     def bind_driver(self, kind: NetworkKind) -> None:
-        devbind = ROOT.joinpath("..", "..", "dpdk", "usertools", "dpdk-devbind.py")
+        if not self.settings.nic_pci_id:
+            return
+        driver = self.nic_driver(kind)
+        if pci_driver(self.settings.nic_pci_id) == driver:
+            return
 
-        if kind not in(NetworkKind.DPDK, NetworkKind.DPDK_TAP):
-            driver = self.settings.native_nic_driver
-        elif kind == NetworkKind.DPDK:
-            driver = self.settings.dpdk_nic_driver
+        if kind == NetworkKind.DPDK:
             try:
                 ip(["link", "set", self.settings.native_nic_ifname, "down"])
             except subprocess.CalledProcessError:  # interface may not exists
                 pass
 
-        if self.settings.nic_pci_id:
-            run(["sudo", "python3", str(devbind), "-b", driver, self.settings.nic_pci_id])
+        devbind = ROOT.joinpath("..", "..", "dpdk", "usertools", "dpdk-devbind.py")
+        run(["sudo", "python3", str(devbind), "-b", driver, self.settings.nic_pci_id])
+
+        if kind != NetworkKind.DPDK:
+            # the kernel driver creates the interface asynchronously
+            ifname = self.settings.native_nic_ifname
+            for _ in range(100):
+                if os.path.exists(f"/sys/class/net/{ifname}"):
+                    break
+                time.sleep(0.1)
+            else:
+                raise RuntimeError(f"{ifname} did not appear after binding {driver}")
+
+    def desired_links(self, kind: NetworkKind) -> List[Link]:
+        s = self.settings
+        bridged = kind == NetworkKind.TAP
+        links = []
+        if bridged:
+            addrs = {normalize_cidr(c) for c in [s.tap_bridge_cidr, s.tap_bridge_cidr6]}
+            links.append(Link(BRIDGE, kind="bridge", mtu=self.mtu, addrs=addrs))
+        links.append(
+            Link(
+                s.tap_ifname,
+                kind="tun",
+                mtu=self.mtu,
+                master=BRIDGE if bridged else None,
+                owner=getpass.getuser(),
+            )
+        )
+        if kind == NetworkKind.DPDK:
+            # the NIC is bound to the DPDK driver and has no kernel interface
+            return links
 
-        if kind == NetworkKind.NATIVE or kind == NetworkKind.CLIENT_NATIVE:
-            ip(["link", "set", self.settings.native_nic_ifname, "up"])
+        nic_addrs: Optional[Set[str]] = set()
+        if kind == NetworkKind.NATIVE:
+            nic_addrs = {normalize_cidr(c) for c in [s.cidr, s.cidr6]}
+        elif kind == NetworkKind.CLIENT_NATIVE:
+            nic_addrs = {normalize_cidr(c) for c in [s.remote_cidr, s.remote_cidr6]}
+        elif kind == NetworkKind.DPDK_TAP:
+            nic_addrs = None
+        links.append(
+            Link(
+                s.native_nic_ifname,
+                mtu=self.mtu,
+                master=BRIDGE if bridged else None,
+                addrs=nic_addrs,
+            )
+        )
+        return links
 
     def extra_env(self, kind: NetworkKind) -> Dict[str, str]:
         if kind == NetworkKind.TAP:
@@ -63,74 +283,73 @@ class Network:
                 SGXLKL_GW4="",
                 SGXLKL_IP6=self.settings.local_dpdk_ip6,
                 SGXLKL_TAP_OFFLOAD="1",
-                SGXLKL_TAP_MTU="1500",
+                SGXLKL_TAP_MTU=str(self.mtu),
+                SGXLKL_SYSCTL=self.sysctl_profile.lkl_value(),
             )
-        # TODO tune settings for DPDK_TAP
         elif kind in (NetworkKind.DPDK, NetworkKind.DPDK_TAP):
-            sysctl = "net.core.rmem_max=56623104;net.core.wmem_max=56623104;net.core.rmem_default=56623104;net.core.wmem_default=56623104;net.core.optmem_max=40960;net.ipv4.tcp_rmem=4096 87380 56623104;net.ipv4.tcp_wmem=4096 65536 56623104;net.core.somaxconn=1024;net.core.netdev_max_backlog=2000"
-            return dict(SGXLKL_DPDK_MTU="1500", SGXLKL_SYSCTL=sysctl)
+            return dict(
+                SGXLKL_DPDK_MTU=str(self.mtu), SGXLKL_SYSCTL=self.sysctl_profile.lkl_value()
+            )
         else:
             return {}
 
+    def effective_sysctls(self, log: str) -> Dict[str, str]:
+        """
+        Values of the sysctl profile as read back from the stack that
+        handled the connections since the last setup(); log is the
+        captured output of sgx-lkl-run.
+        """
+        if self.kind in HOST_STACK:
+            return host_sysctls(self.sysctl_profile)
+        return enclave_sysctls(log)
+
+    def wait_for_port(
+        self,
+        proc: subprocess.Popen,
+        port: int,
+        name: str,
+        tls: bool = False,
+        deadline: float = 60.0,
+    ) -> float:
+        """
+        Waits until the server spawned as proc accepts connections on the
+        enclave address, see readiness.wait_for_port. With DPDK the enclave
+        address is not reachable through the host kernel, so the port is
+        probed from the remote host instead.
+        """
+        remote_nc = None
+        if self.kind in (NetworkKind.DPDK, NetworkKind.DPDK_TAP):
+            remote_nc = nc_command(self.settings)
+        return wait_for_port(
+            proc, self.settings.local_dpdk_ip, port, name, remote_nc, tls, deadline
+        )
+
     def setup(self, kind: NetworkKind) -> Dict[str, str]:
+        """
+        Brings driver, links and addresses into the state required by kind.
+        Only differences to the current state are applied, so setting up
+        the same kind twice does not touch the network.
+        """
         self.bind_driver(kind)
+        self.kind = kind
 
         if kind in (NetworkKind.DPDK, NetworkKind.DPDK_TAP):
-            setup_hugepages(StorageKind.SPDK)
+            setup_hugepages(StorageKind.SPDK, [self.settings.nic_pci_id], self.dpdk_queues)
         else:
             setup_hugepages(StorageKind.NATIVE)
-            ip(["addr", "flush", "dev", self.settings.native_nic_ifname])
-
-        try:
-            ip(["link", "del", self.settings.tap_ifname])
-        except subprocess.CalledProcessError:
-            # might not exists
-            pass
-
-        ip(
-            [
-                "tuntap",
-                "add",
-                "dev",
-                self.settings.tap_ifname,
-                "mode",
-                "tap",
-                "user",
-                getpass.getuser(),
-            ]
-        )
-        ip(["link", "set", "dev", self.settings.tap_ifname, "mtu", "1500"])
-        ip(["link", "set", "dev", self.settings.tap_ifname, "up"])
-
-        subprocess.run(["sudo", "ip", "link", "del", "iperf-br"])
 
+        absent = [] if kind == NetworkKind.TAP else [BRIDGE]
+        batch = Batch("network")
+        batch.steps = network_changes(read_links(), self.desired_links(kind), absent)
         if kind == NetworkKind.TAP:
-            ip(["link", "add", "name", "iperf-br", "mtu", "1500", "type", "bridge"])
-            ip(["link", "set", "dev", "iperf-br", "up"])
-            ip(["link", "set", self.settings.native_nic_ifname, "master", "iperf-br"])
-            ip(["link", "set", self.settings.tap_ifname, "master", "iperf-br"])
-            run(
-                [
-                    "sudo",
-                    "sysctl",
-                    "-w",
-                    "net.ipv4.ip_forward=1",
-                    "net.ipv6.conf.all.forwarding=1",
-                ]
+            batch.steps += sysctl_changes(
+                {"net.ipv4.ip_forward": "1", "net.ipv6.conf.all.forwarding": "1"}
             )
-            for cidr in [self.settings.tap_bridge_cidr, self.settings.tap_bridge_cidr6]:
-                ip(["addr", "add", "dev", "iperf-br", cidr])
-        elif kind == NetworkKind.NATIVE or kind == NetworkKind.CLIENT_NATIVE:
-            if kind == NetworkKind.CLIENT_NATIVE:
-                cidrs = [self.settings.remote_cidr, self.settings.remote_cidr6]
-            else:
-                cidrs = [self.settings.cidr, self.settings.cidr6]
-            for cidr in cidrs:
-                ip(["addr", "add", cidr, "dev", self.settings.native_nic_ifname])
-
-        if kind != NetworkKind.DPDK:
-            ip(["link", "set", "dev", self.settings.native_nic_ifname, "mtu", "1500"])
-            ip(["link", "set", self.settings.native_nic_ifname, "up"])
+        if kind in HOST_STACK:
+            batch.steps += sysctl_changes(dict(self.sysctl_profile.values))
+        batch.apply()
 
+        if len(batch) == 0:
+            print(f"network already set up for {kind.name}")
         print("########################################")
         return self.extra_env(kind)
@@ -1,5 +1,3 @@
-import time
-import subprocess
 from typing import Dict, List
 import os
 
@@ -11,20 +9,26 @@ from helpers import (
     create_settings,
     flamegraph_env,
     nix_build,
+    nix_build_all,
     read_stats,
     write_stats,
     spawn,
     scone_env
 )
+from dpdk_queues import DEFAULT, queue_configs, record_queue_stats, tag_queues
+from fingerprint import tag_stats
+from sysctl_profiles import LEGACY, sysctl_profiles, tag_sysctl
 from storage import Storage, StorageKind
-from network import Network, NetworkKind, setup_remote_network
+from network import MTU, Network, NetworkKind, mtus, setup_remote_network
 from process_wrk import parse_wrk_output
+from result_store import completed_runs
 
 
-def process_wrk_output(wrk_out: str, system: str, stats: Dict[str, List[str]], connections: int) -> None:
+def process_wrk_output(wrk_out: str, system: str, stats: Dict[str, List[str]], connections: int, time_to_ready: float) -> None:
     wrk_metrics = parse_wrk_output(wrk_out)
     stats["system"].append(system)
     stats["connections"].append(str(connections))
+    stats["time-to-ready"].append(time_to_ready)
     for k, v in wrk_metrics.items():
         stats[k].append(v)
 
@@ -34,8 +38,10 @@ class Benchmark:
         self.settings = create_settings()
         self.storage = Storage(settings)
         self.network = Network(settings)
-        self.remote_nc = settings.remote_command(nix_build("netcat-native"))
         self.remote_wrk = settings.remote_command(nix_build("wrk-bench"))
+        self.queue_config = DEFAULT
+        # read back after the last run
+        self.sysctls: Dict[str, str] = {}
 
     def run(
         self,
@@ -48,28 +54,31 @@ class Benchmark:
         env = extra_env.copy()
         env.update(flamegraph_env(f"{os.getcwd()}/nginx-{system}"))
         env.update(dict(SGXLKL_CWD=mnt))
+        queue_stats = os.path.abspath(f"dpdk-stats-nginx-{NOW}.json")
+        if system == "sgx-io":
+            env.update(self.queue_config.env(queue_stats))
 
         nginx_server = nix_build(attr)
         host = self.settings.local_dpdk_ip
-        with spawn(nginx_server, "bin/nginx", "-c", f"{mnt}/nginx/nginx.conf", extra_env=env) as proc:
-            while True:
-                try:
-                    self.remote_nc.run(
-                        "bin/nc", ["-z", self.settings.local_dpdk_ip, "9000"]
-                    )
-                    break
-                except subprocess.CalledProcessError:
-                    status = proc.poll()
-                if status is not None:
-                    raise OSError(f"nginx exiteded with {status}")
-                    time.sleep(1)
-                pass
+        log = f"nginx-{system}-{NOW}.log.gz"
+        with spawn(
+            nginx_server,
+            "bin/nginx",
+            "-c",
+            f"{mnt}/nginx/nginx.conf",
+            extra_env=env,
+            log=log,
+        ) as proc:
+            time_to_ready = self.network.wait_for_port(proc, 9000, "nginx", tls=True)
 
             wrk_connections = 100
             wrk_proc = self.remote_wrk.run(
                 "bin/wrk", ["-t", "16", "-c", f"{wrk_connections}", "-d", "30s", f"https://{host}:9000/test/file"]
             )
-            process_wrk_output(wrk_proc.stdout, system, stats, wrk_connections)
+            process_wrk_output(wrk_proc.stdout, system, stats, wrk_connections, time_to_ready)
+        self.sysctls = self.network.effective_sysctls(log)
+        if system == "sgx-io":
+            record_queue_stats(queue_stats, self.queue_config, "nginx", dict(system=system, run=NOW))
 
 
 def benchmark_nginx_native(
@@ -118,11 +127,8 @@ def benchmark_nginx_scone(
 
 
 def main() -> None:
-    stats = read_stats("nginx.json")
+    stats = read_stats("nginx.jsonl")
     settings = create_settings()
-    setup_remote_network(settings)
-
-    benchmark = Benchmark(settings)
 
     benchmarks = {
         "sgx-lkl": benchmark_nginx_sgx_lkl,
@@ -131,13 +137,48 @@ def main() -> None:
         "scone": benchmark_nginx_scone,
     }
 
-    system = set(stats["system"])
+    # queues and enclave threads only matter for the DPDK path
+    configs = queue_configs()
+    profiles = sysctl_profiles()
+    sizes = mtus()
+    done = completed_runs(
+        stats,
+        {
+            "system": None,
+            "dpdk-queues": DEFAULT.queues,
+            "ethreads": DEFAULT.ethreads,
+            "sysctl-profile": LEGACY,
+            "mtu": MTU,
+        },
+    )
+    runs = {
+        name: [
+            (p, mtu, c)
+            for p in profiles
+            for mtu in sizes
+            for c in (configs if name == "sgx-io" else [DEFAULT])
+            if (name, c.queues, c.ethreads, p.tag, mtu) not in done
+        ]
+        for name in benchmarks
+    }
+    settings.prefetch_remote(["netcat-native", "wrk-bench"])
+    nix_build_all(["iotest-image"] + [f"nginx-{name}" for name, todo in runs.items() if todo])
+    benchmark = Benchmark(settings)
     for name, benchmark_func in benchmarks.items():
-        if name in system:
+        if not runs[name]:
             print(f"skip {name} benchmark")
-            continue
-        benchmark_func(benchmark, stats)
-        write_stats("nginx.json", stats)
+        for sysctl_profile, mtu, config in runs[name]:
+            setup_remote_network(settings, mtu)
+            benchmark.network.sysctl_profile = sysctl_profile
+            benchmark.network.mtu = mtu
+            benchmark.queue_config = config
+            benchmark.network.dpdk_queues = config.queues
+            benchmark_func(benchmark, stats)
+            tag_queues(stats, config if name == "sgx-io" else None)
+            tag_sysctl(stats, sysctl_profile, benchmark.sysctls)
+            stats.tags["mtu"] = mtu
+            tag_stats(stats, settings)
+            write_stats("nginx.jsonl", stats)
 
     csv = f"nginx-{NOW}.tsv"
     print(csv)
@@ -1,54 +1,97 @@
 #!/usr/bin/env python3
+"""
+Runs N iperf3 clients against the multi-threaded iperf3 server, which
+listens on consecutive ports starting at 5201.
+
+All clients are spawned (and pinned) first and wait on their stdin; they
+are released together once every one of them is ready, so the instances
+overlap for the whole test instead of starting one after another. The
+result of each instance is written to stdout as one JSON line as soon as
+it finishes:
+
+    {"port": 5202, "cpu": 3, "result": {...}}
+
+    parallel-iperf [--cpus 0,2,4] N iperf3 -c HOST --json -t 10
+"""
 
 import argparse
+import asyncio
 import json
-import subprocess
+import os
 import sys
-from threading import Condition, Thread
-from typing import Any, Dict, List
+from typing import List, Optional
 
 IPERF3_DEFAULT_PORT = 5201
 
+# blocks until the barrier is released by a line on stdin
+WAIT_AND_EXEC = 'read _ && exec "$@"'
+
+
+def parse_cpus(value: str) -> List[int]:
+    """i.e. 0-3,8"""
+    cpus = []
+    for part in value.split(","):
+        if "-" in part:
+            start, end = part.split("-")
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+async def spawn(cmd: List[str], cpu: Optional[int]) -> asyncio.subprocess.Process:
+    print(f"$ {' '.join(cmd)}", file=sys.stderr)
+
+    def pin() -> None:
+        if cpu is not None:
+            os.sched_setaffinity(0, {cpu})
+
+    return await asyncio.create_subprocess_exec(
+        "sh",
+        "-c",
+        WAIT_AND_EXEC,
+        "sh",
+        *cmd,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        preexec_fn=pin,
+    )
+
+
+async def collect(proc: asyncio.subprocess.Process, port: int, cpu: Optional[int]) -> None:
+    stdout, _ = await proc.communicate()
+    try:
+        result = json.loads(stdout)
+    except ValueError:
+        result = dict(error=f"iperf3 exited with {proc.returncode}: {stdout.decode()}")
+    # one line per instance, in the order they finish
+    print(json.dumps(dict(port=port, cpu=cpu, result=result)), flush=True)
+
+
+async def run(instances: int, iperf_cmd: List[str], cpus: List[int]) -> None:
+    procs = []
+    for i in range(instances):
+        port = IPERF3_DEFAULT_PORT + i
+        cpu = cpus[i % len(cpus)] if cpus else None
+        proc = await spawn(iperf_cmd + ["-p", str(port)], cpu)
+        procs.append((proc, port, cpu))
 
-def run_iperf(
-    condition: Condition,
-    iperf_cmd: List[str],
-    results: List[Dict[str, Any]],
-    index: int,
-) -> None:
-    with condition:
-        condition.wait()
-        # DEBUG
-        print(f"$ {' '.join(iperf_cmd)}", file=sys.stderr)
-        proc = subprocess.run(iperf_cmd, stdout=subprocess.PIPE)
-        print(proc.stdout.decode("utf-8"), file=sys.stderr)
-        results[index] = json.loads(proc.stdout.decode("utf-8"))
+    # the barrier: every client exists and is pinned at this point
+    for proc, _, _ in procs:
+        assert proc.stdin is not None
+        proc.stdin.write(b"\n")
+        proc.stdin.close()
+    await asyncio.gather(*(collect(proc, port, cpu) for proc, port, cpu in procs))
 
 
 def main() -> None:
-    parser = argparse.ArgumentParser(description="Run iperf3 instances in parallel")
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--cpus", type=parse_cpus, default=[], help="pin instance i to the i-th cpu")
     parser.add_argument("instances", type=int, help="number of parallel instances")
-    args, base_iperf_cmd = parser.parse_known_args()
-    condition = Condition()
-    threads = []
-    results: List[Dict[str, Any]] = [{} for i in range(args.instances)]
-    for i in range(args.instances):
-        iperf_cmd = base_iperf_cmd + ["-p", str(IPERF3_DEFAULT_PORT + i)]
-        thread_args = (condition, iperf_cmd, results, i)
-        thread = Thread(target=run_iperf, args=thread_args)
-        thread.start()
-        threads.append(thread)
-
-    with condition:
-        condition.notify_all()
-
-    for thread in threads:
-        thread.join()
-
-    instances = []
-    for i, result in enumerate(results):
-        instances.append(dict(port=IPERF3_DEFAULT_PORT + 1, result=result))
-    json.dump(dict(instances=instances), sys.stdout)
+    args, iperf_cmd = parser.parse_known_args()
+    asyncio.run(run(args.instances, iperf_cmd, args.cpus))
 
 
 if __name__ == "__main__":
@@ -28,6 +28,14 @@ def catplot(**kwargs: Any) -> Any:
     return g
 
 
+def relplot(**kwargs: Any) -> Any:
+    g = sns.relplot(**kwargs)
+    g.despine(top=False, right=False)
+    plt.autoscale()
+    plt.subplots_adjust(top=0.98)
+    return g
+
+
 def apply_hatch(groups: int, g: Any, legend: bool) -> None:
     hatch_list = ['', '///', '---', '\\']
     if len(g.ax.patches) == groups:
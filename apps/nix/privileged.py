@@ -0,0 +1,104 @@
+import shlex
+import subprocess
+import sys
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from helpers import run, ssh_session
+
+# Runs a single step and reports its exit code and duration; aborts the
+# batch on the first failure so later steps do not build on a broken state.
+PRELUDE = """\
+step() {
+  i=$1; shift
+  t0=$(date +%s%N)
+  out=$("$@" 2>&1); rc=$?
+  t1=$(date +%s%N)
+  echo "STEP $i $rc $((t1 - t0))"
+  if [ $rc -ne 0 ]; then
+    printf '%s\\n' "$out" >&2
+    exit 1
+  fi
+}
+"""
+
+
+@dataclass
+class Step:
+    cmd: List[str]
+    # restores the state before cmd, None if cmd cannot be undone
+    undo: Optional[List[str]] = None
+
+
+class BatchError(RuntimeError):
+    pass
+
+
+class Batch:
+    """
+    A list of commands that is executed by a single root shell, locally
+    through sudo or on ssh_host. Steps that completed before a failing one
+    are rolled back in reverse order.
+    """
+
+    def __init__(self, name: str, ssh_host: Optional[str] = None) -> None:
+        self.name = name
+        self.ssh_host = ssh_host
+        self.steps: List[Step] = []
+
+    def add(self, cmd: List[str], undo: Optional[List[str]] = None) -> None:
+        self.steps.append(Step(cmd, undo))
+
+    def __len__(self) -> int:
+        return len(self.steps)
+
+    def script(self, cmds: List[List[str]], abort: bool = True) -> str:
+        lines = [PRELUDE]
+        for i, cmd in enumerate(cmds):
+            quoted = " ".join(shlex.quote(arg) for arg in cmd)
+            lines.append(f"step {i} {quoted}" if abort else f"{quoted} || true")
+        return "\n".join(lines) + "\n"
+
+    def _execute(self, script: str) -> "subprocess.CompletedProcess[str]":
+        if self.ssh_host is None:
+            return run(["sudo", "sh", "-s"], input=script, check=False)
+        return ssh_session(self.ssh_host).run(["sudo", "sh", "-s"], input=script, check=False)
+
+    def apply(self) -> List[Tuple[List[str], float]]:
+        """Returns each command with its duration in seconds"""
+        if not self.steps:
+            return []
+        for step in self.steps:
+            print(f"[{self.name}] {' '.join(step.cmd)}")
+        proc = self._execute(self.script([s.cmd for s in self.steps]))
+
+        timings = []
+        failed = None
+        for line in proc.stdout.splitlines():
+            fields = line.split()
+            if len(fields) != 4 or fields[0] != "STEP":
+                continue
+            i, rc, ns = int(fields[1]), int(fields[2]), int(fields[3])
+            timings.append((self.steps[i].cmd, ns / 1e9))
+            if rc != 0:
+                failed = i
+        if failed is None and proc.returncode != 0:
+            failed = len(timings)
+
+        total = sum(t for _, t in timings)
+        print(f"[{self.name}] {len(timings)}/{len(self.steps)} steps in {total * 1000:.1f}ms")
+        for cmd, seconds in sorted(timings, key=lambda t: -t[1])[:3]:
+            print(f"[{self.name}]   {seconds * 1000:7.1f}ms {' '.join(cmd)}")
+
+        if failed is not None:
+            self.rollback(failed)
+            cmd = " ".join(self.steps[failed].cmd) if failed < len(self.steps) else "?"
+            raise BatchError(f"[{self.name}] step {failed} ({cmd}) failed")
+        return timings
+
+    def rollback(self, failed: int) -> None:
+        undo = [s.undo for s in reversed(self.steps[:failed]) if s.undo is not None]
+        if not undo:
+            return
+        print(f"[{self.name}] rolling back {len(undo)} steps", file=sys.stderr)
+        self._execute(self.script(undo, abort=False))
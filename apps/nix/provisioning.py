@@ -0,0 +1,319 @@
+"""
+Incremental block-level provisioning of the benchmark image.
+
+The image is split into fixed-size extents whose hashes are cached per
+image in a manifest. When writing to a device, only extents that differ
+from what the device already holds are rewritten; extents that are zero in
+the image are discarded (or zeroed, if the device does not read back zeros
+after a discard) instead of being written, and so is the device beyond the
+end of the image.
+
+Holes in the image (SEEK_DATA/SEEK_HOLE) are treated as zero extents
+without being read. Extents are processed by a pool of threads issuing
+aligned O_DIRECT reads and writes, so several requests are in flight at
+the device at once.
+
+Writing needs root, so storage.py runs this file through sudo:
+
+    sudo python3 provisioning.py IMAGE DEVICE --manifest MANIFEST [--force]
+"""
+
+import argparse
+import errno
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+MANIFEST_DIR = Path(__file__).parent.resolve().joinpath(".provision")
+EXTENT_SIZE = 4 * 1024 * 1024
+# concurrent O_DIRECT requests, one per thread; a P4600 needs at least a
+# handful of them to reach its sequential write bandwidth
+QUEUE_DEPTH = 8
+MiB = 1024 * 1024
+
+# linux/fs.h
+BLKDISCARD = 0x1277
+BLKZEROOUT = 0x127F
+
+
+def hash_extent(buf: memoryview, zero: memoryview) -> Optional[str]:
+    """Returns None for all-zero extents"""
+    if buf == zero[: len(buf)]:
+        return None
+    return hashlib.blake2b(buf, digest_size=16).hexdigest()
+
+
+def data_ranges(fd: int, size: int) -> Iterator[Tuple[int, int]]:
+    """Yields (start, end) of the regions of the file that are not holes"""
+    offset = 0
+    while offset < size:
+        try:
+            start = os.lseek(fd, offset, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO:  # only a hole left
+                return
+            if e.errno == errno.EINVAL:  # filesystem without hole support
+                yield offset, size
+                return
+            raise
+        end = min(os.lseek(fd, start, os.SEEK_HOLE), size)
+        yield start, end
+        offset = end
+
+
+def data_extents(fd: int, size: int, extent_size: int) -> Set[int]:
+    """Indices of the extents that contain data; the rest is known to be zero"""
+    extents: Set[int] = set()
+    for start, end in data_ranges(fd, size):
+        extents.update(range(start // extent_size, (end - 1) // extent_size + 1))
+    return extents
+
+
+def aligned_buffer(size: int) -> memoryview:
+    # O_DIRECT needs aligned buffers, mmap returns page-aligned memory
+    return memoryview(mmap.mmap(-1, size))
+
+
+def compute_manifest(image: str, extent_size: int = EXTENT_SIZE) -> Dict[str, Any]:
+    zero = memoryview(bytes(extent_size))
+    buf = aligned_buffer(extent_size)
+    fd = os.open(image, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        data = data_extents(fd, size, extent_size)
+        hashes: List[Optional[str]] = []
+        for i, offset in enumerate(range(0, size, extent_size)):
+            if i not in data:
+                hashes.append(None)
+                continue
+            length = min(extent_size, size - offset)
+            if os.preadv(fd, [buf[:length]], offset) != length:
+                raise OSError(f"short read from {image} at offset {offset}")
+            hashes.append(hash_extent(buf[:length], zero))
+    finally:
+        os.close(fd)
+    return dict(image=image, size=size, extent_size=extent_size, hashes=hashes)
+
+
+def image_manifest(image: str, extent_size: int = EXTENT_SIZE) -> Path:
+    """
+    Hashes of the image extents; cached since nix store paths are immutable.
+    """
+    path = MANIFEST_DIR.joinpath(f"{Path(image).name}-{extent_size}.json")
+    if not path.exists():
+        MANIFEST_DIR.mkdir(exist_ok=True)
+        manifest = compute_manifest(image, extent_size)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp, path)
+    return path
+
+
+def device_manifest(device: str) -> Path:
+    return MANIFEST_DIR.joinpath(f"device-{Path(device).name}.json")
+
+
+def read_device_manifest(device: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(device_manifest(device)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_device_manifest(device: str, manifest: Dict[str, Any]) -> None:
+    MANIFEST_DIR.mkdir(exist_ok=True)
+    with open(device_manifest(device), "w") as f:
+        json.dump(manifest, f)
+
+
+class Device:
+    def __init__(self, path: str, discard: bool) -> None:
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_DIRECT)
+        self.size = os.lseek(self.fd, 0, os.SEEK_END)
+        self.discard = discard
+        # whether discarded blocks read back as zeros, probed on first use
+        self.discard_zeroes: Optional[bool] = None
+        self._probe_lock = threading.Lock()
+
+    def _ioctl(self, request: int, offset: int, length: int) -> None:
+        fcntl.ioctl(self.fd, request, struct.pack("QQ", offset, length))
+
+    def trim(self, offset: int, length: int) -> None:
+        """Discard without any promise about what the range reads back as"""
+        if self.discard and length > 0:
+            self._ioctl(BLKDISCARD, offset, length)
+
+    def zero(self, offset: int, length: int, buf: memoryview, zero: memoryview) -> bool:
+        """Zeroes the range, by discard if possible. Returns True if discarded."""
+        if self.discard and self.discard_zeroes is None:
+            with self._probe_lock:
+                if self.discard_zeroes is None:
+                    self._ioctl(BLKDISCARD, offset, length)
+                    self.read(offset, buf[:length])
+                    self.discard_zeroes = buf[:length] == zero[:length]
+                    if self.discard_zeroes:
+                        return True
+        if self.discard and self.discard_zeroes:
+            self._ioctl(BLKDISCARD, offset, length)
+            return True
+        self._ioctl(BLKZEROOUT, offset, length)
+        return False
+
+    def read(self, offset: int, buf: memoryview) -> None:
+        n = os.preadv(self.fd, [buf], offset)
+        if n != len(buf):
+            raise OSError(f"short read from {self.path} at offset {offset}")
+
+    def write(self, offset: int, buf: memoryview) -> None:
+        n = os.pwritev(self.fd, [buf], offset)
+        if n != len(buf):
+            raise OSError(f"short write to {self.path} at offset {offset}")
+
+    def close(self) -> None:
+        os.fsync(self.fd)
+        os.close(self.fd)
+
+
+class Writer:
+    """
+    Brings one extent at a time in line with the manifest. Called from
+    several threads, each with its own aligned buffers.
+    """
+
+    def __init__(
+        self, image: str, dev: Device, manifest: Dict[str, Any], force: bool
+    ) -> None:
+        self.image = image
+        self.dev = dev
+        self.size = manifest["size"]
+        self.extent_size = manifest["extent_size"]
+        self.hashes = manifest["hashes"]
+        self.force = force
+        self.image_fd = os.open(image, os.O_RDONLY)
+        self.zero = memoryview(bytes(self.extent_size))
+        self.local = threading.local()
+
+    def _buffers(self) -> Tuple[memoryview, memoryview]:
+        if not hasattr(self.local, "buffers"):
+            self.local.buffers = (
+                aligned_buffer(self.extent_size),
+                aligned_buffer(self.extent_size),
+            )
+        return self.local.buffers
+
+    def __call__(self, i: int) -> Tuple[str, int]:
+        """Returns what was done and the number of bytes written"""
+        device_buf, image_buf = self._buffers()
+        expected = self.hashes[i]
+        offset = i * self.extent_size
+        length = min(self.extent_size, self.size - offset)
+        if not self.force:
+            self.dev.read(offset, device_buf[:length])
+            if hash_extent(device_buf[:length], self.zero) == expected:
+                return "unchanged", 0
+        if expected is None:
+            if self.dev.zero(offset, length, device_buf, self.zero):
+                return "discarded", 0
+            return "zeroed", length
+        n = os.preadv(self.image_fd, [image_buf[:length]], offset)
+        if n != length:
+            raise OSError(f"short read from {self.image} at offset {offset}")
+        self.dev.write(offset, image_buf[:length])
+        return "written", length
+
+    def close(self) -> None:
+        os.close(self.image_fd)
+
+
+def provision(
+    image: str,
+    device: str,
+    manifest: Dict[str, Any],
+    force: bool,
+    discard: bool,
+    queue_depth: int = QUEUE_DEPTH,
+) -> Dict[str, Any]:
+    """
+    Makes the first manifest["size"] bytes of device equal to the image.
+    With force every extent is written without looking at the device first.
+    """
+    size = manifest["size"]
+    if size % 4096 != 0 or manifest["extent_size"] % 4096 != 0:
+        raise ValueError(f"{image}: size and extent size must be 4KiB aligned for O_DIRECT")
+
+    summary: Dict[str, Any] = dict(unchanged=0, written=0, discarded=0, zeroed=0)
+    start = time.monotonic()
+    dev = Device(device, discard)
+    if dev.size < size:
+        dev.close()
+        raise OSError(f"{device} ({dev.size} bytes) is smaller than {image} ({size} bytes)")
+    writer = Writer(image, dev, manifest, force)
+    bytes_written = 0
+    try:
+        with ThreadPoolExecutor(max_workers=queue_depth) as pool:
+            for action, n in pool.map(writer, range(len(manifest["hashes"]))):
+                summary[action] += 1
+                bytes_written += n
+        # the filesystem is grown by resize2fs afterwards, contents do not matter
+        dev.trim(size, dev.size - size)
+    finally:
+        writer.close()
+        dev.close()
+
+    seconds = time.monotonic() - start
+    summary["seconds"] = seconds
+    summary["extents"] = len(manifest["hashes"])
+    summary["bytes_written"] = bytes_written
+    summary["mib_per_s"] = bytes_written / MiB / seconds if seconds > 0 else 0.0
+    return summary
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("image")
+    parser.add_argument("device")
+    parser.add_argument("--manifest", help="manifest written by image_manifest()")
+    parser.add_argument("--force", action="store_true", help="write every extent")
+    parser.add_argument(
+        "--queue-depth",
+        type=int,
+        default=QUEUE_DEPTH,
+        help="number of concurrent O_DIRECT requests (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--no-discard",
+        dest="discard",
+        action="store_false",
+        help="never discard, i.e. for dm-crypt without --allow-discards",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str]) -> None:
+    args = parse_args(argv)
+    if args.manifest:
+        with open(args.manifest) as f:
+            manifest = json.load(f)
+    else:
+        manifest = compute_manifest(args.image)
+    summary = provision(
+        args.image, args.device, manifest, args.force, args.discard, args.queue_depth
+    )
+    # last line is parsed by storage.py
+    print(json.dumps(summary))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
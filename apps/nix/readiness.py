@@ -0,0 +1,138 @@
+import errno
+import select
+import socket
+import ssl
+import subprocess
+import time
+from typing import Any, Callable, Optional
+
+from helpers import RemoteCommand, ssh_session
+
+
+def probe_tcp(host: str, port: int, timeout: float, tls: bool = False) -> bool:
+    """
+    Non-blocking connect (and optional TLS handshake) from the local host.
+    """
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    with socket.socket(family, socket.SOCK_STREAM) as sock:
+        sock.setblocking(False)
+        err = sock.connect_ex((host, port))
+        if err not in (0, errno.EINPROGRESS):
+            return False
+        _, writable, _ = select.select([], [sock], [], timeout)
+        if not writable or sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) != 0:
+            return False
+        if not tls:
+            return True
+        sock.settimeout(timeout)
+        # we only care whether the server speaks TLS, not who it is
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        try:
+            with context.wrap_socket(sock, do_handshake_on_connect=False) as tls_sock:
+                tls_sock.do_handshake()
+            return True
+        except (OSError, ssl.SSLError):
+            return False
+
+
+class RemoteProbe:
+    """
+    Polls a port from the remote host with a single long-running ssh command
+    instead of one ssh round trip per attempt. Succeeds once the remote loop
+    exits.
+    """
+
+    def __init__(self, nc: RemoteCommand, host: str, port: int) -> None:
+        self.nc = nc
+        self.host = host
+        self.port = port
+        self.proc: Optional[subprocess.Popen] = None
+        self.remote_pid = ""
+
+    def __enter__(self) -> "RemoteProbe":
+        nc = f"{self.nc.nix_path}/bin/nc"
+        # the remote shell reports its pid so that the loop can be stopped
+        script = f"echo $$; until {nc} -z -w1 {self.host} {self.port}; do sleep 0.05; done"
+        cmd = ssh_session(self.nc.ssh_host).command([script])
+        self.proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+        assert self.proc.stdout is not None
+        self.remote_pid = self.proc.stdout.readline().strip()
+        return self
+
+    def __call__(self, timeout: float) -> bool:
+        assert self.proc is not None
+        try:
+            status = self.proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            return False
+        if status != 0:
+            raise OSError(f"remote probe for {self.host}:{self.port} failed with {status}")
+        return True
+
+    def __exit__(self, *args: Any) -> None:
+        if self.proc is None or self.proc.poll() is not None:
+            return
+        try:
+            # killing ssh does not stop the loop on the remote host
+            if self.remote_pid.isdigit():
+                ssh_session(self.nc.ssh_host).run(["kill", self.remote_pid], check=False)
+        finally:
+            self.proc.kill()
+            self.proc.wait()
+
+
+def wait_until(
+    proc: subprocess.Popen,
+    probe: Callable[[float], bool],
+    name: str,
+    deadline: float = 60.0,
+) -> float:
+    """
+    Calls probe with exponential backoff until it succeeds and returns the
+    time it took. Fails immediately if proc exits in the meantime.
+    """
+    start = time.monotonic()
+    delay = 0.01
+    while True:
+        attempt = time.monotonic()
+        if probe(delay):
+            return time.monotonic() - start
+        elapsed = time.monotonic() - start
+        if elapsed > deadline:
+            raise TimeoutError(f"{name} not ready after {deadline}s")
+        # sleeping in wait() notices an exiting server right away
+        try:
+            status = proc.wait(timeout=max(delay - (time.monotonic() - attempt), 0))
+            raise OSError(f"{name} exited with {status}")
+        except subprocess.TimeoutExpired:
+            pass
+        delay = min(delay * 2, 1.0)
+
+
+def wait_for_port(
+    proc: subprocess.Popen,
+    host: str,
+    port: int,
+    name: str,
+    remote_nc: Optional[RemoteCommand] = None,
+    tls: bool = False,
+    deadline: float = 60.0,
+) -> float:
+    """
+    Waits until the server spawned as proc accepts connections on host:port
+    and returns the time to ready in seconds.
+
+    The port is probed from the local host unless remote_nc is given, see
+    Network.wait_for_port for when this is needed.
+    """
+    if remote_nc is None:
+        seconds = wait_until(
+            proc, lambda timeout: probe_tcp(host, port, timeout, tls), name, deadline
+        )
+    else:
+        with RemoteProbe(remote_nc, host, port) as probe:
+            seconds = wait_until(proc, probe, name, deadline)
+    print(f"{name} ready after {seconds:.3f}s")
+    return seconds
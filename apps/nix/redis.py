@@ -1,5 +1,3 @@
-import subprocess
-import time
 import pandas as pd
 import os
 from typing import Dict, List, DefaultDict
@@ -8,6 +6,7 @@ from helpers import (
     Settings,
     create_settings,
     nix_build,
+    nix_build_all,
     spawn,
     read_stats,
     write_stats,
@@ -15,17 +14,19 @@ from helpers import (
     scone_env,
     flamegraph_env
 )
+from fingerprint import tag_stats
 from storage import Storage, StorageKind
 from network import Network, NetworkKind, setup_remote_network
 
 
-def process_ycsb_out(ycsb_out: str, system: str, results: Dict[str, List]) -> None:
+def process_ycsb_out(ycsb_out: str, system: str, results: Dict[str, List], time_to_ready: float) -> None:
     for line in ycsb_out.split("\n"):
         print(line)
         if line == "":
             break
         operation, metric, value = line.split(",")
         results["system"].append(system)
+        results["time-to-ready"].append(time_to_ready)
         results["operation"].append(operation.strip())
         results["metric"].append(metric.strip())
         results["value"].append(value.strip())
@@ -37,7 +38,6 @@ class Benchmark:
         self.storage = Storage(settings)
         self.network = Network(settings)
         #self.remote_redis = settings.remote_command(nix_build("redis-cli"))
-        self.nc_command = settings.remote_command(nix_build("netcat-native"))
         self.remote_ycsb = settings.remote_command(nix_build("ycsb-native"))
         self.record_count = record_count
         self.operation_count = operation_count
@@ -63,18 +63,9 @@ class Benchmark:
         ]
         env = extra_env.copy()
         env.update(flamegraph_env(f"{os.getcwd()}/redis-{system}"))
-        with spawn(redis_server, *args, extra_env=env) as proc:
-            print(f"waiting for redis for {system} benchmark...", end="")
-            while True:
-                try:
-                    self.nc_command.run("bin/nc", ["-z", "-v", self.settings.local_dpdk_ip, "6379"])
-                    break
-                except subprocess.CalledProcessError:
-                    status = proc.poll()
-                    if status is not None:
-                        raise OSError(f"redis-server exiteded with {status}")
-                    time.sleep(1)
-                    pass
+        with spawn(redis_server, *args, extra_env=env, log=f"redis-{system}-{NOW}.log.gz") as proc:
+            print(f"waiting for redis for {system} benchmark...")
+            time_to_ready = self.network.wait_for_port(proc, 6379, "redis-server", tls=True)
 
             load_proc = self.remote_ycsb.run(
                 "bin/ycsb",
@@ -123,7 +114,7 @@ class Benchmark:
                 ],
             )
 
-        process_ycsb_out(run_proc.stdout, system, stats)
+        process_ycsb_out(run_proc.stdout, system, stats, time_to_ready)
 
 
 def benchmark_redis_native(benchmark: Benchmark, stats: Dict[str, List],) -> None:
@@ -175,14 +166,12 @@ def benchmark_redis_scone(
 
 
 def main() -> None:
-    stats = read_stats("redis.json")
+    stats = read_stats("redis.jsonl")
     settings = create_settings()
     setup_remote_network(settings)
     record_count = 100000
     op_count = 10000
 
-    benchmark = Benchmark(settings, record_count, op_count)
-
     benchmarks = {
         "native": benchmark_redis_native,
         "sgx-lkl": benchmark_redis_sgx_lkl,
@@ -191,12 +180,18 @@ def main() -> None:
     }
 
     system = set(stats["system"])
+    settings.prefetch_remote(["netcat-native", "ycsb-native"])
+    nix_build_all(
+        ["iotest-image"] + [f"redis-{name}" for name in benchmarks if name not in system]
+    )
+    benchmark = Benchmark(settings, record_count, op_count)
     for name, benchmark_func in benchmarks.items():
         if name in system:
             print(f"skip {name} benchmark")
             continue
         benchmark_func(benchmark, stats)
-        write_stats("redis.json", stats)
+        tag_stats(stats, settings)
+        write_stats("redis.jsonl", stats)
 
     csv = f"redis-{NOW}.tsv"
     print(csv)
@@ -0,0 +1,176 @@
+import json
+import os
+from collections import defaultdict
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+# Lines carrying this key extend the schema instead of adding a sample.
+SCHEMA_KEY = "__schema__"
+
+
+def type_name(value: Any) -> str:
+    # bool is a subclass of int, so it has to be checked first
+    if isinstance(value, bool):
+        return "bool"
+    elif isinstance(value, int):
+        return "int"
+    elif isinstance(value, float):
+        return "float"
+    elif isinstance(value, str):
+        return "str"
+    return "json"
+
+
+def cast(type: str, value: Any) -> Any:
+    # json does not distinguish 1.0 from 1
+    if type == "float" and value is not None:
+        return float(value)
+    return value
+
+
+class Stats(defaultdict):
+    """
+    Column-oriented samples as used by the benchmark drivers.
+    Remembers how many rows are already stored so that only new rows are
+    appended, and carries tags that are added to every new row.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(list)
+        self.persisted = 0
+        # rows before this index were not measured in this session, i.e.
+        # imported from a legacy file that is not stored yet, and stay untagged
+        self.tagged_from = 0
+        self.tags: Dict[str, Any] = {}
+
+    def num_rows(self) -> int:
+        return max((len(v) for v in self.values()), default=0)
+
+    def apply_tags(self, start: int) -> None:
+        end = self.num_rows()
+        for k, v in self.tags.items():
+            column = self[k]
+            column.extend([None] * (start - len(column)))
+            column.extend([v] * (end - len(column)))
+
+    def append_rows(self, rows: Iterable[Dict[str, Any]]) -> None:
+        """Appends rows that do not need to have the same columns"""
+        for row in rows:
+            start = self.num_rows()
+            for k, v in row.items():
+                column = self[k]
+                column.extend([None] * (start - len(column)))
+                column.append(v)
+
+    def rows(self, start: int = 0) -> Iterator[Dict[str, Any]]:
+        for i in range(start, self.num_rows()):
+            yield {k: v[i] for k, v in self.items() if i < len(v) and v[i] is not None}
+
+
+class ResultStore:
+    """
+    Append-only JSON-lines file with one record per sample.
+
+    The first occurrence of a column is preceded by a schema record with its
+    type, so readers do not have to guess types from ragged data and can
+    restrict parsing to the columns they need.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._schema: Optional[Dict[str, str]] = None
+
+    def schema(self) -> Dict[str, str]:
+        if self._schema is None:
+            self._schema = {}
+            for record in self._records(schema_only=True):
+                self._schema.update(record[SCHEMA_KEY])
+        return self._schema
+
+    def _records(self, schema_only: bool = False) -> Iterator[Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            for line in f:
+                if schema_only and SCHEMA_KEY not in line:
+                    continue
+                if line.strip() == "":
+                    continue
+                record = json.loads(line)
+                if schema_only == (SCHEMA_KEY in record):
+                    yield record
+
+    def append(self, records: List[Dict[str, Any]]) -> None:
+        if not records:
+            return
+        schema = self.schema()
+        lines = []
+        for record in records:
+            new_columns = {}
+            for k, v in record.items():
+                if k not in schema and v is not None:
+                    new_columns[k] = schema[k] = type_name(v)
+            if new_columns:
+                lines.append(json.dumps({SCHEMA_KEY: new_columns}))
+            lines.append(json.dumps(record))
+        with open(self.path, "a") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def read(self, columns: Optional[List[str]] = None) -> Dict[str, List[Any]]:
+        """
+        Returns the requested columns (all by default). Missing values in a
+        row are filled with None so that all columns have the same length.
+        """
+        schema = self.schema()
+        if columns is None:
+            columns = list(schema.keys())
+        data: Dict[str, List[Any]] = {c: [] for c in columns}
+        for record in self._records():
+            for c in columns:
+                data[c].append(cast(schema.get(c, "json"), record.get(c)))
+        return data
+
+
+def completed_runs(stats: Stats, columns: Dict[str, Any]) -> Set[Tuple[Any, ...]]:
+    """
+    The values of the given columns for every row, i.e. the runs a sweep can
+    skip. Rows written before a column existed get the default from columns.
+    """
+    done = set()
+    for i in range(stats.num_rows()):
+        key = []
+        for column, default in columns.items():
+            values = stats.get(column, [])
+            value = values[i] if i < len(values) else None
+            key.append(default if value is None else value)
+        done.add(tuple(key))
+    return done
+
+
+def read_legacy_stats(path: str, stats: Stats) -> None:
+    """Imports the dict-of-lists json files written by older drivers"""
+    with open(path) as f:
+        for key, value in json.load(f).items():
+            stats[key] = value
+
+
+def read_stats(path: str) -> Stats:
+    stats = Stats()
+    store = ResultStore(path)
+    if os.path.exists(path):
+        for k, v in store.read().items():
+            stats[k] = v
+        stats.persisted = stats.tagged_from = stats.num_rows()
+        return stats
+
+    legacy = path[: -len(".jsonl")] + ".json"
+    if path.endswith(".jsonl") and os.path.exists(legacy):
+        # rows are written to the new store on the next write_stats
+        read_legacy_stats(legacy, stats)
+        stats.tagged_from = stats.num_rows()
+    return stats
+
+
+def write_stats(path: str, stats: Stats) -> None:
+    stats.apply_tags(stats.tagged_from)
+    ResultStore(path).append(list(stats.rows(stats.persisted)))
+    stats.persisted = stats.tagged_from = stats.num_rows()
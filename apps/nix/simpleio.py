@@ -1,5 +1,4 @@
 import os
-import json
 import sys
 import signal
 from typing import Dict, List, Optional
@@ -15,7 +14,9 @@ from helpers import (
     write_stats,
     scone_env,
 )
-from storage import Storage, StorageKind
+from fingerprint import tag_stats
+from capture import Capture, TaggedParser
+from storage import Storage, StorageBackend, StorageKind
 
 
 def benchmark_simpleio(
@@ -47,8 +48,6 @@ def benchmark_simpleio(
     env_string = []
     for k, v in env.items():
         env_string.append(f"{k}={v}")
-    report = ""
-    in_results = False
     env = os.environ.copy()
     env.update(extra_env)
 
@@ -62,20 +61,23 @@ def benchmark_simpleio(
         str(bs * 1024),
     ]
     print(f"$ {' '.join(env_string)} {' '.join(cmd)}")
-    proc = subprocess.Popen(cmd, stdout=stdout, text=True, env=env)
-    try:
-        assert proc.stdout is not None
-        for line in proc.stdout:
-            print(f"stdout: {line}", end="")
-            if line == "<result>\n":
-                in_results = True
-            elif in_results and line == "</result>\n":
+    proc = subprocess.Popen(cmd, stdout=stdout, stderr=stdout, text=True, env=env)
+    jsondata = None
+    with Capture(proc, f"simpleio-{system}-{bs}-{NOW}.log.gz", [TaggedParser("result")]) as capture:
+        try:
+            assert proc.stdout is not None
+            for _, jsondata in capture.samples():
                 break
-            elif in_results:
-                report = line
-    finally:
-        proc.send_signal(signal.SIGINT)
-    jsondata = json.loads(report)
+        finally:
+            try:
+                proc.send_signal(signal.SIGINT)
+                proc.wait(timeout=3)
+            except subprocess.TimeoutExpired:
+                proc.send_signal(signal.SIGKILL)
+                proc.wait()
+        if jsondata is None:
+            capture.print_tail()
+            raise RuntimeError(f"Did not get a result when running benchmark for {system}")
     stats["system"].append(system)
     stats["bytes"].append(jsondata["bytes"])
     stats["time"].append(jsondata["time"])
@@ -92,46 +94,49 @@ def benchmark_sgx_io(storage: Storage, stats: Dict[str, List], bs:int) -> None:
         )
 
 
-#def benchmark_sgx_lkl(storage: Storage, stats: Dict[str, List]) -> None:
-#    mount = storage.setup(StorageKind.LKL)
-#
-#    with mount as mnt:
-#        benchmark_simpleio(
-#            storage,
-#            "sgx-lkl",
-#            "simpleio-sgx-lkl",
-#            mnt,
-#            stats,
-#            extra_env=mount.extra_env(),
-#        )
-#
-#
+def benchmark_sgx_lkl(storage: Storage, stats: Dict[str, List], bs: int) -> None:
+    mount = storage.setup(StorageKind.LKL)
+
+    with mount as mnt:
+        benchmark_simpleio(
+            storage,
+            "sgx-lkl",
+            "simpleio-sgx-lkl",
+            mnt,
+            stats,
+            bs,
+            extra_env=mount.extra_env(),
+        )
+
+
 #def benchmark_scone(storage: Storage, stats: Dict[str, List]) -> None:
 #    with storage.setup(StorageKind.NATIVE) as mnt:
 #        benchmark_simpleio(storage, "scone", "simpleio-scone", mnt, stats, extra_env=scone_env(mnt))
-#
-#
-#def benchmark_native(storage: Storage, stats: Dict[str, List]) -> None:
-#    with storage.setup(StorageKind.NATIVE) as mnt:
-#        benchmark_simpleio(storage, "native", "simpleio-native", mnt, stats)
+
+
+def benchmark_native(storage: Storage, stats: Dict[str, List], bs: int) -> None:
+    with storage.setup(StorageKind.NATIVE) as mnt:
+        benchmark_simpleio(storage, "native", "simpleio-native", mnt, stats, bs)
 
 
 BENCHMARKS = {
-    #"native": benchmark_native,
+    "native": benchmark_native,
     "sgx-io": benchmark_sgx_io,
     #"scone": benchmark_scone,
-    #"sgx-lkl": benchmark_sgx_lkl,
+    "sgx-lkl": benchmark_sgx_lkl,
+}
+# only sgx-io is measured on the NVMe; the others let the loop backend run
+DEFAULT_BENCHMARKS = {
+    StorageBackend.NVME: ["sgx-io"],
+    StorageBackend.LOOP: ["native", "sgx-lkl"],
 }
 
 
 def main() -> None:
-    if len(sys.argv) <= 1:
-        benchmarks = BENCHMARKS
-    else:
-        benchmarks = {k: BENCHMARKS[k] for k in (sys.argv[1:])}
-
-    stats = read_stats("simpleio-stats.json")
+    stats = read_stats("simpleio-stats.jsonl")
     storage = Storage(create_settings())
+    names = sys.argv[1:] or DEFAULT_BENCHMARKS[storage.backend]
+    benchmarks = {k: BENCHMARKS[k] for k in names if storage.supports_system(k)}
     system = set(stats["system"])
 
     # batch sizes in kilobytes
@@ -144,7 +149,8 @@ def main() -> None:
                 print(f"skip {name} benchmark")
                 continue
             benchmark(storage, stats, bs)
-            write_stats("simpleio-stats.json", stats)
+            tag_stats(stats, storage.settings)
+            write_stats("simpleio-stats.jsonl", stats)
 
     csv = f"simpleio-{NOW}.tsv"
     print(csv)
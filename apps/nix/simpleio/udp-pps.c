@@ -0,0 +1,304 @@
+#define _GNU_SOURCE
+
+#include <errno.h>
+#include <inttypes.h>
+#include <pthread.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+#include <unistd.h>
+#include <arpa/inet.h>
+#include <sys/socket.h>
+
+/*
+ * Packets per second with small UDP datagrams.
+ *
+ * The server counts the datagrams of each run and reflects those that ask
+ * for it; a run ends when the next one starts or after a second without
+ * traffic, at which point one json line is printed for it:
+ *
+ *   udp-pps server PORT
+ *
+ * The client sends SIZE byte datagrams at RATE packets per second (0 means
+ * as fast as possible) for SECONDS, either one way (send) or expecting each
+ * datagram back (echo):
+ *
+ *   udp-pps send|echo HOST PORT SIZE RATE SECONDS RUN
+ *
+ * A run id of 0 is reserved for `udp-pps probe HOST PORT`, which exits
+ * with 0 once the server answers.
+ */
+
+#define MAX_PAYLOAD 1472
+#define FLAG_ECHO 1
+/* reading the tsc exits the enclave, so only every n-th packet does it */
+#define TSC_SAMPLE 256
+
+struct header {
+  uint32_t run;
+  uint32_t flags;
+  uint64_t seq;
+};
+
+struct run_stats {
+  uint32_t run;
+  uint64_t received;
+  uint64_t bytes;
+  uint64_t echoed;
+  uint64_t first_tsc;
+  uint64_t last_tsc;
+  /* packets received between first_tsc and last_tsc */
+  uint64_t tsc_packets;
+};
+
+struct client_ctx {
+  int fd;
+  volatile int done;
+  uint64_t echoed;
+};
+
+static inline uint64_t rdtsc(void) {
+  unsigned a, d;
+  asm volatile("rdtsc" : "=a"(a), "=d"(d));
+  return ((uint64_t)a) | (((uint64_t)d) << 32);
+}
+
+static uint64_t now_ns(void) {
+  struct timespec ts;
+  clock_gettime(CLOCK_MONOTONIC, &ts);
+  return (uint64_t)ts.tv_sec * 1000000000ULL + ts.tv_nsec;
+}
+
+static int parse_addr(const char *host, int port, struct sockaddr_in *addr) {
+  memset(addr, 0, sizeof(*addr));
+  addr->sin_family = AF_INET;
+  addr->sin_port = htons(port);
+  if (inet_aton(host, &addr->sin_addr) == 0) {
+    fprintf(stderr, "inet_aton(%s) failed\n", host);
+    return -1;
+  }
+  return 0;
+}
+
+static int set_timeout(int fd, time_t sec, long usec) {
+  struct timeval tv = { .tv_sec = sec, .tv_usec = usec };
+  if (setsockopt(fd, SOL_SOCKET, SO_RCVTIMEO, &tv, sizeof(tv)) == -1) {
+    perror("setsockopt(SO_RCVTIMEO)");
+    return -1;
+  }
+  return 0;
+}
+
+static void flush_run(struct run_stats *s) {
+  if (s->run != 0 && s->received > 0) {
+    printf("{\"run\": %" PRIu32 ", \"received\": %" PRIu64 ", \"bytes\": %" PRIu64
+           ", \"echoed\": %" PRIu64 ", \"cycles\": %" PRIu64 ", \"cycle_packets\": %" PRIu64 "}\n",
+           s->run, s->received, s->bytes, s->echoed,
+           s->last_tsc - s->first_tsc, s->tsc_packets);
+    fflush(stdout);
+  }
+  memset(s, 0, sizeof(*s));
+}
+
+static int server(int port) {
+  static char buf[MAX_PAYLOAD];
+  struct sockaddr_in addr = {
+    .sin_family = AF_INET,
+    .sin_port = htons(port),
+    .sin_addr.s_addr = htonl(INADDR_ANY),
+  };
+  struct run_stats s = {};
+
+  int fd = socket(AF_INET, SOCK_DGRAM, IPPROTO_UDP);
+  if (fd == -1) {
+    perror("socket");
+    return 1;
+  }
+  if (bind(fd, (struct sockaddr *)&addr, sizeof(addr)) == -1) {
+    perror("bind");
+    return 1;
+  }
+  if (set_timeout(fd, 1, 0) == -1) {
+    return 1;
+  }
+
+  printf("<results>\n");
+  fflush(stdout);
+  for (;;) {
+    struct sockaddr_in peer;
+    socklen_t peer_len = sizeof(peer);
+    ssize_t n = recvfrom(fd, buf, sizeof(buf), 0, (struct sockaddr *)&peer, &peer_len);
+    if (n == -1) {
+      if (errno == EAGAIN || errno == EWOULDBLOCK || errno == EINTR) {
+        flush_run(&s);
+        continue;
+      }
+      perror("recvfrom()");
+      return 1;
+    }
+    if ((size_t)n < sizeof(struct header)) {
+      continue;
+    }
+    struct header *h = (struct header *)buf;
+    if (h->run == 0) {
+      sendto(fd, buf, n, 0, (struct sockaddr *)&peer, peer_len);
+      continue;
+    }
+    if (h->run != s.run) {
+      flush_run(&s);
+      s.run = h->run;
+    }
+
+    s.received++;
+    s.bytes += n;
+    if (s.received == 1) {
+      s.first_tsc = s.last_tsc = rdtsc();
+    } else if (s.received % TSC_SAMPLE == 0) {
+      s.last_tsc = rdtsc();
+      s.tsc_packets = s.received - 1;
+    }
+    if (h->flags & FLAG_ECHO) {
+      if (sendto(fd, buf, n, 0, (struct sockaddr *)&peer, peer_len) == n) {
+        s.echoed++;
+      }
+    }
+  }
+}
+
+static void *receive_echoes(void *_args) {
+  struct client_ctx *ctx = (struct client_ctx *)_args;
+  static char buf[MAX_PAYLOAD];
+  for (;;) {
+    ssize_t n = recv(ctx->fd, buf, sizeof(buf), 0);
+    if (n >= 0) {
+      ctx->echoed++;
+    } else if (errno == EAGAIN || errno == EWOULDBLOCK) {
+      /* a timeout after the last send means the stragglers are lost */
+      if (ctx->done) {
+        return NULL;
+      }
+    } else if (errno != EINTR && errno != ECONNREFUSED) {
+      perror("recv()");
+      return NULL;
+    }
+  }
+}
+
+static int client(int echo, const char *host, int port, size_t size,
+                  uint64_t rate, double seconds, uint32_t run) {
+  static char buf[MAX_PAYLOAD];
+  struct sockaddr_in addr;
+  struct client_ctx ctx = {};
+  pthread_t receiver;
+  uint64_t sent = 0, send_errors = 0;
+
+  if (size < sizeof(struct header) || size > MAX_PAYLOAD) {
+    fprintf(stderr, "size must be between %zu and %d\n", sizeof(struct header), MAX_PAYLOAD);
+    return 1;
+  }
+  if (parse_addr(host, port, &addr) == -1) {
+    return 1;
+  }
+  ctx.fd = socket(AF_INET, SOCK_DGRAM, IPPROTO_UDP);
+  if (ctx.fd == -1) {
+    perror("socket");
+    return 1;
+  }
+  if (connect(ctx.fd, (struct sockaddr *)&addr, sizeof(addr)) == -1) {
+    perror("connect");
+    return 1;
+  }
+  if (echo) {
+    if (set_timeout(ctx.fd, 0, 200000) == -1) {
+      return 1;
+    }
+    pthread_create(&receiver, NULL, receive_echoes, &ctx);
+  }
+
+  struct header *h = (struct header *)buf;
+  h->run = run;
+  h->flags = echo ? FLAG_ECHO : 0;
+
+  uint64_t start = now_ns();
+  uint64_t end = start + (uint64_t)(seconds * 1e9);
+  uint64_t interval = rate ? 1000000000ULL / rate : 0;
+  uint64_t now = start;
+  while (now < end) {
+    if (interval) {
+      /* catch up after a stall instead of lowering the rate */
+      uint64_t next = start + sent * interval;
+      while ((now = now_ns()) < next);
+    }
+    h->seq = sent;
+    if (send(ctx.fd, buf, size, 0) == -1) {
+      if (errno != ENOBUFS && errno != EAGAIN && errno != ECONNREFUSED) {
+        perror("send()");
+        return 1;
+      }
+      send_errors++;
+    } else {
+      sent++;
+    }
+    /* checking the clock on every packet limits the unpaced rate */
+    if (!interval && (sent + send_errors) % 64 != 0) {
+      continue;
+    }
+    now = now_ns();
+  }
+  double elapsed = (now_ns() - start) / 1e9;
+
+  if (echo) {
+    ctx.done = 1;
+    pthread_join(receiver, NULL);
+  }
+  printf("{\"run\": %" PRIu32 ", \"mode\": \"%s\", \"size\": %zu, \"rate\": %" PRIu64
+         ", \"sent\": %" PRIu64 ", \"send_errors\": %" PRIu64 ", \"echoed\": %" PRIu64
+         ", \"seconds\": %lf}\n",
+         run, echo ? "echo" : "send", size, rate, sent, send_errors, ctx.echoed, elapsed);
+  close(ctx.fd);
+  return 0;
+}
+
+static int probe(const char *host, int port) {
+  struct sockaddr_in addr;
+  struct header h = {};
+  char buf[MAX_PAYLOAD];
+
+  if (parse_addr(host, port, &addr) == -1) {
+    return 1;
+  }
+  int fd = socket(AF_INET, SOCK_DGRAM, IPPROTO_UDP);
+  if (fd == -1) {
+    perror("socket");
+    return 1;
+  }
+  if (connect(fd, (struct sockaddr *)&addr, sizeof(addr)) == -1 || set_timeout(fd, 1, 0) == -1) {
+    return 1;
+  }
+  if (send(fd, &h, sizeof(h), 0) == -1 || recv(fd, buf, sizeof(buf), 0) == -1) {
+    return 1;
+  }
+  return 0;
+}
+
+int main(int argc, char **argv) {
+  if (argc == 3 && strcmp(argv[1], "server") == 0) {
+    return server(atoi(argv[2]));
+  }
+  if (argc == 4 && strcmp(argv[1], "probe") == 0) {
+    return probe(argv[2], atoi(argv[3]));
+  }
+  if (argc == 8 && (strcmp(argv[1], "send") == 0 || strcmp(argv[1], "echo") == 0)) {
+    return client(strcmp(argv[1], "echo") == 0, argv[2], atoi(argv[3]),
+                  strtoul(argv[4], NULL, 10), strtoull(argv[5], NULL, 10),
+                  atof(argv[6]), strtoul(argv[7], NULL, 10));
+  }
+  fprintf(stderr,
+          "USAGE: %s server PORT\n"
+          "       %s send|echo HOST PORT SIZE RATE SECONDS RUN\n"
+          "       %s probe HOST PORT\n",
+          argv[0], argv[0], argv[0]);
+  return 1;
+}
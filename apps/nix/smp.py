@@ -13,9 +13,16 @@ from helpers import (
     read_stats,
     write_stats,
 )
+from fingerprint import tag_stats
+from fio_jobs import FioJob, tag_job
 from storage import Storage, StorageKind
 
 
+def smp_job(cores: int) -> FioJob:
+    """One job per enclave thread, formerly fio-rand-RW-smp-{cores}.job"""
+    return FioJob(numjobs=cores, size="1G", runtime=50, thread=True)
+
+
 def benchmark_fio(
     system: str,
     attr: str,
@@ -40,7 +47,8 @@ def benchmark_fio(
     if os.environ.get("SGXLKL_ENABLE_GDB", "0") == "1":
         stdout = None
 
-    cmd = [str(fio), "bin/fio", "--output-format=json", "--eta=always", f"fio-rand-RW-smp-{cores}.job"]
+    fio_job = smp_job(cores)
+    cmd = [str(fio), "bin/fio", "--output-format=json", "--eta=always"] + fio_job.args()
     proc = subprocess.Popen(cmd, stdout=stdout, text=True, env=env)
     data = ""
     in_json = False
@@ -75,6 +83,7 @@ def benchmark_fio(
                         stats[f"{op}-{metric_name}-{name}"].append(submetric)
                 else:
                     stats[f"{op}-{metric_name}"].append(metric)
+    tag_job(stats, fio_job)
 
 
 def benchmark_sgx_io(storage: Storage, stats: Dict[str, List], cores: int) -> None:
@@ -84,7 +93,7 @@ def benchmark_sgx_io(storage: Storage, stats: Dict[str, List], cores: int) -> No
 
 
 def main() -> None:
-    stats = read_stats("smp.json")
+    stats = read_stats("smp.jsonl")
 
     settings = create_settings()
 
@@ -96,7 +105,8 @@ def main() -> None:
             print(f"skip {cores} cores")
             continue
         benchmark_sgx_io(storage, stats, cores)
-        write_stats("smp.json", stats)
+        tag_stats(stats, settings)
+        write_stats("smp.jsonl", stats)
 
     csv = f"smp-{NOW}.tsv"
     print(csv)
@@ -12,6 +12,7 @@ from helpers import (
     read_stats,
     write_stats,
 )
+from fingerprint import tag_stats
 from storage import Storage, StorageKind
 
 
@@ -72,7 +73,7 @@ def benchmark_simpleio(
 
 
 def main() -> None:
-    stats = read_stats("spdk-zerocopy.json")
+    stats = read_stats("spdk-zerocopy.jsonl")
     storage = Storage(create_settings())
 
     mount = storage.setup(StorageKind.SPDK)
@@ -89,7 +90,8 @@ def main() -> None:
         benchmark_simpleio(
             storage, "not-optimized", "simpleio-sgx-io", mnt, stats, extra_env=extra_env2
         )
-    write_stats("spdk-zerocopy.json", stats)
+    tag_stats(stats, storage.settings)
+    write_stats("spdk-zerocopy.jsonl", stats)
 
     csv = f"spdk-zerocopy-{NOW}.tsv"
     print(csv)
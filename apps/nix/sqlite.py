@@ -2,18 +2,21 @@ import os
 import subprocess
 import signal
 from typing import Dict, List, Any
-import re
 
 import pandas as pd
 from helpers import (
     NOW,
     create_settings,
     nix_build,
+    nix_build_all,
     read_stats,
     write_stats,
     scone_env,
     flamegraph_env
 )
+from fingerprint import tag_stats
+from dma_monitor import monitor_dma
+from capture import Capture, RegexParser
 from storage import Storage, StorageKind
 
 
@@ -36,20 +39,16 @@ def benchmark_sqlite(
     sqlite = nix_build(attr)
     stdout = subprocess.PIPE
     cmd = [str(sqlite)]
-    proc = subprocess.Popen(cmd, stdout=stdout, text=True, env=env)
+    proc = subprocess.Popen(cmd, stdout=stdout, stderr=stdout, text=True, env=env)
 
     print(f"[Benchmark]:{system}")
 
     n_rows = 0
-    try:
-        if proc.stdout is None:
-            proc.wait()
-        else:
-            for line in proc.stdout:
-                line = line.rstrip()
-                print(line)
-                match = re.match(r"(?: \d+ - |\s+)([^.]+)[.]+\s+([0-9.]+)s", line)
-                if match:
+    parser = RegexParser(r"(?: \d+ - |\s+)([^.]+)[.]+\s+([0-9.]+)s")
+    with Capture(proc, f"sqlite-{system}-{NOW}.log.gz", [parser]) as capture:
+        try:
+            with monitor_dma(proc.pid, f"sqlite-{system}"):
+                for _, match in capture.samples():
                     if "TOTAL" in match.group(1):
                         continue
                     stats["system"].append(system)
@@ -58,12 +57,18 @@ def benchmark_sqlite(
                     n_rows += 1
                     if n_rows == 3:
                         break
-    finally:
-        proc.send_signal(signal.SIGINT)
+        finally:
+            try:
+                proc.send_signal(signal.SIGINT)
+                proc.wait(timeout=3)
+            except subprocess.TimeoutExpired:
+                proc.send_signal(signal.SIGKILL)
+                proc.wait()
 
-    expected = 3
-    if n_rows < expected:
-        raise RuntimeError(f"Expected {expected} rows, got: {n_rows} when running benchmark for {system}")
+        expected = 3
+        if n_rows < expected:
+            capture.print_tail()
+            raise RuntimeError(f"Expected {expected} rows, got: {n_rows} when running benchmark for {system}")
 
 
 def benchmark_sqlite_native(storage: Storage, stats: Dict[str, List[Any]]) -> None:
@@ -99,7 +104,7 @@ def benchmark_sqlite_scone(storage: Storage, stats: Dict[str, List[Any]]) -> Non
 
 
 def main() -> None:
-    stats = read_stats("sqlite.json")
+    stats = read_stats("sqlite.jsonl")
     settings = create_settings()
     storage = Storage(settings)
 
@@ -110,12 +115,19 @@ def main() -> None:
         "sgx-io": benchmark_sqlite_sgx_io,
     }
     system = set(stats["system"])
+    nix_build_all(
+        [f"sqlite-{name}" for name in benchmarks if name not in system]
+        + [storage.image_attr(StorageKind.NATIVE), storage.image_attr(StorageKind.SCONE)]
+    )
     for name, benchmark in benchmarks.items():
         if name in system:
             print(f"skip {name} benchmark")
             continue
+        if not storage.supports_system(name):
+            continue
         benchmark(storage, stats)
-        write_stats("sqlite.json", stats)
+        tag_stats(stats, settings)
+        write_stats("sqlite.jsonl", stats)
 
     csv = f"sqlite-speedtest-{NOW}.tsv"
     print(csv)
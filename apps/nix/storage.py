@@ -1,12 +1,17 @@
 import getpass
+import json
 import os
+import sys
 import time
 from enum import Enum
-from typing import Any, Optional, Dict
+from typing import Any, Optional, Dict, List
 from pathlib import Path
 import subprocess
 
 from helpers import ROOT, Settings, nix_build, run
+from block_tuning import PROFILES, QueueProfile, QueueTuning
+from hugepages import current_plan, dma_memory, mounted_page_size, reserve_hugepages
+from provisioning import QUEUE_DEPTH, image_manifest, read_device_manifest, write_device_manifest
 
 
 class StorageKind(Enum):
@@ -16,19 +21,37 @@ class StorageKind(Enum):
     SCONE = 4
 
 
-def get_total_memory() -> int:
-    with open("/proc/meminfo") as f:
-        for line in f:
-            name, raw_size = line.split(":")
-            if name.strip() != "MemTotal":
-                continue
-            size, unit = raw_size.strip().split()
-            return int(size) * 1024
-    raise Exception("MemTotal entry not found in /proc/meminfo")
+class StorageBackend(Enum):
+    # the P4600 from NVME_PCI_ID, required for SPDK
+    NVME = "nvme"
+    # file-backed loop device, for machines without a spare NVMe
+    LOOP = "loop"
 
 
-def cryptsetup_luks_open(dev: str, cryptsetup_name: str, key: str) -> None:
-    run(["sudo", "cryptsetup", "open", dev, cryptsetup_name], input=key)
+# sgx-lkl attaches to the controller with spdk_nvme_probe(), so SPDK has no
+# bdev layer to put a malloc or AIO disk under
+SUPPORTED_KINDS = {
+    StorageBackend.NVME: set(StorageKind),
+    StorageBackend.LOOP: {StorageKind.NATIVE, StorageKind.LKL, StorageKind.SCONE},
+}
+
+SYSTEM_KINDS = {
+    "native": StorageKind.NATIVE,
+    "sgx-lkl": StorageKind.LKL,
+    "sgx-io": StorageKind.SPDK,
+    "scone": StorageKind.SCONE,
+}
+
+LOOP_DISK = ROOT.joinpath("loop-disk.img")
+
+
+def cryptsetup_luks_open(
+    dev: str, cryptsetup_name: str, key: str, allow_discards: bool = False, check: bool = True
+) -> bool:
+    cmd = ["sudo", "cryptsetup", "open", dev, cryptsetup_name]
+    if allow_discards:
+        cmd.append("--allow-discards")
+    return run(cmd, input=key, check=check).returncode == 0
 
 
 def cryptsetup_luks_close(cryptsetup_name: str, check: bool=True) -> None:
@@ -41,13 +64,22 @@ MOUNTPOINT = ROOT.joinpath("iotest-mnt")
 
 class Mount:
     def __init__(
-        self, kind: StorageKind, raw_dev: str, dev: str, hd_key: Optional[str]
+        self,
+        kind: StorageKind,
+        raw_dev: str,
+        dev: str,
+        hd_key: Optional[str],
+        queue_profile: QueueProfile = PROFILES["booted"],
     ) -> None:
         self.kind = kind
         self.raw_dev = raw_dev
         self.dev = dev
         self.cryptsetup_name = Path(self.raw_dev).name
         self.hd_key = hd_key
+        # SPDK unbinds the device from the kernel block layer
+        self.tuning = None
+        if kind != StorageKind.SPDK:
+            self.tuning = QueueTuning(raw_dev, queue_profile)
 
         self.mountpoint = Path("/mnt/spdk0")
         if self.kind in [StorageKind.NATIVE, StorageKind.SCONE]:
@@ -65,6 +97,9 @@ class Mount:
         return {}
 
     def mount(self) -> None:
+        if self.tuning is not None:
+            self.tuning.apply()
+
         if self.kind not in [StorageKind.NATIVE, StorageKind.SCONE]:
             return
 
@@ -77,6 +112,9 @@ class Mount:
         run(["sudo", "chown", "-R", getpass.getuser(), str(MOUNTPOINT)])
 
     def umount(self) -> None:
+        if self.tuning is not None:
+            self.tuning.restore()
+
         if self.kind not in [StorageKind.NATIVE, StorageKind.SCONE]:
             return
 
@@ -100,20 +138,19 @@ class Mount:
         self.umount()
 
 
-def set_hugepages(num: int) -> None:
-    run(
-        [
-            "sudo",
-            "sh",
-            "-c",
-            "echo $0 > /sys/devices/system/node/node0/hugepages/hugepages-2048kB/nr_hugepages",
-            str(num),
-        ]
-    )
-
+def setup_hugepages(
+    kind: StorageKind, pci_ids: List[Optional[str]] = [], dpdk_queues: int = 1
+) -> None:
+    """
+    Reserves huge pages for the SPDK/DPDK DMA memory of sgx-lkl on the NUMA
+    node local to the given devices; all other kinds get none.
+    """
+    need = dma_memory(dpdk_queues) if kind == StorageKind.SPDK else 0
+    plan = current_plan(need, pci_ids)
+    if plan is not None and mounted_page_size("/dev/hugepages") == plan.page_size:
+        print(f"huge pages unchanged: {plan}")
+        return
 
-def setup_hugepages(kind: StorageKind) -> None:
-    num = 0
     # remount to free up space
     while os.path.ismount("/dev/hugepages"):
         try:
@@ -123,21 +160,19 @@ def setup_hugepages(kind: StorageKind) -> None:
             print(f"unmount {MOUNTPOINT} failed; retry in 1s")
             time.sleep(1)
 
-    run(["sudo", "mount", "-t", "hugetlbfs", "hugetlbfs", "/dev/hugepages"])
-    set_hugepages(0)
-
-    if kind != StorageKind.SPDK:
-        return
-
-    total_memory = get_total_memory()
-    # leave 6 GB for the system
-    gigabyte = 1024 * 1024 * 1024
-    spdk_memory = total_memory - 6 * gigabyte
-    if spdk_memory < gigabyte:
-        raise RuntimeError("Get more memory dude!")
-    num = int(spdk_memory / 2048 / 1024)
-
-    set_hugepages(num)
+    plan = reserve_hugepages(need, pci_ids)
+    run(
+        [
+            "sudo",
+            "mount",
+            "-t",
+            "hugetlbfs",
+            "-o",
+            f"pagesize={plan.page_size // 1024}K",
+            "hugetlbfs",
+            "/dev/hugepages",
+        ]
+    )
 
 
 def setup_luks(plain_dev: str, luks_name: str, key: str) -> str:
@@ -164,25 +199,75 @@ def setup_luks(plain_dev: str, luks_name: str, key: str) -> str:
         ],
         input=key,
     )
-    cryptsetup_luks_open(plain_dev, luks_name, key)
+    cryptsetup_luks_open(plain_dev, luks_name, key, allow_discards=True)
     return f"/dev/mapper/{luks_name}"
 
+
+def reuse_luks(plain_dev: str, luks_name: str, key: str) -> Optional[str]:
+    """
+    Opens an existing container so that its content can be updated in
+    place; a fresh luksFormat changes the master key and thereby every block.
+    """
+    if run(["sudo", "cryptsetup", "isLuks", plain_dev], check=False).returncode != 0:
+        return None
+    if not cryptsetup_luks_open(plain_dev, luks_name, key, allow_discards=True, check=False):
+        return None
+    return f"/dev/mapper/{luks_name}"
+
+
+def provision_image(image: str, dev: str, force: bool) -> None:
+    """
+    Writes the image extents that differ from the device content.
+    """
+    last = read_device_manifest(dev)
+    if last is not None and last["image"] != image:
+        print(f"{dev}: replacing {last['image']}")
+    manifest = image_manifest(image)
+    cmd = ["sudo", sys.executable, str(ROOT.joinpath("provisioning.py"))]
+    cmd += [image, dev, "--manifest", str(manifest)]
+    cmd += ["--queue-depth", os.environ.get("PROVISION_QUEUE_DEPTH", str(QUEUE_DEPTH))]
+    if force:
+        cmd.append("--force")
+    summary = json.loads(run(cmd).stdout.splitlines()[-1])
+    print(
+        f"{dev}: {summary['written']} extents written, {summary['unchanged']} unchanged, "
+        f"{summary['discarded']} discarded, {summary['zeroed']} zeroed "
+        f"in {summary['seconds']:.1f}s ({summary['mib_per_s']:.0f} MiB/s)"
+    )
+    write_device_manifest(dev, dict(image=image, manifest=str(manifest), **summary))
+
 # https://sconedocs.github.io/SCONE_Fileshield/
 
 
 class Storage:
     def __init__(self, settings: Settings) -> None:
         self.settings = settings
+        # applied by Mount.mount to the kernel block device
+        self.queue_profile = PROFILES["booted"]
+        # of the last mount, with the values read back after applying the profile
+        self.tuning: Optional[QueueTuning] = None
 
-    def setup(self, kind: StorageKind) -> Mount:
+    def image_attr(self, kind: StorageKind) -> str:
         if kind == StorageKind.SCONE and self.settings.spdk_hd_key:
-            image = nix_build("iotest-image-scone")
-        else:
-            image = nix_build("iotest-image")
+            return "iotest-image-scone"
+        return "iotest-image"
 
-        if MOUNTPOINT.is_mount():
-            run(["sudo", "umount", str(MOUNTPOINT)])
+    @property
+    def backend(self) -> StorageBackend:
+        return StorageBackend(self.settings.storage_backend)
+
+    def supports(self, kind: StorageKind) -> bool:
+        return kind in SUPPORTED_KINDS[self.backend]
 
+    def supports_system(self, system: str) -> bool:
+        """Prints why a benchmark system is skipped"""
+        kind = SYSTEM_KINDS[system]
+        if self.supports(kind):
+            return True
+        print(f"skip {system} benchmark: not supported by the {self.backend.value} backend")
+        return False
+
+    def _nvme_device(self) -> str:
         try:
             spdk_device = self.settings.spdk_device()
             if os.path.exists(f"/dev/mapper/{spdk_device}"):
@@ -206,29 +291,63 @@ class Storage:
         while not os.path.exists(raw_dev):
             print(".")
             time.sleep(1)
+        return raw_dev
+
+    def _loop_device(self) -> str:
+        if not LOOP_DISK.exists():
+            # sparse, provisioning discards (punches holes) instead of writing zeros
+            run(["truncate", "-s", self.settings.loop_disk_size, str(LOOP_DISK)])
+        attached = run(["losetup", "--noheadings", "--output", "NAME", "-j", str(LOOP_DISK)])
+        raw_dev = attached.stdout.strip().split("\n")[0]
+        if raw_dev:
+            if os.path.exists(f"/dev/mapper/{Path(raw_dev).name}"):
+                cryptsetup_luks_close(Path(raw_dev).name, check=False)
+            return raw_dev
+        cmd = ["sudo", "losetup", "--find", "--show", "--direct-io=on", str(LOOP_DISK)]
+        return run(cmd).stdout.strip()
+
+    def setup(self, kind: StorageKind, reflash: Optional[bool] = None) -> Mount:
+        """
+        Only the parts of the image that changed since the last run are
+        written to the device; reflash (or REFLASH=1) discards the whole
+        device and writes the full image instead.
+        """
+        if not self.supports(kind):
+            raise RuntimeError(f"{kind.name} is not supported by the {self.backend.value} backend")
+
+        image = nix_build(self.image_attr(kind))
 
-        # TRIM for optimal performance
-        run(["sudo", "blkdiscard", "-f", raw_dev])
-        if self.settings.spdk_hd_key and kind != StorageKind.SCONE:
-            dev = setup_luks(raw_dev, spdk_device, self.settings.spdk_hd_key)
+        if MOUNTPOINT.is_mount():
+            run(["sudo", "umount", str(MOUNTPOINT)])
+
+        if self.backend == StorageBackend.NVME:
+            raw_dev = self._nvme_device()
         else:
-            dev = raw_dev
-        run(
-            [
-                "sudo",
-                "dd",
-                f"if={image}",
-                f"of={dev}",
-                "bs=128M",
-                "conv=fdatasync",
-                "oflag=direct",
-                "status=progress",
-            ]
-        )
+            raw_dev = self._loop_device()
+        luks_name = Path(raw_dev).name
+
+        if reflash is None:
+            reflash = os.environ.get("REFLASH", "0") == "1"
+        if reflash:
+            # TRIM for optimal performance
+            run(["sudo", "blkdiscard", "-f", raw_dev])
+
+        dev = raw_dev
+        force = reflash
+        if self.settings.spdk_hd_key and kind != StorageKind.SCONE:
+            key = self.settings.spdk_hd_key
+            reused = None if reflash else reuse_luks(raw_dev, luks_name, key)
+            if reused is None:
+                dev = setup_luks(raw_dev, luks_name, key)
+                # new master key, nothing on the device can be reused
+                force = True
+            else:
+                dev = reused
+        provision_image(image, dev, force)
         run(["sudo", "resize2fs", dev])
 
         if self.settings.spdk_hd_key and kind != StorageKind.SCONE:
-            run(["sudo", "cryptsetup", "close", spdk_device])
+            run(["sudo", "cryptsetup", "close", luks_name])
 
         if kind == StorageKind.SPDK:
             run(
@@ -241,6 +360,8 @@ class Storage:
         elif kind == StorageKind.LKL:
             run(["sudo", "chown", getpass.getuser(), raw_dev])
 
-        setup_hugepages(kind)
+        setup_hugepages(kind, [self.settings.nvme_pci_id])
 
-        return Mount(kind, raw_dev, dev, self.settings.spdk_hd_key)
+        mount = Mount(kind, raw_dev, dev, self.settings.spdk_hd_key, self.queue_profile)
+        self.tuning = mount.tuning
+        return mount
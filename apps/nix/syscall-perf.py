@@ -14,6 +14,7 @@ from helpers import (
     read_stats,
     write_stats,
 )
+from fingerprint import tag_stats
 from network import Network, NetworkKind
 
 
@@ -101,7 +102,7 @@ BENCHMARKS = {
 
 
 def main() -> None:
-    stats = read_stats("syscall-perf.json")
+    stats = read_stats("syscall-perf.jsonl")
     system = set(stats["system"])
     benchmark = Benchmark()
 
@@ -110,7 +111,8 @@ def main() -> None:
             print(f"skip {name} benchmark")
             continue
         benchmark_func(benchmark, stats)
-        write_stats("syscall-perf.json", stats)
+        tag_stats(stats, benchmark.settings)
+        write_stats("syscall-perf.jsonl", stats)
 
     csv = f"syscall-perf-{NOW}.tsv"
     print(csv)
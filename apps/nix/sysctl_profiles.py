@@ -0,0 +1,170 @@
+"""
+Named TCP sysctl profiles that are applied to whichever stack terminates
+the connections: the host kernel for native and scone, the LKL kernel in
+the enclave (SGXLKL_SYSCTL) for sgx-lkl and sgx-io.
+
+Every profile sets the same keys, so switching profiles never leaves
+values of the previous one behind. Bump the version of a profile when its
+values change; results are tagged with name and version:
+
+    SYSCTL_PROFILES=tuned,tuned-bbr python3 iperf.py
+"""
+
+import gzip
+import os
+import re
+import sys
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+from privileged import Step
+from result_store import Stats
+
+# sgx-lkl prints the effective value of every sysctl it sets
+ENCLAVE_SYSCTL = re.compile(r"\[\s*SGX-LKL\s*\] sysctl (\S+) = (.*)")
+# rows written before profiles existed
+LEGACY = "legacy"
+
+
+@dataclass(frozen=True)
+class SysctlProfile:
+    name: str
+    version: int
+    values: Tuple[Tuple[str, str], ...]
+
+    @property
+    def tag(self) -> str:
+        return f"{self.name}-v{self.version}"
+
+    def lkl_value(self) -> str:
+        """Format of SGXLKL_SYSCTL"""
+        return ";".join(f"{k}={v}" for k, v in self.values)
+
+
+def profile(
+    name: str, version: int, base: Dict[str, str], overrides: Dict[str, str] = {}
+) -> SysctlProfile:
+    values = dict(base, **overrides)
+    # LKL stops at the first failing entry, keep the one most likely to be
+    # unsupported (an unavailable congestion control) last
+    cc = "net.ipv4.tcp_congestion_control"
+    items = [(k, v) for k, v in values.items() if k != cc] + [(cc, values[cc])]
+    return SysctlProfile(name, version, tuple(items))
+
+
+# Defaults of a 5.x kernel, spelled out so that the older LKL kernel and
+# the host start from the same values
+LINUX_DEFAULTS = {
+    "net.core.rmem_max": "212992",
+    "net.core.wmem_max": "212992",
+    "net.core.rmem_default": "212992",
+    "net.core.wmem_default": "212992",
+    "net.core.optmem_max": "20480",
+    "net.ipv4.tcp_rmem": "4096 131072 6291456",
+    "net.ipv4.tcp_wmem": "4096 16384 4194304",
+    "net.core.somaxconn": "4096",
+    "net.core.netdev_max_backlog": "1000",
+    "net.ipv4.tcp_congestion_control": "cubic",
+}
+
+# what the enclave runs used to get through SGXLKL_SYSCTL
+TUNED = dict(
+    LINUX_DEFAULTS,
+    **{
+        "net.core.rmem_max": "56623104",
+        "net.core.wmem_max": "56623104",
+        "net.core.rmem_default": "56623104",
+        "net.core.wmem_default": "56623104",
+        "net.core.optmem_max": "40960",
+        "net.ipv4.tcp_rmem": "4096 87380 56623104",
+        "net.ipv4.tcp_wmem": "4096 65536 56623104",
+        "net.core.somaxconn": "1024",
+        "net.core.netdev_max_backlog": "2000",
+    }
+)
+
+PROFILES = {
+    p.name: p
+    for p in [
+        profile("linux-default", 1, LINUX_DEFAULTS),
+        profile("tuned", 1, TUNED),
+        profile("tuned-bbr", 1, TUNED, {"net.ipv4.tcp_congestion_control": "bbr"}),
+        profile(
+            "tuned-backlog",
+            1,
+            TUNED,
+            {"net.core.somaxconn": "65535", "net.core.netdev_max_backlog": "250000"},
+        ),
+        profile(
+            "small-buffers",
+            1,
+            TUNED,
+            {
+                "net.core.rmem_max": "4194304",
+                "net.core.wmem_max": "4194304",
+                "net.core.rmem_default": "212992",
+                "net.core.wmem_default": "212992",
+                "net.ipv4.tcp_rmem": "4096 131072 4194304",
+                "net.ipv4.tcp_wmem": "4096 16384 4194304",
+            },
+        ),
+    ]
+}
+
+
+def sysctl_profiles() -> List[SysctlProfile]:
+    """Profiles to sweep, i.e. SYSCTL_PROFILES=tuned,tuned-bbr"""
+    names = os.environ.get("SYSCTL_PROFILES", "tuned").split(",")
+    unknown = [n for n in names if n not in PROFILES]
+    if unknown:
+        raise RuntimeError(f"unknown sysctl profiles {unknown}, choose from {list(PROFILES)}")
+    return [PROFILES[n] for n in names]
+
+
+def sysctl_path(key: str) -> str:
+    return "/proc/sys/" + key.replace(".", "/")
+
+
+def read_sysctl(key: str) -> str:
+    with open(sysctl_path(key)) as f:
+        # multi-value entries are tab separated
+        return " ".join(f.read().split())
+
+
+def sysctl_changes(values: Dict[str, str]) -> List[Step]:
+    steps = []
+    for key, value in values.items():
+        old = read_sysctl(key)
+        if old != value:
+            steps.append(Step(["sysctl", "-w", f"{key}={value}"], ["sysctl", "-w", f"{key}={old}"]))
+    return steps
+
+
+def host_sysctls(profile: SysctlProfile) -> Dict[str, str]:
+    return {key: read_sysctl(key) for key, _ in profile.values}
+
+
+def enclave_sysctls(log: str) -> Dict[str, str]:
+    """Effective values from the captured output of sgx-lkl-run"""
+    values = {}
+    with gzip.open(log, "rt") as f:
+        for line in f:
+            # <time>\t<stream>\t<line>, see capture.py
+            match = ENCLAVE_SYSCTL.search(line.rstrip("\n"))
+            if match:
+                values[match.group(1)] = match.group(2)
+    return values
+
+
+def tag_sysctl(stats: Stats, profile: SysctlProfile, effective: Dict[str, str]) -> None:
+    """Tags the following rows and warns about values the kernel did not take"""
+    for key, value in profile.values:
+        actual = effective.get(key)
+        if actual != value:
+            print(
+                f"sysctl profile {profile.tag}: {key} is {actual!r} instead of {value!r}",
+                file=sys.stderr,
+            )
+    stats.tags["sysctl-profile"] = profile.tag
+    stats.tags["sysctl"] = effective
+
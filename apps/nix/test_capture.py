@@ -0,0 +1,61 @@
+import gzip
+import subprocess
+import sys
+from pathlib import Path
+from typing import Any, List
+
+import pytest
+
+from capture import Capture, JsonBlockParser, Parser, RegexParser, TaggedParser
+
+
+def feed(parser: Parser, lines: List[str]) -> List[Any]:
+    return [sample for line in lines for sample in parser.feed(line)]
+
+
+def test_parser_is_abstract() -> None:
+    with pytest.raises(TypeError):
+        Parser()  # type: ignore
+
+
+def test_json_block_parser() -> None:
+    lines = ["fio-3.28", "{", '  "jobs": [', "    1", "  ]", "}", "noise", "{", '  "a": 2', "}"]
+    assert feed(JsonBlockParser(), lines) == [{"jobs": [1]}, {"a": 2}]
+
+
+def test_json_block_parser_incomplete() -> None:
+    assert feed(JsonBlockParser(), ["{", '  "jobs": []']) == []
+
+
+def test_tagged_parser() -> None:
+    lines = ['{"outside": 1}', "<result>", '{"bytes": 1}', '{"bytes": 2}', "</result>", '{"x": 3}']
+    assert feed(TaggedParser("result"), lines) == [{"bytes": 1}, {"bytes": 2}]
+
+
+def test_regex_parser() -> None:
+    matches = feed(RegexParser(r"(\w+): ([0-9.]+)s"), ["insert: 1.5s", "total 3s", "select: 2s"])
+    assert [m.groups() for m in matches] == [("insert", "1.5"), ("select", "2")]
+
+
+def test_capture_logs_and_yields_samples(tmp_path: Path) -> None:
+    script = "print('<result>'); print('{\"n\": 1}'); print('</result>'); print('done')"
+    proc = subprocess.Popen(
+        [sys.executable, "-c", script], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+    )
+    log = tmp_path.joinpath("out.log.gz")
+    with Capture(proc, str(log), [TaggedParser("result")]) as capture:
+        samples = [sample for _, sample in capture.samples()]
+        proc.wait()
+    assert samples == [{"n": 1}]
+    assert [line for _, _, line in capture.tail(2)] == ["</result>", "done"]
+    with gzip.open(log, "rt") as f:
+        assert [line.split("\t")[1:] for line in f][-1] == ["stdout", "done\n"]
+
+
+def test_capture_survives_bad_samples(tmp_path: Path) -> None:
+    script = "print('<r>'); print('not json'); print('{\"ok\": true}'); print('</r>')"
+    proc = subprocess.Popen([sys.executable, "-c", script], stdout=subprocess.PIPE, text=True)
+    with Capture(proc, str(tmp_path.joinpath("out.log.gz")), [TaggedParser("r")]) as capture:
+        samples = [sample for _, sample in capture.samples()]
+        proc.wait()
+    assert samples == [{"ok": True}]
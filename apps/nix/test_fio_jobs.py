@@ -0,0 +1,70 @@
+import pytest
+
+from fio_jobs import DEFAULT, DIMENSIONS, FioJob, fio_jobs, tag_job
+from result_store import Stats
+
+
+@pytest.fixture(autouse=True)
+def clean_env(monkeypatch: pytest.MonkeyPatch) -> None:
+    for name in list(DIMENSIONS.values()) + ["FIO_RUNTIME", "FIO_SWEEP"]:
+        monkeypatch.delenv(name, raising=False)
+
+
+def test_default_matches_the_old_job_file() -> None:
+    assert DEFAULT.name == "psync-bs4K-qd16-j8-r60-buffered-40G"
+    assert DEFAULT.rw == "randrw"
+    assert "--rwmixread=60" in DEFAULT.args()
+    assert "--thread" not in DEFAULT.args()
+
+
+def test_rw() -> None:
+    assert FioJob(rwmixread=100).rw == "randread"
+    assert FioJob(rwmixread=0).rw == "randwrite"
+    assert "--thread" in FioJob(thread=True).args()
+
+
+def test_default_grid() -> None:
+    assert fio_jobs() == [DEFAULT]
+
+
+def test_product(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("FIO_BS", "4K,64K")
+    monkeypatch.setenv("FIO_IODEPTH", "1,64")
+    monkeypatch.setenv("FIO_RUNTIME", "30")
+    jobs = fio_jobs()
+    assert [(j.bs, j.iodepth) for j in jobs] == [("4K", 1), ("4K", 64), ("64K", 1), ("64K", 64)]
+    assert {j.runtime for j in jobs} == {30}
+
+
+def test_axes(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("FIO_SWEEP", "axes")
+    monkeypatch.setenv("FIO_BS", "64K,4K")
+    monkeypatch.setenv("FIO_IODEPTH", "1,64")
+    monkeypatch.setenv("FIO_DIRECT", "0,1")
+    jobs = fio_jobs()
+    # the first value of every dimension is the operating point
+    assert [(j.bs, j.iodepth, j.direct) for j in jobs] == [
+        ("64K", 1, 0),
+        ("4K", 1, 0),
+        ("64K", 64, 0),
+        ("64K", 1, 1),
+    ]
+
+
+def test_invalid_values(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("FIO_IODEPTH", "1,deep")
+    with pytest.raises(RuntimeError, match="FIO_IODEPTH must be a list of int"):
+        fio_jobs()
+    monkeypatch.delenv("FIO_IODEPTH")
+    monkeypatch.setenv("FIO_SWEEP", "random")
+    with pytest.raises(RuntimeError, match="FIO_SWEEP"):
+        fio_jobs()
+
+
+def test_tag_job() -> None:
+    stats = Stats()
+    job = FioJob(bs="64K")
+    tag_job(stats, job)
+    assert stats.tags["fio-job"] == job.name
+    assert stats.tags["fio-bs"] == "64K"
+    assert stats.tags["fio-thread"] is False
@@ -0,0 +1,83 @@
+from typing import Any, Dict, List
+
+from fio_timeseries import (
+    bins_percentile,
+    interval_rows,
+    label_phases,
+    runtime_over,
+    steady_start,
+    steady_summary,
+)
+
+MiB = 2 ** 20
+
+
+def report(second: int, read_mib: int, bins: Dict[str, int] = {}) -> Dict[str, Any]:
+    """Cumulative status report of a single job that only reads"""
+    empty = {"io_bytes": 0, "total_ios": 0}
+    read = {"io_bytes": read_mib * MiB, "total_ios": read_mib * 256, "clat_ns": {"bins": bins}}
+    job = {"elapsed": second, "read": read, "write": empty, "trim": empty}
+    return {"timestamp_ms": 1000 * second, "jobs": [job]}
+
+
+def reports(bandwidth: List[int]) -> List[Dict[str, Any]]:
+    total = 0
+    result = [report(0, 0)]
+    for second, bw in enumerate(bandwidth, start=1):
+        total += bw
+        result.append(report(second, total))
+    return result
+
+
+def test_bins_percentile() -> None:
+    bins = {100: 50, 200: 49, 1000: 1}
+    assert bins_percentile(bins, 50) == 100.0
+    assert bins_percentile(bins, 99) == 200.0
+    assert bins_percentile(bins, 99.9) == 1000.0
+    assert bins_percentile({}, 50) is None
+
+
+def test_interval_rows_are_deltas() -> None:
+    rows = interval_rows(
+        [report(0, 0), report(1, 100, {"1000": 10}), report(3, 300, {"1000": 10, "3000": 30})]
+    )
+    assert [(r["time"], r["bw-mib"], r["iops"]) for r in rows] == [
+        (1.0, 100.0, 25600.0),
+        (3.0, 100.0, 25600.0),
+    ]
+    # only the latencies of the interval count
+    assert rows[1]["clat-p50-us"] == 3.0
+
+
+def test_steady_start() -> None:
+    assert steady_start([10, 50, 100, 102, 98, 101, 99, 100]) == 2
+    assert steady_start([10, 20, 30, 40, 50, 60]) is None
+    assert steady_start([100, 100]) is None
+    assert steady_start([0, 0, 0, 0, 0]) is None
+
+
+def test_label_phases() -> None:
+    rows = interval_rows(reports([10, 50, 100, 102, 98, 101, 99, 100, 60, 55]))
+    steady = label_phases(rows)
+    assert [r["phase"] for r in rows] == ["ramp"] * 2 + ["steady"] * 6 + ["drift"] * 2
+    assert steady == 100.0
+
+
+def test_label_phases_without_steady_state() -> None:
+    rows = interval_rows(reports([10, 20, 40, 80, 160]))
+    assert label_phases(rows) is None
+    assert {r["phase"] for r in rows} == {"ramp"}
+
+
+def test_steady_summary_ignores_ramp_and_drift() -> None:
+    runs = reports([10, 50, 100, 102, 98, 101, 99, 100, 60, 55])
+    rows = interval_rows(runs)
+    label_phases(rows)
+    summary = steady_summary(runs, rows)
+    assert list(summary) == [0]
+    assert summary[0]["steady-read-bw-mib"] == 100.0
+
+
+def test_runtime_over() -> None:
+    assert not runtime_over(report(9, 0), 10)
+    assert runtime_over(report(10, 0), 10)
@@ -0,0 +1,86 @@
+from pathlib import Path
+from typing import Dict
+
+import pytest
+
+import hugepages
+from hugepages import GiB, MiB, HugepagePlan, current_plan, dma_memory, parse_size, plan_hugepages
+
+
+def make_node(root: Path, node: int, memory: int, pages: Dict[int, int] = {}) -> None:
+    path = root.joinpath(f"node{node}")
+    path.mkdir(parents=True)
+    path.joinpath("meminfo").write_text(
+        f"Node {node} MemTotal:       {memory // 1024} kB\nNode {node} MemFree:        0 kB\n"
+    )
+    for size in [2 * MiB, GiB]:
+        sizes = path.joinpath("hugepages", f"hugepages-{size // 1024}kB")
+        sizes.mkdir(parents=True)
+        sizes.joinpath("nr_hugepages").write_text(f"{pages.get(size, 0)}\n")
+        sizes.joinpath("free_hugepages").write_text(f"{pages.get(size, 0)}\n")
+
+
+@pytest.fixture
+def sysfs(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    monkeypatch.setattr(hugepages, "NODE_PATH", str(tmp_path))
+    monkeypatch.delenv("SGXLKL_HEAP", raising=False)
+    monkeypatch.delenv("HUGEPAGE_SIZE", raising=False)
+    return tmp_path
+
+
+def test_parse_size() -> None:
+    assert parse_size("2G") == 2 * GiB
+    assert parse_size("512m") == 512 * MiB
+    assert parse_size("64KB") == 64 * 1024
+    assert parse_size("4096") == 4096
+    with pytest.raises(ValueError):
+        parse_size("2 gigs")
+
+
+def test_dma_memory_grows_with_queues() -> None:
+    assert dma_memory(1) == dma_memory()
+    assert dma_memory(1) >= 6 * GiB
+    # every further queue eventually needs its own rx mempool
+    assert dma_memory(32) - dma_memory(31) == hugepages.DPDK_MBUF_NUM * hugepages.DPDK_MBUF_SIZ
+
+
+def test_plan_rounds_up(sysfs: Path) -> None:
+    make_node(sysfs, 0, 64 * GiB)
+    assert plan_hugepages(GiB + 1, 0, 2 * MiB) == HugepagePlan(0, 2 * MiB, 513)
+    assert plan_hugepages(GiB + 1, 0, GiB) == HugepagePlan(0, GiB, 2)
+
+
+def test_plan_rejects_unsupported_page_size(sysfs: Path) -> None:
+    make_node(sysfs, 0, 64 * GiB)
+    with pytest.raises(RuntimeError, match="does not support"):
+        plan_hugepages(GiB, 0, 4 * MiB)
+
+
+def test_plan_leaves_room_for_the_enclave_heap(
+    sysfs: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    make_node(sysfs, 0, 16 * GiB)
+    assert plan_hugepages(8 * GiB, 0, GiB).pages == 8
+    monkeypatch.setenv("SGXLKL_HEAP", "4G")
+    with pytest.raises(RuntimeError, match="only 6144 MiB are left"):
+        plan_hugepages(8 * GiB, 0, GiB)
+
+
+def test_current_plan_reuses_an_exact_reservation(sysfs: Path) -> None:
+    make_node(sysfs, 0, 64 * GiB, {GiB: 7})
+    make_node(sysfs, 1, 64 * GiB)
+    assert current_plan(7 * GiB, []) == HugepagePlan(0, GiB, 7)
+    assert current_plan(8 * GiB, []) is None
+    assert current_plan(0, []) is None
+
+
+def test_current_plan_ignores_reservations_in_use(sysfs: Path) -> None:
+    make_node(sysfs, 0, 64 * GiB, {GiB: 7})
+    sysfs.joinpath("node0", "hugepages", "hugepages-1048576kB", "free_hugepages").write_text("6\n")
+    assert current_plan(7 * GiB, []) is None
+
+
+def test_current_plan_without_pages(sysfs: Path) -> None:
+    make_node(sysfs, 0, 64 * GiB)
+    assert current_plan(0, []) == HugepagePlan(0, 2 * MiB, 0)
+    assert current_plan(GiB, []) is None
@@ -0,0 +1,112 @@
+import json
+from typing import List, Optional
+
+import pytest
+
+from network import Link, link_changes, network_changes, parse_links
+from privileged import Step
+
+
+def cmds(steps: List[Step]) -> List[str]:
+    return [" ".join(s.cmd) for s in steps]
+
+
+def undos(steps: List[Step]) -> List[Optional[str]]:
+    return [None if s.undo is None else " ".join(s.undo) for s in steps]
+
+
+def test_parse_links() -> None:
+    output = json.dumps(
+        [
+            {
+                "ifname": "tap0",
+                "mtu": 9000,
+                "flags": ["BROADCAST", "UP"],
+                "master": "br0",
+                "linkinfo": {"info_kind": "tun", "info_data": {"user": "bench"}},
+                "addr_info": [
+                    {"local": "10.0.0.1", "prefixlen": 24, "scope": "global"},
+                    {"local": "fe80::1", "prefixlen": 64, "scope": "link"},
+                ],
+            }
+        ]
+    )
+    assert parse_links(output) == {
+        "tap0": Link("tap0", "tun", 9000, True, "br0", {"10.0.0.1/24"}, "bench")
+    }
+
+
+def test_no_changes() -> None:
+    link = Link("tap0", "tun", addrs={"10.0.0.1/24"}, owner="bench")
+    assert link_changes(link, link) == []
+
+
+def test_create_tap() -> None:
+    desired = Link("tap0", "tun", mtu=9000, addrs={"10.0.0.1/24"}, owner="bench")
+    steps = link_changes(None, desired)
+    assert cmds(steps) == [
+        "ip tuntap add dev tap0 mode tap user bench",
+        "ip link set dev tap0 mtu 9000",
+        "ip addr add 10.0.0.1/24 dev tap0",
+        "ip link set dev tap0 up",
+    ]
+    # deleting the link undoes everything else
+    assert undos(steps) == ["ip link del tap0", None, None, None]
+
+
+def test_create_bridge_with_mtu() -> None:
+    steps = link_changes(None, Link("br0", "bridge", mtu=4000))
+    assert cmds(steps) == [
+        "ip link add name br0 mtu 4000 type bridge",
+        "ip link set dev br0 up",
+    ]
+
+
+def test_change_existing_link() -> None:
+    current = Link("eth2", mtu=1500, addrs={"10.0.0.1/24", "10.0.1.1/24"})
+    desired = Link("eth2", mtu=9000, master="br0", addrs={"10.0.0.1/24", "10.0.2.1/24"})
+    steps = link_changes(current, desired)
+    assert cmds(steps) == [
+        "ip link set dev eth2 mtu 9000",
+        "ip link set dev eth2 master br0",
+        "ip addr del 10.0.1.1/24 dev eth2",
+        "ip addr add 10.0.2.1/24 dev eth2",
+    ]
+    assert undos(steps) == [
+        "ip link set dev eth2 mtu 1500",
+        "ip link set dev eth2 nomaster",
+        "ip addr add 10.0.1.1/24 dev eth2",
+        "ip addr del 10.0.2.1/24 dev eth2",
+    ]
+
+
+def test_keep_addresses_when_not_managed() -> None:
+    current = Link("eth2", addrs={"10.0.0.1/24"})
+    assert link_changes(current, Link("eth2", addrs=None)) == []
+
+
+def test_recreate_tap_of_other_user() -> None:
+    current = Link("tap0", "tun", owner="root")
+    steps = link_changes(current, Link("tap0", "tun", owner="bench"))
+    assert cmds(steps)[:2] == ["ip link del tap0", "ip tuntap add dev tap0 mode tap user bench"]
+
+
+def test_missing_nic() -> None:
+    with pytest.raises(RuntimeError, match="eth2 does not exist"):
+        link_changes(None, Link("eth2"))
+
+
+def test_network_changes_order() -> None:
+    current = {
+        "old-br": Link("old-br", "bridge"),
+        "eth2": Link("eth2", master="old-br"),
+    }
+    desired = [Link("br0", "bridge"), Link("eth2", master="br0")]
+    steps = network_changes(current, desired, ["old-br", "missing"])
+    assert cmds(steps) == [
+        "ip link del old-br",
+        "ip link add name br0 mtu 1500 type bridge",
+        "ip link set dev br0 up",
+        # the port lost its master with the old bridge, so no nomaster first
+        "ip link set dev eth2 master br0",
+    ]
@@ -0,0 +1,69 @@
+import subprocess
+from pathlib import Path
+from typing import List
+
+import pytest
+
+from privileged import Batch, BatchError
+
+
+class LocalBatch(Batch):
+    """Runs the script as the current user and records every script"""
+
+    def __init__(self) -> None:
+        super().__init__("test")
+        self.scripts: List[str] = []
+
+    def _execute(self, script: str) -> "subprocess.CompletedProcess[str]":
+        self.scripts.append(script)
+        return subprocess.run(["sh", "-s"], input=script, stdout=subprocess.PIPE, text=True)
+
+
+def test_apply_reports_every_step(tmp_path: Path) -> None:
+    batch = LocalBatch()
+    batch.add(["touch", str(tmp_path.joinpath("a"))])
+    batch.add(["touch", str(tmp_path.joinpath("b"))])
+    timings = batch.apply()
+    assert [cmd[0] for cmd, _ in timings] == ["touch", "touch"]
+    assert all(seconds >= 0 for _, seconds in timings)
+    assert tmp_path.joinpath("b").exists()
+
+
+def test_empty_batch_runs_nothing() -> None:
+    batch = LocalBatch()
+    assert batch.apply() == []
+    assert batch.scripts == []
+
+
+def test_rollback_in_reverse_order(tmp_path: Path) -> None:
+    log = tmp_path.joinpath("log")
+    batch = LocalBatch()
+    for name in ["a", "b"]:
+        path = str(tmp_path.joinpath(name))
+        batch.add(["touch", path], undo=["sh", "-c", f"rm {path} && echo {name} >> {log}"])
+    # cannot be undone, so it is skipped during the rollback
+    batch.add(["true"])
+    batch.add(["false"], undo=["touch", str(tmp_path.joinpath("never"))])
+    batch.add(["touch", str(tmp_path.joinpath("skipped"))])
+
+    with pytest.raises(BatchError, match="step 3 \\(false\\) failed"):
+        batch.apply()
+    assert log.read_text().split() == ["b", "a"]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["log"]
+    assert len(batch.scripts) == 2
+
+
+def test_rollback_continues_after_failed_undo(tmp_path: Path) -> None:
+    batch = LocalBatch()
+    path = str(tmp_path.joinpath("a"))
+    batch.add(["touch", path], undo=["rm", path])
+    batch.add(["true"], undo=["false"])
+    batch.add(["false"])
+    with pytest.raises(BatchError):
+        batch.apply()
+    assert not tmp_path.joinpath("a").exists()
+
+
+def test_script_quotes_arguments() -> None:
+    script = Batch("test").script([["echo", "a b", "$HOME"]])
+    assert "step 0 echo 'a b' '$HOME'" in script
@@ -0,0 +1,159 @@
+import json
+import os
+from pathlib import Path
+from typing import List, Tuple
+
+import pytest
+
+import provisioning
+from provisioning import (
+    Device,
+    Writer,
+    compute_manifest,
+    data_extents,
+    hash_extent,
+    image_manifest,
+    provision,
+    read_device_manifest,
+    write_device_manifest,
+)
+
+EXTENT = 4096
+
+
+def write_image(path: Path, extents: str) -> None:
+    """One character per extent: d(ata), z(eros written out) or h(ole)"""
+    with open(path, "wb") as f:
+        f.truncate(len(extents) * EXTENT)
+        for i, kind in enumerate(extents):
+            f.seek(i * EXTENT)
+            if kind == "d":
+                f.write(bytes([i + 1]) * EXTENT)
+            elif kind == "z":
+                f.write(bytes(EXTENT))
+
+
+@pytest.fixture(autouse=True)
+def manifest_dir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    path = tmp_path.joinpath(".provision")
+    monkeypatch.setattr(provisioning, "MANIFEST_DIR", path)
+    return path
+
+
+def test_hash_extent() -> None:
+    zero = memoryview(bytes(EXTENT))
+    assert hash_extent(memoryview(bytes(100)), zero) is None
+    a = hash_extent(memoryview(b"a" * 100), zero)
+    assert a is not None and len(a) == 32
+    assert a != hash_extent(memoryview(b"b" * 100), zero)
+
+
+def test_compute_manifest(tmp_path: Path) -> None:
+    image = tmp_path.joinpath("image")
+    write_image(image, "dzhd")
+    manifest = compute_manifest(str(image), EXTENT)
+    assert manifest["size"] == 4 * EXTENT
+    assert manifest["extent_size"] == EXTENT
+    hashes = manifest["hashes"]
+    assert [h is None for h in hashes] == [False, True, True, False]
+    assert hashes[0] != hashes[3]
+
+
+def test_compute_manifest_short_last_extent(tmp_path: Path) -> None:
+    image = tmp_path.joinpath("image")
+    image.write_bytes(b"x" * (EXTENT + 10))
+    hashes = compute_manifest(str(image), EXTENT)["hashes"]
+    assert len(hashes) == 2 and None not in hashes
+
+
+def test_image_manifest_is_cached(tmp_path: Path, manifest_dir: Path) -> None:
+    image = tmp_path.joinpath("image")
+    write_image(image, "dd")
+    path = image_manifest(str(image), EXTENT)
+    assert path.parent == manifest_dir
+    # store paths never change, so the image is not hashed again
+    write_image(image, "hh")
+    assert image_manifest(str(image), EXTENT) == path
+    assert None not in json.loads(path.read_text())["hashes"]
+    assert not any(p.suffix == ".tmp" for p in manifest_dir.iterdir())
+
+
+def test_device_manifest() -> None:
+    assert read_device_manifest("/dev/nvme0n1") is None
+    write_device_manifest("/dev/nvme0n1", {"hashes": [None]})
+    assert read_device_manifest("/dev/nvme0n1") == {"hashes": [None]}
+    with open(provisioning.device_manifest("/dev/nvme0n1"), "w") as f:
+        f.write("{")
+    assert read_device_manifest("/dev/nvme0n1") is None
+
+
+def test_data_extents_skip_holes(tmp_path: Path) -> None:
+    image = tmp_path.joinpath("image")
+    write_image(image, "dhhzhd")
+    fd = os.open(image, os.O_RDONLY)
+    try:
+        extents = data_extents(fd, 6 * EXTENT, EXTENT)
+    finally:
+        os.close(fd)
+    # written zeros are data as far as the filesystem is concerned
+    assert extents == {0, 3, 5}
+
+
+def test_provision_writes_changed_extents(tmp_path: Path) -> None:
+    image = tmp_path.joinpath("image")
+    write_image(image, "dhdd")
+    device = tmp_path.joinpath("device")
+    device.write_bytes(image.read_bytes()[: 2 * EXTENT] + b"x" * EXTENT + bytes(2 * EXTENT))
+    manifest = compute_manifest(str(image), EXTENT)
+
+    summary = provision(str(image), str(device), manifest, force=False, discard=False)
+    assert (summary["unchanged"], summary["written"]) == (2, 2)
+    assert summary["bytes_written"] == 2 * EXTENT
+    assert device.read_bytes()[: 4 * EXTENT] == image.read_bytes()
+
+    summary = provision(str(image), str(device), manifest, force=False, discard=False)
+    assert (summary["unchanged"], summary["written"]) == (4, 0)
+
+
+def test_provision_rejects_small_devices(tmp_path: Path) -> None:
+    image = tmp_path.joinpath("image")
+    write_image(image, "dd")
+    device = tmp_path.joinpath("device")
+    device.write_bytes(bytes(EXTENT))
+    manifest = compute_manifest(str(image), EXTENT)
+    with pytest.raises(OSError, match="is smaller than"):
+        provision(str(image), str(device), manifest, force=False, discard=False)
+    manifest["size"] += 1
+    with pytest.raises(ValueError, match="4KiB aligned"):
+        provision(str(image), str(device), manifest, force=False, discard=False)
+
+
+class ZeroingDevice(Device):
+    """Regular files support neither BLKDISCARD nor BLKZEROOUT"""
+
+    def __init__(self, path: str) -> None:
+        super().__init__(path, discard=False)
+        self.zeroed: List[Tuple[int, int]] = []
+
+    def zero(self, offset: int, length: int, buf: memoryview, zero: memoryview) -> bool:
+        self.zeroed.append((offset, length))
+        # O_DIRECT needs the aligned buffer
+        buf[:length] = zero[:length]
+        self.write(offset, buf[:length])
+        return False
+
+
+def test_writer_zeroes_instead_of_writing(tmp_path: Path) -> None:
+    image = tmp_path.joinpath("image")
+    write_image(image, "dh")
+    device = tmp_path.joinpath("device")
+    device.write_bytes(b"x" * 2 * EXTENT)
+    dev = ZeroingDevice(str(device))
+    writer = Writer(str(image), dev, compute_manifest(str(image), EXTENT), force=True)
+    try:
+        assert [writer(i) for i in range(2)] == [("written", EXTENT), ("zeroed", EXTENT)]
+    finally:
+        writer.close()
+        dev.close()
+    assert dev.zeroed == [(EXTENT, EXTENT)]
+    assert device.read_bytes() == image.read_bytes()
@@ -0,0 +1,67 @@
+import socket
+import subprocess
+import sys
+from typing import Iterator, List
+
+import pytest
+
+from readiness import probe_tcp, wait_for_port, wait_until
+
+
+@pytest.fixture
+def server() -> Iterator[subprocess.Popen]:
+    proc = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+    yield proc
+    proc.kill()
+    proc.wait()
+
+
+@pytest.fixture
+def listener() -> Iterator[socket.socket]:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        sock.listen()
+        yield sock
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_probe_tcp(listener: socket.socket) -> None:
+    assert probe_tcp("127.0.0.1", listener.getsockname()[1], 1.0)
+    assert not probe_tcp("127.0.0.1", free_port(), 1.0)
+
+
+def test_probe_tcp_without_tls(listener: socket.socket) -> None:
+    # accepts the connection but never answers the handshake
+    assert not probe_tcp("127.0.0.1", listener.getsockname()[1], 0.2, tls=True)
+
+
+def test_wait_until_backs_off(server: subprocess.Popen) -> None:
+    delays: List[float] = []
+
+    def probe(timeout: float) -> bool:
+        delays.append(timeout)
+        return len(delays) == 4
+
+    assert wait_until(server, probe, "server") >= 0
+    assert delays == [0.01, 0.02, 0.04, 0.08]
+
+
+def test_wait_until_fails_if_the_server_exits() -> None:
+    proc = subprocess.Popen(["true"])
+    with pytest.raises(OSError, match="server exited with 0"):
+        wait_until(proc, lambda timeout: False, "server")
+
+
+def test_wait_until_deadline(server: subprocess.Popen) -> None:
+    with pytest.raises(TimeoutError):
+        wait_until(server, lambda timeout: False, "server", deadline=0.05)
+
+
+def test_wait_for_port(server: subprocess.Popen, listener: socket.socket) -> None:
+    port = listener.getsockname()[1]
+    assert wait_for_port(server, "127.0.0.1", port, "server") < 1.0
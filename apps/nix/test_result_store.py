@@ -0,0 +1,88 @@
+import json
+from pathlib import Path
+
+from result_store import ResultStore, Stats, completed_runs, read_stats, write_stats
+
+
+def test_roundtrip_keeps_types_and_ragged_columns(tmp_path: Path) -> None:
+    path = str(tmp_path.joinpath("bench.jsonl"))
+    stats = Stats()
+    stats.append_rows([{"system": "native", "bw": 1.0}, {"system": "sgx-io", "queues": 2}])
+    write_stats(path, stats)
+
+    read = read_stats(path)
+    assert read["system"] == ["native", "sgx-io"]
+    # json writes 1.0 as 1.0, but the schema keeps it a float either way
+    assert read["bw"] == [1.0, None]
+    assert read["queues"] == [None, 2]
+    assert read.persisted == 2
+
+
+def test_write_appends_only_new_rows(tmp_path: Path) -> None:
+    path = str(tmp_path.joinpath("bench.jsonl"))
+    stats = Stats()
+    stats["system"].append("native")
+    write_stats(path, stats)
+    stats["system"].append("sgx-io")
+    write_stats(path, stats)
+
+    assert read_stats(path)["system"] == ["native", "sgx-io"]
+    # one schema record, two samples
+    assert len(Path(path).read_text().splitlines()) == 3
+
+
+def test_tags_only_apply_to_new_rows(tmp_path: Path) -> None:
+    path = str(tmp_path.joinpath("bench.jsonl"))
+    stats = Stats()
+    stats["system"].append("native")
+    write_stats(path, stats)
+
+    stats = read_stats(path)
+    stats.tags["mtu"] = 9000
+    stats["system"].append("sgx-io")
+    write_stats(path, stats)
+
+    assert read_stats(path)["mtu"] == [None, 9000]
+
+
+def test_legacy_rows_are_imported_without_tags(tmp_path: Path) -> None:
+    tmp_path.joinpath("bench.json").write_text(
+        json.dumps({"system": ["native", "sgx-lkl"], "bw": [1, 2]})
+    )
+    path = str(tmp_path.joinpath("bench.jsonl"))
+    stats = read_stats(path)
+    stats.tags.update({"mtu": 1500, "sysctl-profile": "tuned"})
+    stats["system"].append("sgx-io")
+    stats["bw"].append(3)
+    write_stats(path, stats)
+
+    read = read_stats(path)
+    assert read["system"] == ["native", "sgx-lkl", "sgx-io"]
+    assert read["mtu"] == [None, None, 1500]
+    assert read["sysctl-profile"] == [None, None, "tuned"]
+    # the legacy rows still count as runs with the default values
+    done = completed_runs(read, {"system": None, "mtu": 1500, "sysctl-profile": "legacy"})
+    assert done == {
+        ("native", 1500, "legacy"),
+        ("sgx-lkl", 1500, "legacy"),
+        ("sgx-io", 1500, "tuned"),
+    }
+
+
+def test_legacy_rows_are_written_once(tmp_path: Path) -> None:
+    tmp_path.joinpath("bench.json").write_text(json.dumps({"system": ["native"]}))
+    path = str(tmp_path.joinpath("bench.jsonl"))
+    stats = read_stats(path)
+    write_stats(path, stats)
+    write_stats(path, stats)
+
+    assert read_stats(path)["system"] == ["native"]
+
+
+def test_read_selected_columns(tmp_path: Path) -> None:
+    path = str(tmp_path.joinpath("bench.jsonl"))
+    store = ResultStore(path)
+    store.append([{"system": "native", "bw": 1.5}, {"system": "sgx-io", "lat": 3}])
+
+    assert store.read(["system", "lat"]) == {"system": ["native", "sgx-io"], "lat": [None, 3]}
+    assert store.schema() == {"system": "str", "bw": "float", "lat": "int"}
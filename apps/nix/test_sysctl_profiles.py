@@ -0,0 +1,59 @@
+import gzip
+from pathlib import Path
+
+import pytest
+
+from result_store import Stats
+from sysctl_profiles import (
+    LINUX_DEFAULTS,
+    PROFILES,
+    enclave_sysctls,
+    profile,
+    sysctl_profiles,
+    tag_sysctl,
+)
+
+CC = "net.ipv4.tcp_congestion_control"
+
+
+def test_congestion_control_comes_last() -> None:
+    base = {CC: "cubic", "net.core.rmem_max": "1", "net.core.wmem_max": "2"}
+    p = profile("test", 1, base, {"net.core.rmem_max": "3"})
+    assert p.values == (("net.core.rmem_max", "3"), ("net.core.wmem_max", "2"), (CC, "cubic"))
+    assert p.lkl_value() == f"net.core.rmem_max=3;net.core.wmem_max=2;{CC}=cubic"
+    assert p.tag == "test-v1"
+
+
+def test_profiles_set_the_same_keys() -> None:
+    for p in PROFILES.values():
+        assert sorted(k for k, _ in p.values) == sorted(LINUX_DEFAULTS), p.name
+        assert p.values[-1][0] == CC
+
+
+def test_sysctl_profiles_from_env(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.delenv("SYSCTL_PROFILES", raising=False)
+    assert [p.name for p in sysctl_profiles()] == ["tuned"]
+    monkeypatch.setenv("SYSCTL_PROFILES", "tuned-bbr,linux-default")
+    assert [p.name for p in sysctl_profiles()] == ["tuned-bbr", "linux-default"]
+    monkeypatch.setenv("SYSCTL_PROFILES", "tuned,fast")
+    with pytest.raises(RuntimeError, match="fast"):
+        sysctl_profiles()
+
+
+def test_enclave_sysctls(tmp_path: Path) -> None:
+    log = tmp_path.joinpath("run.log.gz")
+    with gzip.open(log, "wt") as f:
+        f.write("0.1\tstdout\t[   SGX-LKL  ] sysctl net.core.rmem_max = 56623104\n")
+        f.write("0.2\tstderr\tunrelated\n")
+        f.write(f"0.3\tstdout\t[ SGX-LKL ] sysctl {CC} = bbr\n")
+    assert enclave_sysctls(str(log)) == {"net.core.rmem_max": "56623104", CC: "bbr"}
+
+
+def test_tag_sysctl_warns_about_rejected_values(capsys: pytest.CaptureFixture) -> None:
+    stats = Stats()
+    p = PROFILES["tuned-bbr"]
+    effective = dict(p.values)
+    effective[CC] = "cubic"
+    tag_sysctl(stats, p, effective)
+    assert stats.tags == {"sysctl-profile": "tuned-bbr-v1", "sysctl": effective}
+    assert f"{CC} is 'cubic' instead of 'bbr'" in capsys.readouterr().err
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Packets per second with small UDP datagrams, one way (send) and reflected
+by the server (echo). The server (bin/udp-pps from simpleio) runs natively,
+in sgx-lkl over TAP and in sgx-io over DPDK; the client runs on the remote
+host:
+
+    UDP_PPS_SIZES=64,512,1472 UDP_PPS_RATES=0,1000000 python3 udp-pps.py
+
+A rate of 0 sends as fast as the client can. Each run reports the delivered
+Mpps, the fraction of datagrams lost and the tsc cycles the server spent
+per received datagram, which is its cost per packet when it cannot keep up.
+"""
+
+import gzip
+import json
+import os
+import subprocess
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from capture import TaggedParser
+from fingerprint import tag_stats
+from helpers import (
+    NOW,
+    Settings,
+    create_settings,
+    nix_build,
+    nix_build_all,
+    read_stats,
+    spawn,
+    write_stats,
+)
+from network import Network, NetworkKind
+from readiness import wait_until
+from result_store import Stats, completed_runs
+from sysctl_profiles import tag_sysctl
+
+PORT = 5300
+MODES = ["send", "echo"]
+# the server reports a run after this long without traffic, see udp-pps.c
+SERVER_IDLE = 1.0
+
+# mode, payload size, packets per second
+Run = Tuple[str, int, int]
+
+
+def parse_numbers(name: str, default: str) -> List[int]:
+    value = os.environ.get(name, default)
+    try:
+        return [int(v) for v in value.split(",")]
+    except ValueError:
+        raise RuntimeError(f"{name} must be a list of numbers, got {value}")
+
+
+def pps_runs() -> List[Run]:
+    """From UDP_PPS_MODES, UDP_PPS_SIZES and UDP_PPS_RATES"""
+    modes = os.environ.get("UDP_PPS_MODES", ",".join(MODES)).split(",")
+    unknown = [m for m in modes if m not in MODES]
+    if unknown:
+        raise RuntimeError(f"unknown modes {unknown}, choose from {MODES}")
+    sizes = parse_numbers("UDP_PPS_SIZES", "64,128,256,512,1024,1472")
+    if any(s < 16 or s > 1472 for s in sizes):
+        raise RuntimeError(f"UDP_PPS_SIZES must be between 16 and 1472, got {sizes}")
+    rates = parse_numbers("UDP_PPS_RATES", "0")
+    return [(m, s, r) for m in modes for s in sizes for r in rates]
+
+
+def server_results(log: str) -> Dict[int, Dict[str, Any]]:
+    """Per run counters the server printed, from its captured output"""
+    parser = TaggedParser("results")
+    results = {}
+    with gzip.open(log, "rt") as f:
+        for line in f:
+            # <time>\t<stream>\t<line>, see capture.py
+            _, stream, text = line.rstrip("\n").split("\t", 2)
+            if stream != "stdout":
+                continue
+            for sample in parser.feed(text):
+                results[sample["run"]] = sample
+    return results
+
+
+def summarize_run(client: Dict[str, Any], server: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    # nothing is printed for runs where no datagram arrived
+    server = server or dict(received=0, echoed=0, cycles=0, cycle_packets=0)
+    delivered = client["echoed"] if client["mode"] == "echo" else server["received"]
+    seconds = client["seconds"]
+    cycle_packets = server["cycle_packets"]
+    return {
+        "mode": client["mode"],
+        "size": client["size"],
+        "rate": client["rate"],
+        "sent": client["sent"],
+        "send-errors": client["send_errors"],
+        "received": server["received"],
+        "echoed": client["echoed"],
+        "seconds": seconds,
+        "offered-mpps": client["sent"] / seconds / 1e6,
+        "mpps": delivered / seconds / 1e6,
+        "drop-rate": 1 - delivered / client["sent"] if client["sent"] else 1.0,
+        "cycles-per-packet": server["cycles"] / cycle_packets if cycle_packets else None,
+    }
+
+
+class Benchmark:
+    def __init__(self, settings: Settings) -> None:
+        self.settings = settings
+        self.network = Network(settings)
+        self.client = settings.remote_command(nix_build("udp-pps-client"))
+        self.seconds = float(os.environ.get("UDP_PPS_SECONDS", "10"))
+        self.runs: List[Run] = []
+        # read back after the last run
+        self.sysctls: Dict[str, str] = {}
+
+    def probe(self, timeout: float) -> bool:
+        # the client waits a second for the answer itself
+        host = self.settings.local_dpdk_ip
+        try:
+            self.client.run("bin/udp-pps", ["probe", host, str(PORT)])
+            return True
+        except subprocess.CalledProcessError:
+            return False
+
+    def run(
+        self, attr: str, system: str, stats: Stats, extra_env: Dict[str, str] = {}
+    ) -> None:
+        server = nix_build(attr)
+        host = self.settings.local_dpdk_ip
+        log = f"udp-pps-{system}-{NOW}.log.gz"
+        clients = []
+        with spawn(server, "bin/udp-pps", "server", str(PORT), extra_env=extra_env, log=log) as proc:
+            try:
+                wait_until(proc, self.probe, "udp-pps")
+            except TimeoutError:
+                raise OSError(f"Could not reach udp-pps after 1 min")
+            for i, (mode, size, rate) in enumerate(self.runs, start=1):
+                args = [mode, host, str(PORT), str(size), str(rate), str(self.seconds), str(i)]
+                out = self.client.run("bin/udp-pps", args)
+                clients.append(json.loads(out.stdout))
+            time.sleep(SERVER_IDLE * 2)
+        self.sysctls = self.network.effective_sysctls(log)
+
+        servers = server_results(log)
+        for client in clients:
+            row = summarize_run(client, servers.get(client["run"]))
+            stats["system"].append(system)
+            for k, v in row.items():
+                stats[k].append(v)
+            cycles = row["cycles-per-packet"]
+            print(
+                f"[udp-pps-{system}] {row['mode']} {row['size']}B: {row['mpps']:.3f} Mpps, "
+                f"{row['drop-rate'] * 100:.1f}% dropped, "
+                f"{'-' if cycles is None else f'{cycles:.0f}'} cycles/packet"
+            )
+
+
+def benchmark_native(benchmark: Benchmark, stats: Stats) -> None:
+    extra_env = benchmark.network.setup(NetworkKind.NATIVE)
+    benchmark.run("simpleio-native", "native", stats, extra_env=extra_env)
+
+
+def benchmark_sgx_lkl(benchmark: Benchmark, stats: Stats) -> None:
+    extra_env = benchmark.network.setup(NetworkKind.TAP)
+    benchmark.run("simpleio-sgx-lkl", "sgx-lkl", stats, extra_env=extra_env)
+
+
+def benchmark_sgx_io(benchmark: Benchmark, stats: Stats) -> None:
+    extra_env = benchmark.network.setup(NetworkKind.DPDK)
+    benchmark.run("simpleio-sgx-io", "sgx-io", stats, extra_env=extra_env)
+
+
+def main() -> None:
+    stats = read_stats("udp-pps.jsonl")
+    settings = create_settings()
+
+    benchmarks = {
+        "native": benchmark_native,
+        "sgx-lkl": benchmark_sgx_lkl,
+        "sgx-io": benchmark_sgx_io,
+    }
+
+    done = completed_runs(stats, {"system": None, "mode": None, "size": None, "rate": None})
+    runs = {
+        name: [r for r in pps_runs() if (name,) + r not in done] for name in benchmarks
+    }
+    settings.prefetch_remote(["udp-pps-client"])
+    nix_build_all([f"simpleio-{name}" for name, todo in runs.items() if todo])
+    benchmark = Benchmark(settings)
+    for name, benchmark_func in benchmarks.items():
+        if not runs[name]:
+            print(f"skip {name} benchmark")
+            continue
+        benchmark.runs = runs[name]
+        benchmark_func(benchmark, stats)
+        tag_sysctl(stats, benchmark.network.sysctl_profile, benchmark.sysctls)
+        tag_stats(stats, settings)
+        write_stats("udp-pps.jsonl", stats)
+
+    csv = "udp-pps-latest.tsv"
+    print(csv)
+    pd.DataFrame(stats).to_csv(csv, index=False, sep="\t")
+
+
+if __name__ == "__main__":
+    main()
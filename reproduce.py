@@ -62,25 +62,17 @@ def checkout_submodules(nix_shell: str) -> None:
 
 
 def load_default_env() -> Dict[str, str]:
-    sysctl = [
-        "net.core.rmem_max=56623104",
-        "net.core.wmem_max=56623104",
-        "net.core.rmem_default=56623104",
-        "net.core.wmem_default=56623104",
-        "net.core.optmem_max=40960",
-        "net.ipv4.tcp_rmem=4096 87380 56623104",
-        "net.ipv4.tcp_wmem=4096 65536 56623104",
-    ]
+    # SGXLKL_SYSCTL is set per run from apps/nix/sysctl_profiles.py
     default = {
         "SGXLKL_SPDK_HD_KEY": "snakeoil",
         "SGXLKL_KEY": f"{ROOT}/build/config/enclave_debug.key",
         "SGXLKL_DPDK_RX_QUEUES": "1",
+        "SGXLKL_DPDK_TX_QUEUES": "1",
         "SGXLKL_KERNEL_VERBOSE": "1",
         "SGXLKL_VERBOSE": "1",
         "SGXLKL_HEAP": "1G",
         "SGXLKL_X86_ACC": "1",
         "SGXLKL_ETHREADS": "1",
-        "SGXLKL_SYSCTL": ";".join(sysctl),
         # for git checkouts to proceed smoothly
         "HTTP_PROXY": "http://127.0.0.1:7890",
         "HTTPS_PROXY": "http://127.0.0.1:7890",
@@ -227,6 +219,9 @@ def generate_graphs() -> None:
         if not result.exists():
             warn(f"tsv file {result} does not exists! It should have been created during evaluation")
         shutil.copyfile(result, results.joinpath(f))
+    # micro_bench_plots.py prefers the result stores over the tsv exports
+    for store in APPS_PATH.glob("*.jsonl"):
+        shutil.copyfile(store, results.joinpath(store.name))
     graphs = APPS_PATH.joinpath("graphs.py")
     apps_graphs = APPS_PATH.joinpath("apps_graphs.py")
     micro_bench_plots = APPS_PATH.joinpath("micro_bench_plots.py")
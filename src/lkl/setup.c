@@ -857,6 +857,33 @@ void lkl_poststart_net(enclave_config_t* encl, int net_dev_id) {
     }
 }
 
+// Logs the value the kernel ended up with, which differs from the requested
+// one if it was clamped; apps/nix/sysctl_profiles.py parses these lines.
+static void log_sysctl(const char *key) {
+    char path[256], value[256];
+    snprintf(path, sizeof(path), "/proc/sys/%s", key);
+    for (char *p = path + strlen("/proc/sys/"); *p; p++) {
+        if (*p == '.')
+            *p = '/';
+    }
+    int fd = lkl_sys_open(path, LKL_O_RDONLY, 0);
+    if (fd < 0)
+        return;
+    long n = lkl_sys_read(fd, value, sizeof(value) - 1);
+    lkl_sys_close(fd);
+    if (n < 0)
+        return;
+    value[n] = '\0';
+    // multi-value entries such as net.ipv4.tcp_rmem are tab separated
+    for (char *p = value; *p; p++) {
+        if (*p == '\t')
+            *p = ' ';
+        else if (*p == '\n')
+            *p = '\0';
+    }
+    sgxlkl_info("sysctl %s = %s\n", key, value);
+}
+
 static void do_sysctl(enclave_config_t *encl) {
     if (!encl->sysctl)
         return;
@@ -888,6 +915,7 @@ static void do_sysctl(enclave_config_t *encl) {
             sgxlkl_warn("Failed to set sysctl config %s=%s\n", path, val);
             break;
         }
+        log_sysctl(path);
     }
 
     free(sysctl_all);
@@ -1,5 +1,15 @@
 #include "dpdk.h"
 
+#include <errno.h>
+#include <fcntl.h>
+#include <inttypes.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/fsuid.h>
+#include <sys/stat.h>
+#include <unistd.h>
+
 #include <rte_eal.h>
 #include <rte_ethdev.h>
 #include <rte_mempool.h>
@@ -151,7 +161,7 @@ int enable_symmetric_rxhash(int port_id) {
   return r;
 }
 
-int setup_iface(int portid, size_t mtu, size_t rx_queues) {
+int setup_iface(int portid, size_t mtu, size_t rx_queues, size_t tx_queues) {
     int ret = 0;
     struct rte_eth_link link;
     struct rte_eth_dev_info dev_info;
@@ -184,7 +194,19 @@ int setup_iface(int portid, size_t mtu, size_t rx_queues) {
       return -ENOSYS;
     }
 
-    ret = rte_eth_dev_configure(portid, rx_queues, DPDK_NUM_TX_QUEUE, &port_conf);
+    struct rte_eth_conf conf = port_conf;
+    if (mtu > ETHER_MTU) {
+      size_t pkt_len = mtu + ETHER_HDR_LEN + ETHER_CRC_LEN;
+      if (!(dev_info.rx_offload_capa & DEV_RX_OFFLOAD_JUMBO_FRAME) ||
+          pkt_len > dev_info.max_rx_pktlen) {
+        fprintf(stderr, "dpdk: port %d does not support an mtu of %zu\n", portid, mtu);
+        return -ENOSYS;
+      }
+      conf.rxmode.offloads |= DEV_RX_OFFLOAD_JUMBO_FRAME;
+      conf.rxmode.max_rx_pkt_len = pkt_len;
+    }
+
+    ret = rte_eth_dev_configure(portid, rx_queues, tx_queues, &conf);
     if (ret < 0) {
       fprintf(stderr, "dpdk: failed to configure port: %s\n", rte_strerror(-ret));
       return ret;
@@ -230,7 +252,7 @@ int setup_iface(int portid, size_t mtu, size_t rx_queues) {
       }
     }
 
-    for (unsigned i = 0; i < DPDK_NUM_TX_QUEUE; i++) {
+    for (unsigned i = 0; i < tx_queues; i++) {
       ret = rte_eth_tx_queue_setup(portid, i, DPDK_NUMDESC, 0, &dev_info.default_txconf);
       if (ret < 0) {
         fprintf(stderr, "dpdk: failed to setup tx queue %u: %s\n", i, rte_strerror(-ret));
@@ -268,3 +290,71 @@ int setup_iface(int portid, size_t mtu, size_t rx_queues) {
 
     return 0;
 }
+
+// Writes the extended statistics of all ports as json. Besides the port
+// totals, PMDs report per-queue counters here (i.e. rx_q0packets).
+//
+// We run setuid root, but the path comes from the caller: open it with the
+// file system permissions of the calling user and never follow a symlink.
+int dump_stats(size_t port_num, const char *path, uid_t uid) {
+    mode_t old_umask = umask(022);
+    int old_fsgid = setfsgid(getgid());
+    int old_fsuid = setfsuid(uid);
+    int fd = -1;
+    int saved_errno = EPERM;
+    // setfsuid does not report errors, but returns the current value
+    if (setfsuid(uid) == (int)uid && setfsgid(getgid()) == (int)getgid()) {
+        fd = open(path, O_WRONLY | O_CREAT | O_TRUNC | O_NOFOLLOW, 0644);
+        saved_errno = errno;
+    }
+    setfsuid(old_fsuid);
+    setfsgid(old_fsgid);
+    umask(old_umask);
+    if (fd < 0) {
+        fprintf(stderr, "userpci: cannot open %s: %s\n", path, strerror(saved_errno));
+        return -saved_errno;
+    }
+    FILE *f = fdopen(fd, "w");
+    if (!f) {
+        saved_errno = errno;
+        close(fd);
+        fprintf(stderr, "userpci: cannot open %s: %s\n", path, strerror(saved_errno));
+        return -saved_errno;
+    }
+    int ret = 0;
+    fprintf(f, "{\"ports\": [");
+    for (int portid = 0; portid < port_num; portid++) {
+        int n = rte_eth_xstats_get_names(portid, NULL, 0);
+        if (n < 0) {
+            fprintf(stderr, "dpdk: failed to get xstats of port %d: %s\n", portid, rte_strerror(-n));
+            ret = n;
+            break;
+        }
+        struct rte_eth_xstat_name *names = calloc(n, sizeof(*names));
+        struct rte_eth_xstat *values = calloc(n, sizeof(*values));
+        if (!names || !values) {
+            free(names);
+            free(values);
+            ret = -ENOMEM;
+            break;
+        }
+        if (rte_eth_xstats_get_names(portid, names, n) != n ||
+            rte_eth_xstats_get(portid, values, n) != n) {
+            fprintf(stderr, "dpdk: xstats of port %d changed while reading\n", portid);
+            free(names);
+            free(values);
+            ret = -EAGAIN;
+            break;
+        }
+        fprintf(f, "%s{\"port\": %d, \"xstats\": {", portid ? ", " : "", portid);
+        for (int i = 0; i < n; i++) {
+            fprintf(f, "%s\"%s\": %" PRIu64, i ? ", " : "", names[values[i].id].name, values[i].value);
+        }
+        fprintf(f, "}}");
+        free(names);
+        free(values);
+    }
+    fprintf(f, "]}\n");
+    fclose(f);
+    return ret;
+}
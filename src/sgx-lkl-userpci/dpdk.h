@@ -1,6 +1,8 @@
 #ifndef DPDK_USERPCI_DPDK
 #include <stddef.h>
+#include <sys/types.h>
 
-int setup_iface(int portid, size_t mtu, size_t queues);
+int setup_iface(int portid, size_t mtu, size_t rx_queues, size_t tx_queues);
+int dump_stats(size_t port_num, const char *path, uid_t uid);
 #endif DPDK_USERPCI_DPDK
 
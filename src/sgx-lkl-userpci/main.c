@@ -23,8 +23,12 @@ int main(int argc, char **argv) {
     int exitcode = 0;
     char *mtustr = getenv("SGXLKL_DPDK_MTU");
     char *queues_str = getenv("SGXLKL_DPDK_RX_QUEUES");
+    char *tx_queues_str = getenv("SGXLKL_DPDK_TX_QUEUES");
+    // written when the enclave exits, see apps/nix/dpdk_queues.py
+    char *stats_path = getenv("SGXLKL_DPDK_STATS");
     int mtu = 1500;
     size_t rx_queues = 1;
+    size_t tx_queues = 1;
 
     if (mtustr) {
         mtu = atoi(mtustr);
@@ -32,6 +36,9 @@ int main(int argc, char **argv) {
     if (queues_str) {
         rx_queues = atoi(queues_str);
     }
+    if (tx_queues_str) {
+        tx_queues = atoi(tx_queues_str);
+    }
 
     // create files with world-writeable permissions (i.e. in /dev/hugepages)
     umask(0);
@@ -49,10 +56,13 @@ int main(int argc, char **argv) {
     size_t port_num = rte_eth_dev_count_avail();
     for (int portid = 0; portid < port_num; portid++) {
         fprintf(stderr, "userpci: setting up iface %d\n", portid);
-        int r = setup_iface(portid, mtu, rx_queues);
+        int r = setup_iface(portid, mtu, rx_queues, tx_queues);
         if (r < 0) {
             goto error;
         }
+        // hardware counters survive a restart of the port
+        rte_eth_stats_reset(portid);
+        rte_eth_xstats_reset(portid);
     }
 
     fprintf(stderr, "userpci: all ifaces ready.\n");
@@ -68,6 +78,9 @@ int main(int argc, char **argv) {
     // child will eventually close this
     char byte;
     r = read(finished_fd, &byte, 1);
+    if (stats_path) {
+        dump_stats(port_num, stats_path, uid);
+    }
     if (r >= 0) {
       fprintf(stderr, "%s: Got unexpected data result on finished pipe: %d\n", argv[0], r);
       goto error;